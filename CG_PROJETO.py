@@ -1,11 +1,49 @@
 import sys
+import time
+# Referência para medir o arranque, antes dos imports pesados (启动计时起点，在重量级导入之前)
+STARTUP_T0 = time.perf_counter()
 import math
-import random
 import os
+import json
+import mmap
+import hashlib
+import marshal
+import types
+import queue
+import heapq
+import threading
+import collections
+import importlib.util
+import socket
+import ctypes
+import zlib
+import struct
 import numpy as np
 from OpenGL.GL import *
 from OpenGL.GLU import *
 from OpenGL.GLUT import *
+from OpenGL.raw.GL.VERSION.GL_1_0 import glReadPixels as raw_glReadPixels
+
+
+def lazy_import(name):
+    """
+    延迟导入：模块在第一次访问属性时才真正加载。
+    Import preguiçoso: o módulo só é carregado no primeiro acesso a um atributo.
+    """
+    if name in sys.modules:
+        return sys.modules[name]
+    spec = importlib.util.find_spec(name)
+    spec.loader = importlib.util.LazyLoader(spec.loader)
+    module = importlib.util.module_from_spec(spec)
+    sys.modules[name] = module
+    spec.loader.exec_module(module)
+    return module
+
+
+# Só usados pela telemetria, controlo remoto e pools de processos (仅遥测/远程控制/进程池使用)
+asyncio = lazy_import("asyncio")
+futures = lazy_import("concurrent.futures")
+multiprocessing = lazy_import("multiprocessing")
 
 # ============================================================================
 # 1. CONFIGURATION & GLOBAL STATE
@@ -15,19 +53,108 @@ from OpenGL.GLUT import *
 # Mude estes valores (x, y, z, w) para alterar a posição da luz. 修改这些坐标 (x, y, z, w) 可以改变光源位置。
 light0_pos = [0.0, 50.0, 0.0, 1.0]   # Luz Ambiente/Sol (环境光)
 light1_pos = [0.0, 6.0, -20.0, 1.0]  # Luz da Garagem (车库灯)
+moon_pos = [-20.0, 40.0, -20.0, 0.0]  # Luz de noite, direcional (夜间方向光)
+
+# --- State (状态) ---
+# Todo o estado mutável (carro, cena, câmara, input) vive no objeto 'state'.
+# 所有可变状态（车辆、场景、摄像机、输入）都保存在 'state' 对象中。
+# (nome, formato struct, valor inicial) -- (名称, struct 格式, 初始值)
+STATE_LAYOUT = (
+    # --- Car State ---
+    ("car_pos", "3d", (0.0, 0.0, 0.0)),
+    ("car_yaw", "d", 0.0),
+    ("steering_angle", "d", 0.0),
+    ("wheel_rotation", "d", 0.0),
+    ("car_door_open", "?", False),
+    ("car_door_angle", "d", 0.0),
+    ("headlights_on", "?", False),
+    # --- Scene State ---
+    ("garage_door_height", "d", 0.0),
+    # Altura para onde a porta está a ir; -1 = parada (车库门目标高度，-1 表示静止)
+    ("garage_door_target", "d", -1.0),
+    ("is_night", "?", False),
+    # Mantidos pelos eventos das zonas de disparo (由触发区域事件维护)
+    ("car_in_garage", "?", False),
+    ("car_at_garage_door", "?", False),
+    # [REQ 8] A posição da câmara deverá poder ser controlada pelo utilizador.
+    # 0=Orbital, 1=Seguir, 2=Condutor. O utilizador muda com a tecla 'v'. 0=轨道视角, 1=跟随视角, 2=驾驶员视角。用户按 'v' 键切换。
+    # - cam_dist: 修改初始摄像机距离 (Distância inicial da câmera).
+    ("camera_mode", "i", 0),
+    ("cam_yaw", "d", 0.0),
+    ("cam_pitch", "d", 0.2),
+    ("cam_dist", "d", 22.0),
+    # --- Input ---
+    ("mouse_down", "?", False),
+    ("last_mouse_x", "i", 0),
+    ("last_mouse_y", "i", 0),
+)
+
+
+class State:
+    """
+    紧凑的状态对象（__slots__），复制、哈希、序列化与比较都很廉价。
+    Estado compacto (__slots__): copiar, fazer hash, serializar e comparar é barato.
+    """
+    __slots__ = tuple(name for name, fmt, default in STATE_LAYOUT)
+    _struct = struct.Struct("<" + "".join(fmt for name, fmt, default in STATE_LAYOUT))
+
+    def __init__(self, **values):
+        for name, fmt, default in STATE_LAYOUT:
+            value = values.get(name, default)
+            setattr(self, name, list(value) if isinstance(default, tuple) else value)
+
+    def copy(self):
+        new = State.__new__(State)
+        for name in State.__slots__:
+            value = getattr(self, name)
+            setattr(new, name, value[:] if isinstance(value, list) else value)
+        return new
+
+    def astuple(self):
+        return tuple(tuple(v) if isinstance(v, list) else v
+                     for v in (getattr(self, name) for name in State.__slots__))
+
+    @classmethod
+    def fromtuple(cls, values):
+        return cls(**dict(zip(cls.__slots__, values)))
+
+    def to_bytes(self):
+        flat = []
+        for v in self.astuple():
+            if isinstance(v, tuple):
+                flat.extend(v)
+            else:
+                flat.append(v)
+        return State._struct.pack(*flat)
+
+    @classmethod
+    def from_bytes(cls, data):
+        flat = iter(State._struct.unpack(data))
+        return cls(**{name: tuple(next(flat) for _ in range(int(fmt[:-1]))) if len(fmt) > 1 else next(flat)
+                      for name, fmt, default in STATE_LAYOUT})
+
+    def diff(self, other):
+        """
+        返回 other 中与 self 不同的字段。
+        Devolve os campos de 'other' que diferem de self.
+        """
+        return {name: b for name, a, b in zip(State.__slots__, self.astuple(), other.astuple()) if a != b}
+
+    def update(self, changes):
+        for name, value in changes.items():
+            setattr(self, name, list(value) if isinstance(value, tuple) else value)
 
-# --- Car State ---
-car_pos = [0.0, 0.0, 0.0]    
-car_yaw = 0.0                
-steering_angle = 0.0         
-wheel_rotation = 0.0         
-car_door_open = False        
-car_door_angle = 0.0         
-headlights_on = False        
+    def __eq__(self, other):
+        return isinstance(other, State) and self.astuple() == other.astuple()
 
-# --- Scene State ---
-garage_door_height = 0.0     
-is_night = False             
+    def __hash__(self):
+        return hash(self.astuple())
+
+    def __repr__(self):
+        return "State(%s)" % ", ".join("%s=%r" % item for item in zip(State.__slots__, self.astuple()))
+
+
+state = State()
 
 # --- Physics Constants ---
 WHEELBASE = 2.8              
@@ -35,18 +162,8 @@ MAX_STEER = 35.0             # [修改说明]: 改大这个值可以让车转弯
 STEER_SPEED = 3.0            
 MOVE_SPEED = 0.5              # [修改说明]: 改大这个值可以让车跑得更快 (Aumentar para o carro andar mais rápido).
 
-# [REQ 8] A posição da câmara deverá poder ser controlada pelo utilizador.
-# 0=Orbital, 1=Seguir, 2=Condutor. O utilizador muda com a tecla 'v'. 0=轨道视角, 1=跟随视角, 2=驾驶员视角。用户按 'v' 键切换。
-# - cam_dist: 修改初始摄像机距离 (Distância inicial da câmera).
-camera_mode = 0 
-cam_yaw = 0.0
-cam_pitch = 0.2
-cam_dist = 22.0
-
-# --- Input ---
-mouse_down = False
-last_mouse_x = 0
-last_mouse_y = 0
+# --- Camera ---
+camera_eye = (0.0, 0.0, 0.0)   # posição do olho no último frame (上一帧的摄像机位置)
 
 # --- Textures ---
 tex_floor_id = 0
@@ -54,6 +171,223 @@ tex_wall_id = 0
 
 # --- Optimization ---
 floor_display_list = None 
+shared_quadric = None
+
+# --- Geometry Baking (几何烘焙) ---
+# [修改说明]: 设为 False 则每帧重新执行 draw_* 函数 (False = redesenhar em modo imediato a cada frame).
+USE_BAKED_GEOMETRY = True
+BAKE_CACHE_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), ".bake_cache")
+BAKE_FORMAT_VERSION = 1
+
+# --- Scene Description (场景描述) ---
+# [修改说明]: 指向 .json（文本）或 .cgscene（二进制，mmap 加载）场景文件。
+# Ficheiro da cena: .json (texto) ou .cgscene (binário, carregado via mmap).
+SCENE_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), "scene.json")
+scene = None
+
+# --- World Streaming (世界分块流式加载) ---
+# [修改说明]: 设为 True 可让地面和物体按地块在车辆周围动态生成，车可以无限行驶。
+# True = chão e objetos gerados por blocos à volta do carro (mundo infinito).
+STREAM_WORLD = False
+WORLD_TILE_SIZE = 30.0               # tamanho de cada bloco (地块边长)
+WORLD_TILE_STEPS = 12                # quadrados de chão por lado do bloco
+WORLD_LOAD_RADIUS = 4                # raio de carregamento, em blocos (加载半径，单位：地块)
+WORLD_MEMORY_BUDGET = 64 * 1024 * 1024   # bytes (内存预算)
+WORLD_UPLOADS_PER_FRAME = 2          # blocos enviados para a GPU por frame
+WORLD_TREES_PER_TILE = 2.5
+WORLD_ROCKS_PER_TILE = 1.0
+WORLD_CLEARING_RADIUS = 10.0         # sem árvores à volta dos edifícios da cena
+WORLD_SEED = 123
+world = None
+
+# --- Impostors (远景替身) ---
+# [修改说明]: 超过 IMPOSTOR_DISTANCE 的树木、岩石和房屋用面向摄像机的贴图四边形代替。
+# Para lá de IMPOSTOR_DISTANCE, árvores, rochas e casas são desenhadas como quads texturados.
+USE_IMPOSTORS = True
+IMPOSTOR_DISTANCE = 60.0
+IMPOSTOR_ANGLES = 8                  # ângulos capturados por tipo (每种物体的拍摄角度数)
+IMPOSTOR_CELL_SIZE = 128             # píxeis por célula do atlas
+IMPOSTOR_KINDS = ("tree", "rock", "modern_house", "classic_house")
+impostor_atlas = None
+
+# --- Occlusion Culling (遮挡剔除) ---
+# [修改说明]: 使用硬件遮挡查询跳过被房屋挡住的物体 (occlusion queries para objetos escondidos).
+USE_OCCLUSION_QUERIES = True
+OCCLUDER_KINDS = ("garage", "modern_house", "classic_house")
+OCCLUSION_VISIBLE_INTERVAL = 4       # objetos visíveis são re-testados a cada N frames
+occlusion_culler = None
+
+# --- Simulation Thread (模拟线程) ---
+# [修改说明]: 设为 False 则在 GLUT 回调中直接更新状态（单线程）。
+# False = o estado é atualizado diretamente nos callbacks GLUT (uma só thread).
+USE_SIM_THREAD = True
+SIM_RATE = 60.0                      # ticks por segundo (每秒模拟步数)
+SIM_FIELDS = ("car_pos", "car_yaw", "steering_angle", "wheel_rotation", "car_door_open",
+              "car_door_angle", "headlights_on", "garage_door_height", "is_night",
+              "car_in_garage", "car_at_garage_door")
+SIM_INTERPOLATED = ("car_pos", "car_yaw", "wheel_rotation", "car_door_angle", "garage_door_height")
+simulation = None
+
+# --- Frame Capture (帧捕获) ---
+# [修改说明]: 按 'r' 开始/停止录制 (tecla 'r' inicia/termina a gravação).
+CAPTURE_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "captures")
+CAPTURE_FORMAT = "png"               # "png" (sequência) ou "raw" (vídeo rgb24 num só ficheiro)
+CAPTURE_PBO_COUNT = 3                # o frame N é lido enquanto se desenha o N+2
+CAPTURE_WORKERS = max(1, (os.cpu_count() or 2) - 1)
+CAPTURE_MAX_PENDING = 16             # frames à espera de codificação antes de abrandar
+frame_capture = None
+
+# --- Replays & Batch Rendering (回放与批量渲染) ---
+# [修改说明]: 按 'l' 开始/停止记录回放；批量渲染: python CG_PROJETO.py --batch jobs.json
+# Tecla 'l' grava um replay; render em lote: python CG_PROJETO.py --batch jobs.json
+REPLAY_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "replays")
+BATCH_FPS = 30.0
+BATCH_CHUNK = 8                      # frames consecutivos por tarefa (每个任务的连续帧数)
+BATCH_WORKERS = os.cpu_count() or 1
+
+# --- Driving Environment (驾驶环境) ---
+CAR_FOOTPRINT = (-1.1, -2.4, 1.1, 2.2)   # contorno do carro x0, z0, x1, z1 (车身轮廓，局部坐标)
+CAR_HEIGHT = 1.4                     # objetos acima desta altura não colidem (高于此高度不碰撞)
+ENV_MAX_STEPS = 1000
+ENV_CAMERA_MODE = 1                  # câmara das observações renderizadas (渲染观测使用的摄像机)
+headless_context = None
+
+# --- Telemetry (遥测) ---
+# [修改说明]: 设为 True 在本地套接字上广播车辆状态；地址为 (host, port) 或 Unix 套接字路径。
+# True = transmite o estado do carro num socket local: (host, porta) ou caminho de socket Unix.
+USE_TELEMETRY = False
+TELEMETRY_ADDRESS = ("127.0.0.1", 5555)
+TELEMETRY_RATE = 30.0                # amostras por segundo (每秒样本数)
+TELEMETRY_FORMAT = "json"            # "json" (linhas) ou "binary" (TELEMETRY_STRUCT)
+TELEMETRY_MAX_BUFFER = 64 * 1024     # bytes por cliente antes de ser desligado
+telemetry = None
+
+# --- Remote Control (远程控制) ---
+# [修改说明]: 设为 True 接受本地套接字上的批量命令（自动驾驶测试）。
+# True = aceita lotes de comandos num socket local (testes de condução automáticos).
+USE_COMMAND_SERVER = False
+COMMAND_ADDRESS = ("127.0.0.1", 5556)
+command_server = None
+
+# --- GL Resource Tracking (GL 资源跟踪) ---
+# [修改说明]: 设为 True 记录纹理/缓冲区/显示列表/二次曲面的创建与删除。
+# True = regista criação/remoção de texturas, buffers, listas e quádricas (contagens, bytes, origem).
+TRACK_GL_RESOURCES = False
+RESOURCE_REPORT_INTERVAL = 0.0      # segundos entre relatórios; 0 = desligado (报告间隔秒数)
+RESOURCE_LEAK_FRAMES = 0            # >0: AssertionError se os recursos vivos passam o mínimo dos últimos N frames...
+RESOURCE_LEAK_MARGIN = 8            # ...em mais do que isto (tolera cargas pontuais) (超过最近 N 帧最小值的容差)
+gl_resources = None
+
+# --- GL Call Statistics (GL 调用统计) ---
+# [修改说明]: 设为 True 统计每帧、每个 draw_* 函数的 GL 调用/图元/顶点数（有开销，仅用于测量）。
+# True = conta chamadas GL, primitivas e vértices por frame e por draw_* (tem custo; só para medir).
+COUNT_GL_CALLS = False
+gl_stats = None
+
+# --- Startup (启动) ---
+# [修改说明]: 设为 True 时，第一帧不需要的工作（替身图集、服务器）在第一帧显示后才执行。
+# True = o que não é preciso para o primeiro frame (impostores, servidores) corre depois dele.
+FAST_STARTUP = True
+PRINT_STARTUP_REPORT = False    # imprime as fases do arranque (打印启动各阶段耗时)
+
+# --- Particles (粒子) ---
+# [修改说明]: 车辆行驶时的排气烟雾与后轮扬尘。
+# Fumo do escape e pó das rodas traseiras quando o carro anda.
+USE_PARTICLES = True
+PARTICLE_CAPACITY = 32768
+PARTICLE_EXHAUST_RATE = 60.0    # partículas/s por escape (每个排气口每秒粒子数)
+PARTICLE_DUST_RATE = 80.0       # partículas/s por roda à velocidade máxima (最高速时每个车轮)
+particles = None
+
+# --- Tire Tracks (轮胎印) ---
+# [修改说明]: 后轮在地面留下的印记（固定容量，最旧的被覆盖）。
+# Marcas das rodas traseiras no chão (capacidade fixa, as mais antigas são substituídas).
+USE_TIRE_TRACKS = True
+TRACK_CAPACITY = 4096           # quads no anel (环形缓冲区中的四边形数)
+TRACK_SEGMENT = 0.3             # comprimento de cada marca (每段印记长度)
+TRACK_WIDTH = 0.3
+tire_tracks = None
+
+# --- Secondary Views (次级视图) ---
+# [修改说明]: 后视镜与画中画小地图渲染到离屏纹理；每个视图有自己的分辨率、更新间隔（帧）和 LOD 偏置。
+# Espelho e mapa picture-in-picture renderizados para texturas; cada vista tem resolução,
+# intervalo de atualização (frames) e viés de LOD (lod_bias x IMPOSTOR_DISTANCE) próprios.
+# A tecla 'm' mostra/esconde o mapa. 按 'm' 显示/隐藏小地图。
+USE_SECONDARY_VIEWS = True
+SECONDARY_VIEWS = {
+    "mirror": dict(size=(200, 100), interval=2, lod_bias=0.5, fov=35.0, far=120.0, car=False),
+    "map": dict(size=(256, 256), interval=4, extent=40.0, far=200.0, enabled=False),
+}
+VIEW_REUSE_DISTANCE = 15.0      # reutiliza a oclusão principal com o olho a menos disto (眼睛距离小于此值时复用遮挡结果)
+MAP_OVERLAY_SIZE = 200          # pixels
+secondary_views = None
+active_view = None              # vista a ser desenhada (None = principal) / 当前绘制的视图
+
+# --- Trigger Zones (触发区域) ---
+# [修改说明]: 车库内部与门前区域由场景生成；AUTO_GARAGE_DOOR=True 时车靠近门就自动开门。
+# Zonas com nome (interior e frente de cada garagem) com eventos de entrada/saída.
+# Com AUTO_GARAGE_DOOR=True a porta abre sozinha quando o carro se aproxima.
+TRIGGER_CELL_SIZE = 16.0
+GARAGE_APRON_DEPTH = 10.0       # profundidade da zona em frente à porta (门前区域深度)
+AUTO_GARAGE_DOOR = False
+triggers = None
+
+# --- Camera Collision (摄像机碰撞) ---
+# [修改说明]: 轨道/跟随摄像机被墙壁或房屋挡住时会平滑地拉近车辆。
+# A câmara orbital/de seguir aproxima-se suavemente do carro quando uma parede ou casa a tapa.
+USE_CAMERA_COLLISION = True
+CAMERA_RADIUS = 0.4             # folga entre a câmara e a geometria (摄像机与几何体的间隔)
+CAMERA_MIN_DISTANCE = 1.5
+CAMERA_PULL_IN_TIME = 0.06      # s, suavização ao aproximar (拉近的平滑时间)
+CAMERA_RELEASE_TIME = 0.35      # s, suavização ao afastar (回退的平滑时间)
+camera_collider = None
+
+# --- Navigation (导航) ---
+# [修改说明]: 按 'p' 开关自动驾驶：车辆沿预先计算的流场开进车库（门关着时在门前等待）。
+# Tecla 'p': piloto automático até à garagem pelo campo de fluxo (espera à porta se estiver fechada).
+NAV_CELL = 0.5                  # tamanho da célula da grelha (网格大小)
+NAV_MARGIN = 12.0               # margem da grelha à volta dos obstáculos (网格在障碍物外的边距)
+NAV_CLEARANCE = 1.2             # obstáculos alargados pela meia largura do carro (按半车宽膨胀)
+NAV_DRIVEWAY_GAP = 4.0          # distância da frente da casa à entrada (房屋前方车道的距离)
+NAV_WALL_RANGE = 3.0            # células a menos disto de uma parede custam mais (靠近墙的格子代价更高)
+NAV_WALL_COST = 2.0             # custo extra junto à parede: o caminho passa pelo meio das aberturas
+NAV_CLEARANCE_COST = 12.0       # custo da faixa alargada: só se entra nela para sair de lá (膨胀带代价)
+NAV_STEER_GAIN = 1.5
+AUTOPILOT_DESTINATION = "garage"
+AUTOPILOT_SPEED = 6.0           # unidades/s
+AUTOPILOT_BACKOFF = 0.5         # s de marcha-atrás depois de um passo bloqueado (被挡住后倒车的秒数)
+navigation = None
+autopilot = False
+autopilot_backoff = 0.0         # marcha-atrás restante (剩余倒车时间)
+
+# --- Shadows (阴影) ---
+# [修改说明]: 太阳 (GL_LIGHT0) 与车库灯 (GL_LIGHT1) 的阴影。静态物体的深度图缓存，只在灯光或场景变化时
+# 重画（昼夜切换、车库门移动、区域中心移动）；汽车每帧只画进一张小的动态深度图，两者在屏幕空间合成。
+# Sombras do sol e da luz da garagem: mapa estático em cache (redesenhado só quando a luz ou
+# a cena mudam) + mapa pequeno só do carro a cada frame, compostos num pass de ecrã.
+# extent: meia largura da região do mapa estático; snap: a região segue o carro em passos de 'snap'.
+USE_SHADOWS = True
+SHADOW_LIGHTS = {
+    "sun": dict(static_size=2048, dynamic_size=512, extent=60.0, snap=20.0, strength=0.45, night_strength=0.25),
+    "lamp": dict(static_size=512, dynamic_size=256, extent=8.0, near=1.5, strength=0.5),
+}
+SHADOW_CAR_RADIUS = 3.2             # esfera envolvente do carro para o mapa dinâmico (汽车包围球)
+SHADOW_POLYGON_OFFSET = (2.0, 4.0)  # contra "shadow acne" (防止阴影粉刺)
+shadows = None
+
+# --- Animation (动画) ---
+# [修改说明]: 门按关键帧轨道运动（时间, 数值）；改变时间即可改变动画速度。
+# Trilhas de keyframes (tempo em s, valor) das portas; devem ser crescentes.
+# 'g'/'f' e a porta automática tocam "garage_door"; 'o' toca "car_door".
+ANIMATION_TRACKS = {
+    "garage_door": ((0.0, 0.0), (0.25, 0.2), (0.5, 0.8), (1.5, 4.2), (1.75, 4.8), (2.0, 5.0)),
+    "car_door": ((0.0, 0.0), (0.15, 20.0), (0.3, 48.0), (0.45, 60.0)),
+}
+GARAGE_SLATS = 10               # ripas da porta da garagem (车库门板条数)
+animation = None
+
+# --- Garage Geometry ---
+GARAGE_DIMS = (8.0, 5.0, 10.0, 0.5)   # largura, altura, profundidade, espessura do telhado (宽, 高, 深, 屋顶厚度)
 
 # ============================================================================
 # 2. TEXTURE GENERATION
@@ -64,15 +398,10 @@ def generate_mosaic_texture(width=128, height=128):
     生成地面马赛克纹理.
     Gera textura de mosaico para o chão.
     """
-    image = np.zeros((height, width, 3), dtype=np.uint8)
-    for y in range(height):
-        for x in range(width):
-            noise = random.randint(0, 40)
-            if (x // 8 + y // 8) % 2 == 0:
-                image[y, x] = [90+noise, 80+noise, 70+noise]
-            else:
-                image[y, x] = [70+noise, 60+noise, 50+noise]
-    return image.tobytes()
+    y, x = np.mgrid[0:height, 0:width]
+    noise = np.random.randint(0, 41, (height, width, 1))
+    image = np.where(((x // 8 + y // 8) % 2 == 0)[..., None], [90, 80, 70], [70, 60, 50]) + noise
+    return image.astype(np.uint8).tobytes()
 
 
 def generate_brick_texture(width=64, height=64):
@@ -80,17 +409,30 @@ def generate_brick_texture(width=64, height=64):
     生成墙壁砖块纹理。
     Gera textura de tijolos para as paredes.
     """
-    image = np.zeros((height, width, 3), dtype=np.uint8)
-    for y in range(height):
-        for x in range(width):
-            shift = 0 if (y//8)%2==0 else 4
-            if ((x+shift)//16)%2==0:
-                image[y,x]=[120,60,40] 
-            else:
-                image[y,x]=[100,50,30] 
-            if y%8==0 or (x+shift)%16==0:
-                image[y,x]=[150,150,150]
-    return image.tobytes()
+    y, x = np.mgrid[0:height, 0:width]
+    shift = np.where((y // 8) % 2 == 0, 0, 4)
+    image = np.where((((x + shift) // 16) % 2 == 0)[..., None], [120, 60, 40], [100, 50, 30])
+    image[(y % 8 == 0) | ((x + shift) % 16 == 0)] = [150, 150, 150]
+    return image.astype(np.uint8).tobytes()
+
+
+def load_texture(generator, width, height):
+    """
+    从 BAKE_CACHE_DIR 读取程序纹理；缓存不存在时生成并保存（键为生成函数的代码摘要）。
+    Lê a textura procedural de BAKE_CACHE_DIR; se não existir, gera-a e grava-a
+    (a chave é o resumo do código do gerador).
+    """
+    path = os.path.join(BAKE_CACHE_DIR, "texture-%s-%s-%dx%d.cgb" % (
+        generator.__name__, _source_digest(generator)[:20], width, height))
+    loaded = load_blob(path)
+    if loaded is not None:
+        return loaded[0]["pixels"]
+    pixels = np.frombuffer(generator(width, height), np.uint8).reshape(height, width, 3)
+    try:
+        save_blob(path, {"pixels": pixels}, {})
+    except OSError:
+        pass
+    return pixels
 
 
 def init_resources():
@@ -98,32 +440,14 @@ def init_resources():
     初始化OpenGL纹理资源。
     Inicializa recursos de textura OpenGL.
     """
-
-    glClearColor(0.6, 0.8, 1.0, 1.0)
-    glEnable(GL_DEPTH_TEST)
-    glDisable(GL_CULL_FACE)
-    glEnable(GL_COLOR_MATERIAL)
-    glColorMaterial(GL_FRONT_AND_BACK, GL_AMBIENT_AND_DIFFUSE)
-    glEnable(GL_NORMALIZE)
-    glShadeModel(GL_SMOOTH)
-    glEnable(GL_LIGHTING)
-    glEnable(GL_LIGHT0)
-    
-    glEnable(GL_LIGHT1)
-    
-    glLightfv(GL_LIGHT1, GL_DIFFUSE, [1.0, 1.0, 1.0, 1.0])
-    glLightfv(GL_LIGHT2, GL_DIFFUSE, [1.0, 1.0, 0.8, 1.0])
-    glLightfv(GL_LIGHT3, GL_DIFFUSE, [1.0, 1.0, 0.8, 1.0])
-
-
-
     global tex_floor_id, tex_wall_id
     glPixelStorei(GL_UNPACK_ALIGNMENT, 1)
     
     # Floor Texture
     tex_floor_id = glGenTextures(1)
     glBindTexture(GL_TEXTURE_2D, tex_floor_id)
-    glTexImage2D(GL_TEXTURE_2D, 0, GL_RGB, 128, 128, 0, GL_RGB, GL_UNSIGNED_BYTE, generate_mosaic_texture())
+    glTexImage2D(GL_TEXTURE_2D, 0, GL_RGB, 128, 128, 0, GL_RGB, GL_UNSIGNED_BYTE,
+                 np.ascontiguousarray(load_texture(generate_mosaic_texture, 128, 128)))
     glTexParameteri(GL_TEXTURE_2D, GL_TEXTURE_MIN_FILTER, GL_LINEAR)
     glTexParameteri(GL_TEXTURE_2D, GL_TEXTURE_MAG_FILTER, GL_LINEAR)
     glTexParameteri(GL_TEXTURE_2D, GL_TEXTURE_WRAP_S, GL_REPEAT)
@@ -132,7 +456,8 @@ def init_resources():
     # Wall Texture
     tex_wall_id = glGenTextures(1)
     glBindTexture(GL_TEXTURE_2D, tex_wall_id)
-    glTexImage2D(GL_TEXTURE_2D, 0, GL_RGB, 64, 64, 0, GL_RGB, GL_UNSIGNED_BYTE, generate_brick_texture())
+    glTexImage2D(GL_TEXTURE_2D, 0, GL_RGB, 64, 64, 0, GL_RGB, GL_UNSIGNED_BYTE,
+                 np.ascontiguousarray(load_texture(generate_brick_texture, 64, 64)))
     glTexParameteri(GL_TEXTURE_2D, GL_TEXTURE_MIN_FILTER, GL_NEAREST)
     glTexParameteri(GL_TEXTURE_2D, GL_TEXTURE_MAG_FILTER, GL_NEAREST)
 
@@ -140,6 +465,9 @@ def init_resources():
 # 3. MATERIALS
 # ============================================================================
 
+# Substitui todos os materiais do objeto atual (场景文件中的材质覆盖); None = sem substituição.
+material_override = None
+
 # [REQ 7] Deverá haver pelo menos 5 materiais diferentes.
 # cor do carro, altere glColor3f em 'car_paint_metal'. 车身颜色，修改 'car_paint_metal' 下面的 glColor3f 数值。
 def set_material(mat_type):
@@ -147,6 +475,9 @@ def set_material(mat_type):
     定义材质属性（颜色、反光度）。
     Define propriedades do material (cor, reflexo, brilho).
     """
+    if material_override is not None:
+        mat_type = material_override
+
     glColorMaterial(GL_FRONT_AND_BACK, GL_AMBIENT_AND_DIFFUSE)
     glMaterialfv(GL_FRONT, GL_EMISSION, [0.0, 0.0, 0.0, 1.0]) 
 
@@ -248,13 +579,13 @@ def update_car_lights():
     更新车灯位置与方向（聚光灯），防止穿模并确保只照亮前方。
     Atualiza a posição e direção dos faróis (spotlights), evitando atravessar objetos.
     """
-    if headlights_on:
+    if state.headlights_on:
         glEnable(GL_LIGHT2)
         glEnable(GL_LIGHT3)
         
         glPushMatrix()
-        glTranslatef(car_pos[0], 0.35, car_pos[2])
-        glRotatef(math.degrees(car_yaw), 0, 1, 0)
+        glTranslatef(state.car_pos[0], 0.35, state.car_pos[2])
+        glRotatef(math.degrees(state.car_yaw), 0, 1, 0)
         
         spot_dir = [0.0, -0.2, -1.0] 
         spot_cutoff = 35.0           
@@ -292,64 +623,84 @@ def update_car_lights():
 
 # [REQ 9] Deverá haver um chão texturado por repetição.
 # Mude "x1/2.0" para "x1/1.0" ou "x1/5.0" para alterar a frequência da repetição. 修改 glTexCoord2f 中的除数（比如把2.0改成1.0或5.0）来改变地板纹理的重复密度。
+def draw_floor_geometry():
+    """ 
+    绘制地面几何体（供显示列表与烘焙使用）。
+    Emite a geometria do chão (usada pela display list e pelo baking).
+    """
+    glEnable(GL_TEXTURE_2D)
+    glBindTexture(GL_TEXTURE_2D, tex_floor_id)
+    set_material("stone")
+    
+    size = 150.0
+    steps = 120 
+    step_size = (size * 2) / steps
+    
+    glNormal3f(0, 1, 0) 
+    for i in range(steps):
+        for j in range(steps):
+            x1 = -size + i * step_size
+            z1 = -size + j * step_size
+            x2 = x1 + step_size
+            z2 = z1 + step_size
+            
+            # --- Mapeamento de Textura (Texture Mapping) ---
+            glBegin(GL_QUADS)
+            glTexCoord2f(x1/2.0, z1/2.0); glVertex3f(x1, 0, z1)
+            glTexCoord2f(x2/2.0, z1/2.0); glVertex3f(x2, 0, z1)
+            glTexCoord2f(x2/2.0, z2/2.0); glVertex3f(x2, 0, z2)
+            glTexCoord2f(x1/2.0, z2/2.0); glVertex3f(x1, 0, z2)
+            glEnd()
+    
+    glDisable(GL_TEXTURE_2D)
+
+
 def draw_mosaic_floor():
     """ 
-    绘制高精度马赛克地面（使用显示列表优化）。
+    绘制高精度马赛克地面（使用烘焙网格或显示列表优化）。
     Desenha o chão de mosaico de alta precisão.
     """
     global floor_display_list
 
     glDisable(GL_LIGHT1) 
     
-    glEnable(GL_TEXTURE_2D)
-    glBindTexture(GL_TEXTURE_2D, tex_floor_id)
-    set_material("stone")
+    if USE_BAKED_GEOMETRY:
+        draw_cached(draw_floor_geometry)
+        return
     
     if floor_display_list is None:
         floor_display_list = glGenLists(1)
         glNewList(floor_display_list, GL_COMPILE)
-        
-        size = 150.0
-        steps = 120 
-        step_size = (size * 2) / steps
-        
-        glNormal3f(0, 1, 0) 
-        for i in range(steps):
-            for j in range(steps):
-                x1 = -size + i * step_size
-                z1 = -size + j * step_size
-                x2 = x1 + step_size
-                z2 = z1 + step_size
-                
-                # --- Mapeamento de Textura (Texture Mapping) ---
-                glBegin(GL_QUADS)
-                glTexCoord2f(x1/2.0, z1/2.0); glVertex3f(x1, 0, z1)
-                glTexCoord2f(x2/2.0, z1/2.0); glVertex3f(x2, 0, z1)
-                glTexCoord2f(x2/2.0, z2/2.0); glVertex3f(x2, 0, z2)
-                glTexCoord2f(x1/2.0, z2/2.0); glVertex3f(x1, 0, z2)
-                glEnd()
-        
+        draw_floor_geometry()
         glEndList()
     
     glCallList(floor_display_list)
-    glDisable(GL_TEXTURE_2D)
 
 
-def draw_tree(x, z):
+def get_quadric():
+    """
+    共享的 GLU 二次曲面（只创建一次）。
+    Quádrica GLU partilhada (criada uma só vez).
+    """
+    global shared_quadric
+    if shared_quadric is None:
+        shared_quadric = gluNewQuadric()
+    return shared_quadric
+
+
+def draw_tree():
     """ 
-    绘制树木。
-    Desenha uma árvore. 
+    绘制树木（局部坐标，原点为树根）。
+    Desenha uma árvore (coordenadas locais, origem na base). 
     """
     glDisable(GL_LIGHT1)
 
     glPushMatrix()
-    glTranslatef(x, 0, z)
     set_material("wood")
     
     glPushMatrix()
     glRotatef(-90, 1, 0, 0)
-    quadric = gluNewQuadric()
-    gluCylinder(quadric, 0.4, 0.4, 1.5, 10, 1)
+    gluCylinder(get_quadric(), 0.4, 0.4, 1.5, 10, 1)
     glPopMatrix()
     
     set_material("stone")
@@ -365,36 +716,26 @@ def draw_tree(x, z):
     glPopMatrix()
 
 
-def draw_rock(x, z):
+def draw_rock():
     """ 
-    绘制岩石。
-    Desenha uma rocha. 
+    绘制岩石（局部坐标，位置与旋转由场景实例提供）。
+    Desenha uma rocha (coordenadas locais; posição e rotação vêm da instância da cena). 
     """
     glDisable(GL_LIGHT1)
 
     glPushMatrix()
-    glTranslatef(x, 0.5, z)
-    glRotatef(x * 10, 0, 1, 0)
-    glRotatef(z * 10, 1, 0, 0)
     set_material("stone")
     glScalef(1.2, 0.8, 1.2)
     glutSolidDodecahedron()
     glPopMatrix()
 
 
-# [REQ 5] Garagem com porta que abre por interacção.
-# A animação depende de 'garage_door_height'.
-# 车库门动画依赖于 'garage_door_height' 变量。
-def draw_garage():
+def draw_garage_shell():
     """
-    绘制车库，包含智能光照遮挡逻辑（防止光线穿墙）。
-    Desenha a garagem com lógica inteligente de iluminação (evita vazamento de luz).
+    绘制车库外墙（静态几何）。
+    Desenha as paredes exteriores da garagem (geometria estática).
     """
-    w, h, d, th = 8.0, 5.0, 10.0, 0.5
-    garage_front_z = -10.0
-    
-    glEnable(GL_CULL_FACE)
-    glCullFace(GL_BACK) 
+    w, h, d, th = GARAGE_DIMS
 
     # 1. Outer Walls (Always Lit)
     glDisable(GL_LIGHT1)
@@ -425,6 +766,14 @@ def draw_garage():
     
     glDisable(GL_TEXTURE_2D)
 
+
+def draw_garage_floor():
+    """
+    绘制车库地板（由车库灯照亮）。
+    Desenha o chão da garagem (iluminado pela luz da garagem).
+    """
+    w, h, d, th = GARAGE_DIMS
+
     glEnable(GL_LIGHT1)
 
     #Chao da garagem
@@ -441,18 +790,14 @@ def draw_garage():
     glEnd()
     glDisable(GL_TEXTURE_2D)
 
-    # 2. Inner Walls
+
+def draw_garage_interior():
+    """
+    绘制车库内墙。
+    Desenha as paredes interiores da garagem.
+    """
+    w, h, d, th = GARAGE_DIMS
     set_material("garage_inner_wall")
-    
-    is_car_inside = (-26 < car_pos[2] < -14) and (-5 < car_pos[0] < 5)
-    is_car_in_front_of_garage = (car_pos[2] > garage_front_z) and (-10 < car_pos[0] < 10)
-    is_door_open = (garage_door_height > 1.0) 
-    
-    can_light_reach_inside = is_car_inside or (is_car_in_front_of_garage and is_door_open)
-    
-    if not can_light_reach_inside:
-        glDisable(GL_LIGHT2) # Left Headlight
-        glDisable(GL_LIGHT3) # Right Headlight 
 
     glBegin(GL_QUADS)
     # Back Inside
@@ -463,22 +808,26 @@ def draw_garage():
     glNormal3f(-1,0,0); glVertex3f(w/2, 0, -d); glVertex3f(w/2, 0, 0); glVertex3f(w/2, h, 0); glVertex3f(w/2, h, -d)
     glEnd()
 
-    if not can_light_reach_inside and headlights_on:
-        glEnable(GL_LIGHT2)
-        glEnable(GL_LIGHT3)
 
-    #Lampada da garagem
+def draw_garage_lamp():
+    """
+    绘制车库灯泡。
+    Desenha a lâmpada da garagem.
+    """
+    w, h, d, th = GARAGE_DIMS
     glPushMatrix()
     glTranslatef(0, h - 0.5, -d/2) # 相对坐标 Z = -5.0
     set_material("light_bulb_on")
     glutSolidSphere(0.3, 16, 16)   
     glPopMatrix()
 
-    glDisable(GL_LIGHT1)
-
-    glDisable(GL_CULL_FACE)
 
-    # Roof & Door 屋顶和门
+def draw_garage_roof():
+    """
+    绘制车库屋顶。
+    Desenha o telhado da garagem.
+    """
+    w, h, d, th = GARAGE_DIMS
     glPushMatrix()
     glTranslatef(0, h, -d/2)
     glScalef(w+1, th, d+1)
@@ -486,33 +835,93 @@ def draw_garage():
     glColor3f(0.3,0.3,0.3)
     glutSolidCube(1.0)
     glPopMatrix()
-    
 
-    # [REQ5: Porta da garagem abrir / 车库门打开]
-    # garage_door_height controla a altura. 控制开启高度
+
+def draw_garage_slats(count):
+    """
+    车库门最下面的 count 块板条（门底在原点，由动画矩阵抬起）。
+    As 'count' ripas de baixo da porta da garagem (base da porta na origem; a matriz da animação levanta-a).
+    """
+    w, h, d, th = GARAGE_DIMS
     set_material("garage_metal")
-    num_slats = 10
-    slat_h = h / num_slats 
+    slat_h = h / GARAGE_SLATS
+    for i in range(count):
+        glPushMatrix()
+        glTranslatef(0, i * slat_h + slat_h/2, 0)
+        glScalef(w-0.4, slat_h * 1.02, 0.1)
+        glutSolidCube(1.0)
+        glPopMatrix()
+
+
+# [REQ 5] Garagem com porta que abre por interacção.
+# A animação depende de 'garage_door_height'.
+# 车库门动画依赖于 'garage_door_height' 变量。
+def draw_garage_door():
+    """
+    绘制车库卷帘门（动态）。
+    Desenha a porta de enrolar da garagem (dinâmica).
+    """
+    # [REQ5: Porta da garagem abrir / 车库门打开]
+    # garage_door_height controla a altura (matriz "garage_door" da paleta). 控制开启高度
+    # As ripas que sobem acima do vão deixam de ser desenhadas. 超出门洞的板条不再绘制
+    # A paleta é calculada uma vez por frame em render_frame (调色板每帧在 render_frame 中计算一次)
+    palette = get_animation()
+    palette.draw("garage_door", draw_garage_slats, palette.garage_slats)
+
+
+def draw_garage():
+    """
+    绘制车库，包含智能光照遮挡逻辑（防止光线穿墙）。
+    Desenha a garagem com lógica inteligente de iluminação (evita vazamento de luz).
+    """
+    glEnable(GL_CULL_FACE)
+    glCullFace(GL_BACK) 
+
+    draw_cached(draw_garage_shell)
+
+    # Interior só é desenhado se for visível pela porta (只有通过门洞可见时才画车库内部)
+    if not garage_interior_visible():
+        glDisable(GL_LIGHT1)
+        glDisable(GL_CULL_FACE)
+        draw_cached(draw_garage_roof)
+        draw_garage_door()
+        return
+
+    draw_cached(draw_garage_floor)
+
+    # 2. Inner Walls
+    is_door_open = (state.garage_door_height > 1.0) 
     
-    for i in range(num_slats):
-        base_y_pos = i * slat_h
-        current_y = base_y_pos + garage_door_height
-        
-        if current_y < h:
-            glPushMatrix()
-            glTranslatef(0, current_y + slat_h/2, 0)
-            glScalef(w-0.4, slat_h * 1.02, 0.1)
-            glutSolidCube(1.0)
-            glPopMatrix()
+    can_light_reach_inside = state.car_in_garage or (state.car_at_garage_door and is_door_open)
+    
+    if not can_light_reach_inside:
+        glDisable(GL_LIGHT2) # Left Headlight
+        glDisable(GL_LIGHT3) # Right Headlight 
+
+    draw_cached(draw_garage_interior)
+
+    if not can_light_reach_inside and state.headlights_on:
+        glEnable(GL_LIGHT2)
+        glEnable(GL_LIGHT3)
+
+    #Lampada da garagem
+    draw_cached(draw_garage_lamp)
+
+    glDisable(GL_LIGHT1)
+
+    glDisable(GL_CULL_FACE)
+
+    # Roof & Door 屋顶和门
+    draw_cached(draw_garage_roof)
+    draw_garage_door()
 
 
-def draw_modern_house(x, z):
+def draw_modern_house():
     """ 
-    绘制现代风格房屋。
-    Desenha a casa moderna. 
+    绘制现代风格房屋（局部坐标）。
+    Desenha a casa moderna (coordenadas locais). 
     """
     glPushMatrix()
-    glTranslatef(x, 0, z)
     set_material("house_wall_white")
     
     glPushMatrix()
@@ -549,13 +958,12 @@ def draw_modern_house(x, z):
     glPopMatrix()
 
 
-def draw_classic_house(x, z):
+def draw_classic_house():
     """ 
-    绘制经典风格房屋。
-    Desenha a casa clássica. 
+    绘制经典风格房屋（局部坐标）。
+    Desenha a casa clássica (coordenadas locais). 
     """
     glPushMatrix()
-    glTranslatef(x, 0, z)
     w, h, d = 5.0, 3.0, 4.0
     set_material("house_wall_brick")
     
@@ -610,7 +1018,7 @@ def draw_wheel(radius, width):
     绘制车轮。
     Desenha a roda. 
     """
-    quadric = gluNewQuadric()
+    quadric = get_quadric()
     glPushMatrix()
     glTranslatef(0, 0, -width/2)
     set_material("rubber")
@@ -631,7 +1039,6 @@ def draw_wheel(radius, width):
     glPopMatrix()
     
     glPopMatrix()
-    gluDeleteQuadric(quadric)
 
 
 # [REQ 3] O veículo terá um volante que poderá rodar.
@@ -686,48 +1093,196 @@ def draw_seat():
     glPopMatrix()
 
 
+class ProfileMesh:
+    """
+    带索引的三角网格。points/faces 是共享位置的封闭拓扑；positions/normals/indices
+    是绘制用的顶点（只在需要分开法线处复制，位置取自 points）。
+    Malha indexada de triângulos. points/faces são a topologia com posições
+    partilhadas; positions/normals/indices são os vértices de desenho (duplicados
+    só onde as normais se separam, com as posições copiadas de points).
+    Os índices a partir de seam são o segmento que fecha o contorno (闭合段).
+    """
+
+    def __init__(self, points, faces, positions, normals, indices, seam):
+        self.points = points
+        self.faces = faces
+        self.positions = positions
+        self.normals = normals
+        self.indices = indices
+        self.seam = seam
+
+
+def triangulate_outline(pts):
+    """
+    耳切法三角化简单多边形（凹凸皆可），三角形保持轮廓的方向。
+    Triangula um polígono simples (convexo ou não) por ear clipping; os
+    triângulos mantêm a orientação do contorno.
+    """
+    z, y = pts[:, 0], pts[:, 1]
+    sign = 1.0 if np.sum(z * np.roll(y, -1) - np.roll(z, -1) * y) > 0 else -1.0
+
+    def cross(a, b, c):
+        return sign * ((pts[b, 0] - pts[a, 0]) * (pts[c, 1] - pts[a, 1]) -
+                       (pts[b, 1] - pts[a, 1]) * (pts[c, 0] - pts[a, 0]))
+
+    remaining = list(range(len(pts)))
+    tris = []
+    while len(remaining) > 3:
+        n = len(remaining)
+        for j in range(n):
+            a, b, c = remaining[j - 1], remaining[j], remaining[(j + 1) % n]
+            # Pontos colineares ficam para depois: cortá-los deixaria uma junção em T na banda
+            # 共线点留到最后：切掉它们会在侧带上留下 T 形接缝
+            if cross(a, b, c) <= 1e-12:
+                continue
+            if not any(cross(a, b, p) >= 0 and cross(b, c, p) >= 0 and cross(c, a, p) >= 0
+                       for p in remaining if p not in (a, b, c)):
+                break
+        else:
+            raise ValueError("contorno não é um polígono simples (轮廓不是简单多边形)")
+        tris.append((a, b, c))
+        remaining.pop(j)
+    if abs(cross(*remaining)) > 1e-12:
+        tris.append(tuple(remaining))
+    return tris
+
+
+def extrude_profile(outline, widths, closed=True, segments=1, crease=60.0):
+    """
+    把 (z, y) 轮廓沿 x 拉伸：端盖在 x = ±width，与侧带共享位置（closed=True 时网格封闭），
+    只有法线按拐角分开，其余按面积加权平滑。
+    Extrude um contorno (z, y) ao longo de x, com tampas laterais em x = ±largura.
+    Tampas e banda partilham as posições (com closed=True a malha é fechada); só
+    as normais se separam, nas tampas e nos cantos do contorno com ângulo > crease
+    (graus). As restantes normais são suaves, ponderadas pela área.
+    closed=False deixa aberto o segmento entre o último e o primeiro ponto; com
+    closed=True esse segmento vem no fim dos índices (mesh.seam).
+    As tampas usam ear clipping, por isso o contorno pode ser côncavo.
+    """
+    pts = np.asarray(outline, dtype=np.float64)
+    m = len(pts)
+    w = np.broadcast_to(np.asarray(widths, dtype=np.float64), (m,))
+    S = segments + 1
+
+    # Cantos suaves partilham a mesma fila de vértices (平滑拐角共享同一排顶点)
+    d = np.roll(pts, -1, axis=0) - pts
+    d /= np.maximum(np.linalg.norm(d, axis=1, keepdims=True), 1e-12)
+    cos_turn = np.einsum("ij,ij->i", np.roll(d, 1, axis=0), d)
+    smooth = cos_turn >= math.cos(math.radians(crease))
+    if not closed:
+        smooth[0] = smooth[-1] = True
+    rows_in, rows_out = np.zeros(m, np.int64), np.zeros(m, np.int64)
+    row_point = []
+    for i in range(m):
+        rows_in[i] = len(row_point)
+        row_point.append(i)
+        if smooth[i]:
+            rows_out[i] = rows_in[i]
+        else:
+            rows_out[i] = len(row_point)
+            row_point.append(i)
+
+    # Posição única do ponto i na estação k: i * S + k (点 i 在第 k 站的唯一位置)
+    t = np.linspace(-1.0, 1.0, S)
+    z, y = pts[:, 0], pts[:, 1]
+    points = np.stack([w[:, None] * t, np.repeat(y[:, None], S, axis=1),
+                       np.repeat(z[:, None], S, axis=1)], axis=-1).reshape(-1, 3)
+    source = [row_point[r] * S + k for r in range(len(row_point)) for k in range(S)]
+
+    # Orientação: normais para fora do contorno (方向：法线朝向轮廓外侧)
+    ccw = np.sum(z * np.roll(y, -1) - np.roll(z, -1) * y) > 0
+    order = ((0, 2, 3), (0, 1, 2)) if ccw else ((0, 3, 2), (0, 2, 1))
+    faces, corners = [], []
+
+    def band(s):
+        e = (s + 1) % m
+        a, b = rows_out[s] * S, rows_in[e] * S
+        for k in range(segments):
+            q = (a + k, a + k + 1, b + k + 1, b + k)
+            p = (s * S + k, s * S + k + 1, e * S + k + 1, e * S + k)
+            for o in order:
+                corners.append([q[j] for j in o])
+                faces.append([p[j] for j in o])
+
+    for s in range(m - 1):
+        band(s)
+    cap = triangulate_outline(pts)
+    for side, k in ((-1.0, 0), (1.0, segments)):
+        base = len(source)
+        source += [i * S + k for i in range(m)]
+        for tri in cap:
+            tri = tri if (side > 0) != ccw else (tri[0], tri[2], tri[1])
+            faces.append([i * S + k for i in tri])
+            corners.append([base + i for i in tri])
+    seam = 3 * len(corners)
+    if closed:
+        band(m - 1)
+
+    positions = points[source]
+    indices = np.array(corners, dtype=np.uint32)
+    # Normal não normalizada = 2 x área: somar dá a média ponderada pela área (未归一化的叉积即面积加权)
+    v0, v1, v2 = positions[indices[:, 0]], positions[indices[:, 1]], positions[indices[:, 2]]
+    face = np.cross(v1 - v0, v2 - v0)
+    normals = np.zeros_like(positions)
+    for c in range(3):
+        np.add.at(normals, indices[:, c], face)
+    normals /= np.maximum(np.linalg.norm(normals, axis=1, keepdims=True), 1e-12)
+    return ProfileMesh(points.astype(np.float32), np.array(faces, dtype=np.uint32).ravel(),
+                       positions.astype(np.float32), normals.astype(np.float32), indices.ravel(), seam)
+
+
+profile_meshes = {}
+
+
+def profile_mesh(outline, widths, closed=True, segments=1, crease=60.0):
+    """
+    按参数缓存的 extrude_profile。
+    extrude_profile com cache por parâmetros.
+    """
+    key = (tuple(map(tuple, outline)), tuple(np.atleast_1d(widths).tolist()), closed, segments, crease)
+    mesh = profile_meshes.get(key)
+    if mesh is None:
+        mesh = profile_meshes[key] = extrude_profile(outline, widths, closed, segments, crease)
+    return mesh
+
+
+def draw_indexed_mesh(mesh, start=0, end=None):
+    """
+    用顶点数组一次绘制 ProfileMesh（可只画 indices[start:end]）。
+    Desenha uma ProfileMesh numa só chamada com vertex arrays (opcionalmente só
+    indices[start:end]).
+    """
+    indices = mesh.indices[start:end]
+    glEnableClientState(GL_VERTEX_ARRAY)
+    glEnableClientState(GL_NORMAL_ARRAY)
+    glVertexPointer(3, GL_FLOAT, 0, mesh.positions)
+    glNormalPointer(GL_FLOAT, 0, mesh.normals)
+    glDrawElements(GL_TRIANGLES, len(indices), GL_UNSIGNED_INT, indices)
+    glDisableClientState(GL_VERTEX_ARRAY)
+    glDisableClientState(GL_NORMAL_ARRAY)
+
+
+# Contornos (z, y) da carroçaria, extrudidos como malhas fechadas; o segmento de fecho
+# (virado para o habitáculo) usa o material preto. O vidro fica aberto em baixo.
+# 车身 (z, y) 轮廓，拉伸为封闭网格；闭合段（朝向座舱）用黑色材质。玻璃底部保持开口。
+FRONT_BODY_OUTLINE = [(-0.9, 0.1), (-2.4, 0.1), (-2.4, 0.4), (-2.0, 0.55), (-0.9, 0.65)]
+REAR_BODY_OUTLINE = [(1.3, 0.65), (2.1, 0.7), (2.1, 0.2), (2.1, 0.1), (1.3, 0.1)]
+GLASS_OUTLINE = [(-0.9, 0.65), (-0.2, 1.05), (0.6, 1.05), (1.4, 0.65)]
+GLASS_WIDTHS = [0.95 * 0.95, 0.65, 0.65, 0.95 * 0.95]
+
+
 def draw_front_body():
     """ 
     绘制车头（平滑曲面）。
     Desenha a frente do carro (superfície suave). 
     """
     set_material("car_paint_metal")
-    profile = [(-2.4, 0.1), (-2.4, 0.4), (-2.0, 0.55), (-0.9, 0.65)]
     w_body = 0.95
-    
-    glBegin(GL_QUAD_STRIP)
-    for z, y in profile:
-        glNormal3f(-0.7, 0.5, 0.0)
-        glVertex3f(-w_body, y, z)
-        glNormal3f(0.0, 1.0, 0.0)
-        glVertex3f(0.0, y, z)
-    glEnd()
-    
-    glBegin(GL_QUAD_STRIP)
-    for z, y in profile:
-        glNormal3f(0.0, 1.0, 0.0)
-        glVertex3f(0.0, y, z)
-        glNormal3f(0.7, 0.5, 0.0)
-        glVertex3f(w_body, y, z)
-    glEnd()
-    
-    for side in [-1, 1]:
-        glBegin(GL_POLYGON)
-        glNormal3f(side, 0, 0)
-        for z, y in profile:
-            glVertex3f(side * w_body, y, z)
-        glVertex3f(side * w_body, 0.1, -0.9)
-        glVertex3f(side * w_body, 0.1, -2.4)
-        glEnd()
-        
+    mesh = profile_mesh(FRONT_BODY_OUTLINE, w_body)
+    draw_indexed_mesh(mesh, 0, mesh.seam)
+
     set_material("car_inner_black")
-    glBegin(GL_QUADS)
-    glNormal3f(0, 0, 1) 
-    glVertex3f(-w_body, 0.65, -0.9)
-    glVertex3f(w_body, 0.65, -0.9)
-    glVertex3f(w_body, 0.1, -0.9)
-    glVertex3f(-w_body, 0.1, -0.9)
-    glEnd()
+    draw_indexed_mesh(mesh, mesh.seam)
 
 
 def draw_rear_body():
@@ -736,43 +1291,12 @@ def draw_rear_body():
     Desenha a traseira do carro. 
     """
     set_material("car_paint_metal")
-    start_z = 1.3
-    profile = [(start_z, 0.65), (2.1, 0.7), (2.1, 0.2)]
     w_body = 0.95
-    
-    glBegin(GL_QUAD_STRIP)
-    for z, y in profile:
-        glNormal3f(-0.7, 0.5, 0.0)
-        glVertex3f(-w_body, y, z)
-        glNormal3f(0.0, 1.0, 0.0)
-        glVertex3f(0.0, y, z)
-    glEnd()
-    
-    glBegin(GL_QUAD_STRIP)
-    for z, y in profile:
-        glNormal3f(0.0, 1.0, 0.0)
-        glVertex3f(0.0, y, z)
-        glNormal3f(0.7, 0.5, 0.0)
-        glVertex3f(w_body, y, z)
-    glEnd()
-    
-    for side in [-1, 1]:
-        glBegin(GL_POLYGON)
-        glNormal3f(side, 0, 0)
-        for z, y in profile:
-            glVertex3f(side * w_body, y, z)
-        glVertex3f(side * w_body, 0.1, 2.1)
-        glVertex3f(side * w_body, 0.1, start_z)
-        glEnd()
-        
+    mesh = profile_mesh(REAR_BODY_OUTLINE, w_body)
+    draw_indexed_mesh(mesh, 0, mesh.seam)
+
     set_material("car_inner_black")
-    glBegin(GL_QUADS)
-    glNormal3f(0, 0, -1) 
-    glVertex3f(-w_body, 0.65, start_z)
-    glVertex3f(w_body, 0.65, start_z)
-    glVertex3f(w_body, 0.1, start_z)
-    glVertex3f(-w_body, 0.1, start_z)
-    glEnd()
+    draw_indexed_mesh(mesh, mesh.seam)
 
 
 def draw_rear_fender():
@@ -820,7 +1344,7 @@ def draw_chassis_floor():
 
 
 # [REQ 2] Portas abrem por resposta a interacção.
-# A rotação da porta é feita aqui: 'if car_door_open: glRotatef(...)'. 车门旋转逻辑在这里。如果想改变开门角度，修改 glRotatef 的参数 (60 或 -60)。
+# A rotação da porta vem de 'car_door_angle' (AnimationPalette). 车门旋转角度来自 car_door_angle。如果想改变开门角度，修改 ANIMATION_TRACKS["car_door"] 的最后数值 (60)。
 def draw_door_object(side):
     """ 
     绘制车门对象。
@@ -855,83 +1379,19 @@ def draw_glass_cabin():
     glEnable(GL_BLEND)
     glBlendFunc(GL_SRC_ALPHA, GL_ONE_MINUS_SRC_ALPHA)
     
-    glass_profile = [(-0.9, 0.65), (-0.2, 1.05), (0.6, 1.05), (1.4, 0.65)]
-    w_body = 0.95
-    w_roof = 0.65 
-    
-    # Left Half
-    glBegin(GL_QUAD_STRIP)
-    for i, (z, y) in enumerate(glass_profile):
-        w = w_roof if (0 < i < 3) else w_body * 0.95
-        glNormal3f(-0.5, 0.8, 0)
-        glVertex3f(-w, y, z)
-        glNormal3f(0.0, 1.0, 0)
-        glVertex3f(0, y, z)
-    glEnd()
-    
-    # Right Half
-    glBegin(GL_QUAD_STRIP)
-    for i, (z, y) in enumerate(glass_profile):
-        w = w_roof if (0 < i < 3) else w_body * 0.95
-        glNormal3f(0.0, 1.0, 0)
-        glVertex3f(0, y, z)
-        glNormal3f(0.5, 0.8, 0)
-        glVertex3f(w, y, z)
-    glEnd()
-    
-    # Side Windows
-    for side in [-1, 1]:
-        glBegin(GL_POLYGON)
-        glNormal3f(side, 0, 0)
-        for z, y in glass_profile:
-            w = w_roof if (0 < glass_profile.index((z,y)) < 3) else w_body * 0.95
-            glVertex3f(side * w, y, z)
-        glEnd()
+    # Para-brisas, tejadilho e óculo; as janelas laterais são as tampas (侧窗即端盖)
+    draw_indexed_mesh(profile_mesh(GLASS_OUTLINE, GLASS_WIDTHS, closed=False))
         
     glDisable(GL_BLEND)
 
 
-def draw_complete_car():
+def draw_car_trim():
     """ 
-    组装完整车辆。
-    Monta o carro completo. 
+    绘制车身附件（尾翼、后视镜、仪表台）。
+    Desenha os acessórios da carroçaria (aileron, espelhos, painel).
     """
-    # Smart Light Control inside Garage(quando entrar na garagem)
-    in_garage_x = -5 < car_pos[0] < 5
-    in_garage_z = -26 < car_pos[2] < -14
-    if in_garage_x and in_garage_z:
-        glEnable(GL_LIGHT1)
-    else:
-        glDisable(GL_LIGHT1)
-
-    glPushMatrix()
-    glTranslatef(car_pos[0], 0.35, car_pos[2])
-    glRotatef(math.degrees(car_yaw), 0, 1, 0)
-    
-    draw_front_body()
-    draw_rear_body()
-    draw_rear_fender()
-    draw_chassis_floor()
-
-    # Doors
-    door_hinge_z = -0.9
-    door_width_offset = 0.95
-    
-    glPushMatrix()
-    glTranslatef(-door_width_offset, 0, door_hinge_z)
-    #Controla o angulo da porta. 控制开门角度越大越宽
-    if car_door_open: glRotatef(-60, 0, 1, 0)
-    draw_door_object(-1)
-    glPopMatrix()
-    
-    glPushMatrix()
-    glTranslatef(door_width_offset, 0, door_hinge_z)
-    if car_door_open: glRotatef(60, 0, 1, 0)
-    draw_door_object(1)
-    glPopMatrix()
-
-    # Spoiler
-    set_material("car_inner_black")
+    # Spoiler
+    set_material("car_inner_black")
     glPushMatrix()
     glTranslatef(0, 0.75, 1.9)
     glPushMatrix()
@@ -953,8 +1413,46 @@ def draw_complete_car():
         glutSolidSphere(1.0, 10, 10)
         glPopMatrix()
 
+    # Inner parts
+    set_material("car_inner_black") 
+    glPushMatrix()
+    glTranslatef(0.0, 0.4, 0.75) 
+    glScalef(1.8, 0.4, 0.05)
+    glutSolidCube(1.0)
+    glPopMatrix()
+
+
+def draw_complete_car():
+    """ 
+    组装完整车辆。
+    Monta o carro completo. 
+    """
+    # Smart Light Control inside Garage(quando entrar na garagem)
+    if state.car_in_garage:
+        glEnable(GL_LIGHT1)
+    else:
+        glDisable(GL_LIGHT1)
+
+    glPushMatrix()
+    glTranslatef(state.car_pos[0], 0.35, state.car_pos[2])
+    glRotatef(math.degrees(state.car_yaw), 0, 1, 0)
+    
+    draw_cached(draw_front_body)
+    draw_cached(draw_rear_body)
+    draw_cached(draw_rear_fender)
+    draw_cached(draw_chassis_floor)
+
+    # Peças animadas: uma matriz da paleta + malha em cache (动画部件：调色板矩阵 + 缓存网格)
+    palette = get_animation()
+
+    # Doors
+    palette.draw("door_left", draw_door_object, -1)
+    palette.draw("door_right", draw_door_object, 1)
+
+    draw_cached(draw_car_trim)
+
     # Light Bulbs
-    if not headlights_on:
+    if not state.headlights_on:
         set_material("light_bulb_off")
     else:
         glMaterialfv(GL_FRONT, GL_EMISSION, [1.0, 1.0, 0.9, 1.0])
@@ -966,7 +1464,7 @@ def draw_complete_car():
     glTranslatef(0.7, 0.3, -2.35); glScalef(0.25, 0.1, 0.1); glutSolidSphere(0.8, 10, 10); glPopMatrix()
     
     # Tail lights
-    if headlights_on:
+    if state.headlights_on:
         glMaterialfv(GL_FRONT, GL_EMISSION, [1.0, 0.0, 0.0, 1.0])
         glColor3f(1.0, 0.0, 0.0)
     else:
@@ -979,124 +1477,170 @@ def draw_complete_car():
     glTranslatef(0.6, 0.5, 2.1); glScalef(0.3, 0.1, 0.05); glutSolidCube(1.0); glPopMatrix()
     glMaterialfv(GL_FRONT, GL_EMISSION, [0.0, 0.0, 0.0, 1.0])
 
-    # Inner parts
-    set_material("car_inner_black") 
-    glPushMatrix()
-    glTranslatef(0.0, 0.4, 0.75) 
-    glScalef(1.8, 0.4, 0.05)
-    glutSolidCube(1.0)
-    glPopMatrix()
-
     glPushMatrix()
-    glTranslatef(-0.45, 0.1, 0.35); draw_seat(); glPopMatrix()
+    glTranslatef(-0.45, 0.1, 0.35); draw_cached(draw_seat); glPopMatrix()
     glPushMatrix()
-    glTranslatef(0.45, 0.1, 0.35); draw_seat(); glPopMatrix()
+    glTranslatef(0.45, 0.1, 0.35); draw_cached(draw_seat); glPopMatrix()
 
-    # [REQ 3] Volante roda (draw_steering_wheel).
-    # Para rodar mais/menos, mude o multiplicador '1.5' (ex: steering_angle * 2.0). 改变方向盘旋转幅度，修改 'steering_angle * 1.5' 中的 1.5。
-    glPushMatrix()
-    glTranslatef(-0.45, 0.55, -0.50)
-    glRotatef(20, 1, 0, 0)
-    glRotatef(steering_angle * 1.5, 0, 0, 1)
-    draw_steering_wheel()
-    glPopMatrix()
+    # [REQ 3] Volante roda (draw_steering_wheel); o multiplicador está em AnimationPalette.evaluate.
+    palette.draw("steering_wheel", draw_steering_wheel)
 
     # [REQ 1] Rodas traseiras maiores que dianteiras.
-    # [REQ 4] Rodas giram ao deslocar.
-    # Rodas da frente (Radius=0.33)
-    # Mude '0.33' para alterar o tamanho das rodas da frente. 修改 '0.33' 来改变前轮大小。
-    for s in [-1, 1]: 
-        glPushMatrix()
-        glTranslatef(s*1.0, 0.0, -1.3)
-        glRotatef(steering_angle, 0, 1, 0)
-        glRotatef(-wheel_rotation, 1, 0, 0) # Rotação da roda (车轮自转)
-        glRotatef(90, 0, 1, 0)
-        draw_wheel(0.33, 0.25)
-        glPopMatrix()
-        
-    #Rotação mais lenta para as rodas maiores 车轮转速
-    rot_rear = wheel_rotation * (0.33/0.55)
-    
-    # Rodas de trás (Radius=0.50)
-    # Mude '0.50' para alterar o tamanho das rodas de trás. 修改 '0.50' 来改变后轮大小。
-    for s in [-1, 1]:
-        glPushMatrix()
-        glTranslatef(s*1.05, 0.15, 1.2)
-        glRotatef(-rot_rear, 1, 0, 0)
-        glRotatef(90, 0, 1, 0)
-        draw_wheel(0.50, 0.35)
-        glPopMatrix()
+    # [REQ 4] Rodas giram ao deslocar (posição e rotação em AnimationPalette.evaluate).
+    # Mude '0.33' / '0.50' para alterar o tamanho das rodas da frente / de trás. 修改 '0.33' / '0.50' 来改变前轮 / 后轮大小。
+    palette.draw("wheel_front_left", draw_wheel, 0.33, 0.25)
+    palette.draw("wheel_front_right", draw_wheel, 0.33, 0.25)
+    palette.draw("wheel_rear_left", draw_wheel, 0.50, 0.35)
+    palette.draw("wheel_rear_right", draw_wheel, 0.50, 0.35)
     
-    draw_glass_cabin()
+    if secondary_views is not None:
+        draw_mirror_glass()
+    draw_cached(draw_glass_cabin)
     glPopMatrix()
 
 # ============================================================================
 # 6. LOGIC & CONTROL
 # ============================================================================
 
-def set_projection():
+def set_projection(aspect=800/600):
     """ 
     设置投影矩阵。
     Configura a matriz de projeção. 
     """
     glMatrixMode(GL_PROJECTION)
     glLoadIdentity()
-    target_fov = 65.0 if camera_mode == 2 else 45.0
-    gluPerspective(target_fov, 800/600, 0.1, 300.0)
+    target_fov = 65.0 if state.camera_mode == 2 else 45.0
+    gluPerspective(target_fov, aspect, 0.1, 300.0)
     glMatrixMode(GL_MODELVIEW)
 
 
-def draw_scene():
+# [REQ 8] Controle de câmara (Camera Control)
+# Aqui define-se a posição da câmara para cada modo. 这里定义了不同模式下的摄像机位置。
+def compute_camera():
     """ 
-    主渲染函数。
-    Função principal de renderização. 
+    计算当前摄像机的眼睛位置与目标点。
+    Calcula a posição do olho e o ponto alvo da câmara atual. 
     """
-    set_projection()
-    
-    if is_night:
-        glClearColor(0.05, 0.05, 0.1, 1.0)
-    else:
-        glClearColor(0.6, 0.8, 1.0, 1.0)
-    
-    glClear(GL_COLOR_BUFFER_BIT | GL_DEPTH_BUFFER_BIT)
-    glLoadIdentity()
-    
-    # [REQ 8] Controle de câmara (Camera Control)
-    # Aqui define-se a posição da câmara (gluLookAt) para cada modo. 这里定义了不同模式下的摄像机位置 (gluLookAt)。
-    if camera_mode == 0: 
-        cx = car_pos[0] + cam_dist * math.sin(cam_yaw) * math.cos(cam_pitch)
-        cy = car_pos[1] + cam_dist * math.sin(cam_pitch)
-        cz = car_pos[2] + cam_dist * math.cos(cam_yaw) * math.cos(cam_pitch)
+    if state.camera_mode == 0: 
+        cx = state.car_pos[0] + state.cam_dist * math.sin(state.cam_yaw) * math.cos(state.cam_pitch)
+        cy = state.car_pos[1] + state.cam_dist * math.sin(state.cam_pitch)
+        cz = state.car_pos[2] + state.cam_dist * math.cos(state.cam_yaw) * math.cos(state.cam_pitch)
         if cy < 0.5: cy = 0.5 
-        gluLookAt(cx, cy, cz, car_pos[0], car_pos[1], car_pos[2], 0, 1, 0)
+        return avoid_camera_obstacles((cx, cy, cz)), (state.car_pos[0], state.car_pos[1], state.car_pos[2])
         
-    elif camera_mode == 1: 
-        cx = car_pos[0] + 15.0 * math.sin(car_yaw + cam_yaw) * math.cos(cam_pitch)
-        cz = car_pos[2] + 15.0 * math.cos(car_yaw + cam_yaw) * math.cos(cam_pitch)
-        cy = car_pos[1] + 15.0 * math.sin(cam_pitch) + 2.0
-        gluLookAt(cx, cy, cz, car_pos[0], car_pos[1], car_pos[2], 0, 1, 0)
+    elif state.camera_mode == 1: 
+        cx = state.car_pos[0] + 15.0 * math.sin(state.car_yaw + state.cam_yaw) * math.cos(state.cam_pitch)
+        cz = state.car_pos[2] + 15.0 * math.cos(state.car_yaw + state.cam_yaw) * math.cos(state.cam_pitch)
+        cy = state.car_pos[1] + 15.0 * math.sin(state.cam_pitch) + 2.0
+        return avoid_camera_obstacles((cx, cy, cz)), (state.car_pos[0], state.car_pos[1], state.car_pos[2])
         
-    elif camera_mode == 2: 
-        rad = car_yaw
+    else: 
+        rad = state.car_yaw
         offset_right = -0.42
         offset_up = 1.35
         offset_back = 0.45
-        eye_x = car_pos[0] + offset_right * math.cos(rad) + offset_back * math.sin(rad)
-        eye_y = car_pos[1] + offset_up
-        eye_z = car_pos[2] - offset_right * math.sin(rad) + offset_back * math.cos(rad)
+        eye_x = state.car_pos[0] + offset_right * math.cos(rad) + offset_back * math.sin(rad)
+        eye_y = state.car_pos[1] + offset_up
+        eye_z = state.car_pos[2] - offset_right * math.sin(rad) + offset_back * math.cos(rad)
         target_dist = 50.0
         tx = eye_x - target_dist * math.sin(rad)
         ty = eye_y - 3.0
         tz = eye_z - target_dist * math.cos(rad)
-        gluLookAt(eye_x, eye_y, eye_z, tx, ty, tz, 0, 1, 0)
+        return (eye_x, eye_y, eye_z), (tx, ty, tz)
+
+
+def draw_scene():
+    """ 
+    主渲染函数。
+    Função principal de renderização. 
+    """
+    if simulation is not None:
+        simulation.apply()
+    t = time.perf_counter()
+    render_frame()
+    if telemetry is not None:
+        telemetry.publish(state, (time.perf_counter() - t) * 1000.0)
+
+    if frame_capture is not None:
+        frame_capture.capture()
+    if gl_resources is not None:
+        gl_resources.end_frame()
+    if gl_stats is not None:
+        gl_stats.end_frame()
+    
+    glutSwapBuffers()
+    if startup.first_frame is None:
+        startup.frame_presented()
+
+
+def render_frame(aspect=800/600):
+    """
+    把场景渲染到当前帧缓冲（不交换缓冲区）。
+    Renderiza a cena no framebuffer atual (sem trocar os buffers).
+    """
+    global camera_eye
+    # Paleta de animação: uma avaliação por frame; as funções draw_* só a leem
+    # 动画调色板每帧计算一次，draw_* 函数只读取它
+    get_animation().evaluate(state)
+    set_projection(aspect)
+    clear_sky()
+    glLoadIdentity()
+    
+    camera_eye, target = compute_camera()
+    gluLookAt(*camera_eye, *target, 0, 1, 0)
+    if occlusion_culler is not None:
+        occlusion_culler.begin_frame()
+    if secondary_views is not None:
+        secondary_views.capture_main()
+        secondary_views.render_stale()
+    
+    setup_lights()
+
+    # Objects (descritos em SCENE_FILE / 由 SCENE_FILE 描述)
+    if world is not None:
+        world.update(state.car_pos[0], state.car_pos[2])
+        world.draw()
+    else:
+        draw_mosaic_floor()
+        draw_scene_objects(scene)
+    if tire_tracks is not None:
+        tire_tracks.draw()
+    
+    draw_complete_car()
+    if shadows is not None:
+        shadows.render(state)
+    if particles is not None:
+        particles.draw()
+    if secondary_views is not None:
+        secondary_views.render_due()
+        secondary_views.draw_overlays()
+
+
+def clear_sky():
+    """
+    用天空颜色清空颜色与深度缓冲。
+    Limpa os buffers de cor e profundidade com a cor do céu.
+    """
+    if state.is_night:
+        glClearColor(0.05, 0.05, 0.1, 1.0)
+    else:
+        glClearColor(0.6, 0.8, 1.0, 1.0)
     
+    glClear(GL_COLOR_BUFFER_BIT | GL_DEPTH_BUFFER_BIT)
+
+
+def setup_lights():
+    """
+    设置灯光（须在视图矩阵之后调用，光源位置随之变换）。
+    Define as luzes (depois da matriz de vista, que transforma as posições).
+    """
     update_car_lights()
 
     # Lights Luz Cor diffuse
-    if is_night:
+    if state.is_night:
         glLightfv(GL_LIGHT0, GL_DIFFUSE, [0.2, 0.3, 0.4, 1.0])
         glLightfv(GL_LIGHT0, GL_AMBIENT, [0.05, 0.05, 0.1, 1.0])
-        glLightfv(GL_LIGHT0, GL_POSITION, [-20, 40, -20, 0])
+        glLightfv(GL_LIGHT0, GL_POSITION, moon_pos)
     else:
         glLightfv(GL_LIGHT0, GL_DIFFUSE, [1.0, 0.9, 0.8, 1.0])
         glLightfv(GL_LIGHT0, GL_AMBIENT, [0.3, 0.3, 0.3, 1.0])
@@ -1105,39 +1649,26 @@ def draw_scene():
 
     glLightfv(GL_LIGHT1, GL_POSITION, light1_pos)
 
-    # Objects
-    draw_mosaic_floor()
-    
-    random.seed(123)
-    for _ in range(15):
-        px, pz = random.randint(-40, 40), random.randint(-40, 40)
-        if abs(px) > 8 or abs(pz) > 8: draw_tree(px, pz)
-        
-    for _ in range(10):
-        px, pz = random.randint(-30, 30), random.randint(-30, 30)
-        if abs(px) > 8 or abs(pz) > 8: draw_rock(px, pz)
-    
-    glPushMatrix()
-    glTranslatef(0, 0, -15)
-    draw_garage()
-    glPopMatrix()
-    
-    draw_modern_house(-15, -10)
-    draw_classic_house(15, -10)
-    
-    draw_complete_car()
-    
-    glutSwapBuffers()
-
 
 def update(v):
     """
     更新动画状态（如车门开启）。
     Atualiza o estado da animação (ex: abertura da porta).
     """
-    global car_door_angle
-    target_angle = 60.0 if car_door_open else 0.0
-    car_door_angle += (target_angle - car_door_angle) * 0.1
+    if simulation is None:
+        if command_server is not None:
+            command_server.tick(state)
+        step_autopilot(state, 0.016)
+        step_triggers(state)
+        step_door(state, 0.016)
+        if replay_recorder is not None:
+            replay_recorder.record(time.perf_counter(), state)
+    if particles is not None:
+        particles.step(state)
+    if tire_tracks is not None:
+        tire_tracks.step(state)
+    if startup.deferred:
+        startup.run_deferred()
     
     glutPostRedisplay()
     glutTimerFunc(16, update, 0) 
@@ -1148,32 +1679,10 @@ def special_keys(k, x, y):
     处理特殊按键（方向键）。
     Manipula teclas especiais (setas).
     """
-    global car_pos, car_yaw, wheel_rotation, steering_angle
-    
-    # [REQUISITO: O volante poderá controlar o ângulo de viragem do veículo] (方向盘控制车辆转向角度)
-    if k == GLUT_KEY_LEFT:
-        steering_angle = min(steering_angle + STEER_SPEED, MAX_STEER)
-    elif k == GLUT_KEY_RIGHT:
-        steering_angle = max(steering_angle - STEER_SPEED, -MAX_STEER)
-    
-    move_dir = 0
-    if k == GLUT_KEY_UP:
-        move_dir = 1
-        # [REQ 4] Rodas giram ao deslocar.
-        # Para rodar as rodas mais depressa, mude '15' para '30'. 想要轮子转得更快，把 '15' 改成 '30'。
-        wheel_rotation += 15 
-        
-    elif k == GLUT_KEY_DOWN:
-        move_dir = -1
-        wheel_rotation -= 15 
-        
-    # [REQ 5] O veículo deve poder deslocar-se.
-    # Mude 'MOVE_SPEED' (no início do ficheiro) para alterar a velocidade. 修改文件开头的 'MOVE_SPEED' 来改变车速。
-    if move_dir != 0:
-        car_pos[0] -= move_dir * MOVE_SPEED * math.sin(car_yaw)
-        car_pos[2] -= move_dir * MOVE_SPEED * math.cos(car_yaw)
-        # [REQUISITO: O carro poderá virar além de se deslocar em linha recta] (车除了直线移动外还能转弯)
-        car_yaw += move_dir * (MOVE_SPEED / WHEELBASE) * math.tan(math.radians(steering_angle))
+    if simulation is not None:
+        simulation.post(apply_special_key, k)
+    else:
+        apply_special_key(state, k)
 
 
 def keyboard(key, x, y):
@@ -1181,43 +1690,40 @@ def keyboard(key, x, y):
     处理普通按键。
     Manipula teclas comuns.
     """
-    global car_door_open, garage_door_height, cam_yaw, cam_pitch, camera_mode, steering_angle, is_night, headlights_on
     try:
         k = key.decode("utf-8").lower()
     except:
         return 
     
-    # [REQ 2] Tecla para abrir porta. 打开车门
-    if k=='o': car_door_open = not car_door_open 
-    
-    # [REQ 5] Teclas para abrir/fechar garagem. 打开车库门
-    if k=='g': garage_door_height = min(garage_door_height + 0.1, 5.0) 
-    if k=='f': garage_door_height = max(garage_door_height - 0.1, 0.0) 
-    
     # [REQ 8] Tecla para mudar câmara. 切换视角
     if k=='v':
-        camera_mode = (camera_mode + 1) % 3
-        cam_yaw = 0.0
-        cam_pitch = 0.4
-        
-    if k==' ': steering_angle = 0.0 
-    if k=='n': is_night = not is_night 
-    if k=='h': headlights_on = not headlights_on 
+        state.camera_mode = (state.camera_mode + 1) % 3
+        state.cam_yaw = 0.0
+        state.cam_pitch = 0.4
+
+    if k=='r': toggle_capture()
+    if k=='l': toggle_replay_recording()
+    if k=='m' and secondary_views is not None: secondary_views.toggle("map")
+    if k=='p': toggle_autopilot()
+
+    if simulation is not None:
+        simulation.post(apply_key, k)
+    else:
+        apply_key(state, k)
 
 
-def mouse_func(button, state, x, y):
+def mouse_func(button, button_state, x, y):
     """
     处理鼠标点击。
     Manipula cliques do mouse.
     """
-    global mouse_down, last_mouse_x, last_mouse_y, cam_dist
     if button == GLUT_LEFT_BUTTON:
-        mouse_down = (state == GLUT_DOWN)
-        last_mouse_x, last_mouse_y = x, y
+        state.mouse_down = (button_state == GLUT_DOWN)
+        state.last_mouse_x, state.last_mouse_y = x, y
     elif button == 3:
-        cam_dist = max(5.0, cam_dist - 1.0)
+        state.cam_dist = max(5.0, state.cam_dist - 1.0)
     elif button == 4:
-        cam_dist = min(50.0, cam_dist + 1.0)
+        state.cam_dist = min(50.0, state.cam_dist + 1.0)
     glutPostRedisplay()
 
 
@@ -1226,14 +1732,13 @@ def motion_func(x, y):
     处理鼠标拖动。
     Manipula movimento do mouse.
     """
-    global cam_yaw, cam_pitch, last_mouse_x, last_mouse_y
-    if mouse_down:
-        dx = x - last_mouse_x
-        dy = y - last_mouse_y
-        cam_yaw += dx * 0.005
-        cam_pitch += dy * 0.005
-        cam_pitch = max(-1.0, min(1.0, cam_pitch))
-        last_mouse_x, last_mouse_y = x, y
+    if state.mouse_down:
+        dx = x - state.last_mouse_x
+        dy = y - state.last_mouse_y
+        state.cam_yaw += dx * 0.005
+        state.cam_pitch += dy * 0.005
+        state.cam_pitch = max(-1.0, min(1.0, state.cam_pitch))
+        state.last_mouse_x, state.last_mouse_y = x, y
         glutPostRedisplay()
 
 
@@ -1253,19 +1758,5354 @@ def init():
     glEnable(GL_LIGHT0)
     glEnable(GL_LIGHT1)
     
+    glLightfv(GL_LIGHT1, GL_DIFFUSE, [1.0, 1.0, 1.0, 1.0])
     glLightfv(GL_LIGHT2, GL_DIFFUSE, [1.0, 1.0, 0.8, 1.0])
     glLightfv(GL_LIGHT3, GL_DIFFUSE, [1.0, 1.0, 0.8, 1.0])
     
-    init_resources()
+    global gl_resources, gl_stats
+    if TRACK_GL_RESOURCES and gl_resources is None:
+        gl_resources = GLResourceTracker().install()
+    with startup.phase("textures"):
+        init_resources()
+    if COUNT_GL_CALLS and gl_stats is None:
+        gl_stats = GLCallCounter().install()
+    
+    global scene, world, occlusion_culler, simulation, particles, tire_tracks, secondary_views, triggers, shadows
+    with startup.phase("scene"):
+        if scene is not None and occlusion_culler is not None:
+            occlusion_culler.release(scene)
+        scene = load_scene(SCENE_FILE)
+        triggers = build_trigger_zones(scene)
+        if STREAM_WORLD:
+            world = WorldStreamer(scene)
+    if USE_IMPOSTORS:
+        # Objetos distantes usam a malha completa até o atlas estar pronto (图集就绪前远处物体用完整网格)
+        startup.defer("impostors", init_impostors)
+    if USE_CAMERA_COLLISION:
+        # Sem colisão da câmara nos primeiros frames (最初几帧没有摄像机碰撞)
+        startup.defer("camera", init_camera_collider)
+    if USE_OCCLUSION_QUERIES and bool(glGenQueries):
+        occlusion_culler = OcclusionCuller()
+    if USE_PARTICLES:
+        particles = ParticleSystem()
+    if USE_TIRE_TRACKS:
+        tire_tracks = TireTracks()
+    if USE_SECONDARY_VIEWS:
+        secondary_views = init_secondary_views()
+    if USE_SHADOWS:
+        shadows = init_shadows()
+    if USE_SIM_THREAD:
+        simulation = SimulationThread()
+        simulation.start()
 
 
-if __name__ == "__main__":
-    glutInit(sys.argv)
-    glutInitDisplayMode(GLUT_DOUBLE | GLUT_RGB | GLUT_DEPTH)
-    glutInitWindowSize(800, 600)
-    glutCreateWindow(b"Final Project")
+# ============================================================================
+# 7. GEOMETRY BAKING (几何烘焙)
+# ============================================================================
+
+# [修改说明]: 场景中的静态 draw_* 函数只执行一次，记录顶点/法线/纹理坐标/材质，
+# 保存到 BAKE_CACHE_DIR，之后每帧只提交缓冲区。修改 draw_* 源码后缓存会自动失效。
+# As funções draw_* estáticas são executadas uma única vez; o resultado é gravado
+# em BAKE_CACHE_DIR e, a cada frame, apenas os buffers são submetidos.
+
+BAKE_MAGIC = b"CGBAKE\x00\x00"
+BAKE_ALIGN = 64
+
+baked_meshes = {}
+
+
+def _fix_winding(pos, nrm):
+    """
+    按法线方向修正三角形绕序（逆时针为正面）。
+    Corrige a ordem dos vértices de cada triângulo para coincidir com a normal.
+    """
+    tri = pos.reshape(-1, 3, 3)
+    face = np.cross(tri[:, 1] - tri[:, 0], tri[:, 2] - tri[:, 0])
+    flip = np.einsum("ij,ij->i", face, nrm.reshape(-1, 3, 3).sum(axis=1)) < 0
+    for arr in (pos, nrm):
+        t = arr.reshape(-1, 3, 3)
+        t[flip, 1], t[flip, 2] = t[flip, 2].copy(), t[flip, 1].copy()
+    return pos, nrm
+
+
+def _grid_triangles(P, N):
+    """
+    将 (行, 列, 3) 网格转换为三角形列表。
+    Converte uma grelha (linhas, colunas, 3) em triângulos.
+    """
+    a, b = P[:-1, :-1], P[1:, :-1]
+    c, d = P[1:, 1:], P[:-1, 1:]
+    na, nb = N[:-1, :-1], N[1:, :-1]
+    nc, nd = N[1:, 1:], N[:-1, 1:]
+    pos = np.stack([a, b, c, a, c, d], axis=2).reshape(-1, 3)
+    nrm = np.stack([na, nb, nc, na, nc, nd], axis=2).reshape(-1, 3)
+    return _fix_winding(pos.astype(np.float64), nrm.astype(np.float64))
+
+
+def solid_cube_mesh(size):
+    """
+    glutSolidCube 的 CPU 版本。
+    Versão em CPU do glutSolidCube.
+    """
+    h = size / 2.0
+    pos, nrm = [], []
+    for axis in range(3):
+        for sign in (-1.0, 1.0):
+            n = np.zeros(3)
+            n[axis] = sign
+            u, v = np.roll(np.eye(3), -axis - 1, axis=0)[:2]
+            corners = [n * h + (su * u + sv * v) * h for su, sv in ((-1, -1), (1, -1), (1, 1), (-1, 1))]
+            for i in (0, 1, 2, 0, 2, 3):
+                pos.append(corners[i])
+                nrm.append(n)
+    return _fix_winding(np.array(pos), np.array(nrm))
+
+
+def solid_sphere_mesh(radius, slices, stacks):
+    """
+    glutSolidSphere 的 CPU 版本。
+    Versão em CPU do glutSolidSphere.
+    """
+    phi = np.linspace(0.0, math.pi, stacks + 1)[:, None]
+    theta = np.linspace(0.0, 2 * math.pi, slices + 1)[None, :]
+    N = np.stack([np.sin(phi) * np.cos(theta), np.sin(phi) * np.sin(theta), np.cos(phi) + 0 * theta], axis=-1)
+    return _grid_triangles(N * radius, N)
+
+
+def solid_cone_mesh(base, height, slices, stacks):
+    """
+    glutSolidCone 的 CPU 版本（含底面）。
+    Versão em CPU do glutSolidCone (com base).
+    """
+    z = np.linspace(0.0, height, stacks + 1)[:, None]
+    theta = np.linspace(0.0, 2 * math.pi, slices + 1)[None, :]
+    r = base * (1.0 - z / height)
+    P = np.stack([r * np.cos(theta), r * np.sin(theta), z + 0 * theta], axis=-1)
+    slant = math.hypot(base, height)
+    N = np.stack([np.cos(theta) * height / slant + 0 * z, np.sin(theta) * height / slant + 0 * z,
+                  np.full_like(P[..., 2], base / slant)], axis=-1)
+    side_p, side_n = _grid_triangles(P, N)
+    cap_p, cap_n = disk_mesh(0.0, base, slices, 1)
+    cap_n = -cap_n
+    cap_p, cap_n = _fix_winding(cap_p, cap_n)
+    return np.vstack([side_p, cap_p]), np.vstack([side_n, cap_n])
+
+
+def solid_torus_mesh(inner, outer, sides, rings):
+    """
+    glutSolidTorus 的 CPU 版本。
+    Versão em CPU do glutSolidTorus.
+    """
+    phi = np.linspace(0.0, 2 * math.pi, sides + 1)[:, None]
+    theta = np.linspace(0.0, 2 * math.pi, rings + 1)[None, :]
+    ring = outer + inner * np.cos(phi)
+    P = np.stack([ring * np.cos(theta), ring * np.sin(theta), inner * np.sin(phi) + 0 * theta], axis=-1)
+    N = np.stack([np.cos(phi) * np.cos(theta), np.cos(phi) * np.sin(theta), np.sin(phi) + 0 * theta], axis=-1)
+    return _grid_triangles(P, N)
+
+
+def solid_dodecahedron_mesh():
+    """
+    glutSolidDodecahedron 的 CPU 版本（外接球半径 √3）。
+    Versão em CPU do glutSolidDodecahedron (raio circunscrito √3).
+    """
+    g = (1 + math.sqrt(5)) / 2
+    verts = [(x, y, z) for x in (-1, 1) for y in (-1, 1) for z in (-1, 1)]
+    for a in (-1, 1):
+        for b in (-1, 1):
+            verts += [(0, a / g, b * g), (a / g, b * g, 0), (a * g, 0, b / g)]
+    verts = np.array(verts, dtype=np.float64)
+    pos, nrm = [], []
+    for a in (-1, 1):
+        for b in (-1, 1):
+            for n in ((0, a * g, b), (a * g, b, 0), (b, 0, a * g)):
+                n = np.array(n, dtype=np.float64) / math.hypot(1, g)
+                d = verts @ n
+                face = verts[d > d.max() - 1e-6]
+                c = face.mean(axis=0)
+                u = face[0] - c
+                v = np.cross(n, u)
+                face = face[np.argsort(np.arctan2((face - c) @ v, (face - c) @ u))]
+                for i in range(1, len(face) - 1):
+                    pos += [face[0], face[i], face[i + 1]]
+                    nrm += [n, n, n]
+    return _fix_winding(np.array(pos), np.array(nrm))
+
+
+def cylinder_mesh(base, top, height, slices, stacks):
+    """
+    gluCylinder 的 CPU 版本（无端盖）。
+    Versão em CPU do gluCylinder (sem tampas).
+    """
+    z = np.linspace(0.0, height, stacks + 1)[:, None]
+    theta = np.linspace(0.0, 2 * math.pi, slices + 1)[None, :]
+    r = base + (top - base) * z / height
+    P = np.stack([r * np.sin(theta), r * np.cos(theta), z + 0 * theta], axis=-1)
+    nz = (base - top) / height
+    length = math.sqrt(1 + nz * nz)
+    N = np.stack([np.sin(theta) / length + 0 * z, np.cos(theta) / length + 0 * z,
+                  np.full_like(P[..., 2], nz / length)], axis=-1)
+    return _grid_triangles(P, N)
+
+
+def disk_mesh(inner, outer, slices, loops):
+    """
+    gluDisk 的 CPU 版本（z=0 平面，法线 +z）。
+    Versão em CPU do gluDisk (plano z=0, normal +z).
+    """
+    r = np.linspace(inner, outer, loops + 1)[:, None]
+    theta = np.linspace(0.0, 2 * math.pi, slices + 1)[None, :]
+    P = np.stack([r * np.sin(theta), r * np.cos(theta), 0 * r * theta], axis=-1)
+    N = np.zeros_like(P)
+    N[..., 2] = 1.0
+    return _grid_triangles(P, N)
+
+
+def _rotation_matrix(angle, x, y, z):
+    """
+    glRotatef 对应的 4x4 矩阵。
+    Matriz 4x4 equivalente a glRotatef.
+    """
+    axis = np.array([x, y, z], dtype=np.float64)
+    axis /= np.linalg.norm(axis)
+    x, y, z = axis
+    c, s = math.cos(math.radians(angle)), math.sin(math.radians(angle))
+    m = np.identity(4)
+    m[:3, :3] = [[x*x*(1-c)+c,   x*y*(1-c)-z*s, x*z*(1-c)+y*s],
+                 [y*x*(1-c)+z*s, y*y*(1-c)+c,   y*z*(1-c)-x*s],
+                 [x*z*(1-c)-y*s, y*z*(1-c)+x*s, z*z*(1-c)+c]]
+    return m
+
+
+class GeometryRecorder:
+    """
+    拦截即时模式 GL 调用，把输出记录为按渲染状态分组的三角形。
+    Interceta as chamadas GL em modo imediato e grava-as como triângulos
+    agrupados por estado de renderização.
+    """
+
+    def __init__(self):
+        self.matrix_stack = [np.identity(4)]
+        self.normal = (0.0, 0.0, 1.0)
+        self.texcoord = (0.0, 0.0)
+        self.color = (1.0, 1.0, 1.0, 1.0)
+        # None = herdado do estado atual (继承当前状态)
+        self.state = {"texture": None, "blend": None, "cull": None, "light1": None,
+                      "specular": None, "shininess": None, "emission": None}
+        self.texture_enabled = False
+        self.texture_bound = None
+        self.mode = None
+        self.prim = []
+        self.batches = {}
+
+    # --- matrix stack ---
+    def glPushMatrix(self):
+        self.matrix_stack.append(self.matrix_stack[-1].copy())
+
+    def glPopMatrix(self):
+        self.matrix_stack.pop()
+
+    def glTranslatef(self, x, y, z):
+        m = np.identity(4)
+        m[:3, 3] = (x, y, z)
+        self.matrix_stack[-1] = self.matrix_stack[-1] @ m
+
+    def glRotatef(self, angle, x, y, z):
+        self.matrix_stack[-1] = self.matrix_stack[-1] @ _rotation_matrix(angle, x, y, z)
+
+    def glScalef(self, x, y, z):
+        self.matrix_stack[-1] = self.matrix_stack[-1] @ np.diag([x, y, z, 1.0])
+
+    def glMultMatrixf(self, m):
+        self.matrix_stack[-1] = self.matrix_stack[-1] @ np.asarray(m, dtype=np.float64).reshape(4, 4).T
+
+    # --- per-vertex attributes ---
+    def glNormal3f(self, x, y, z):
+        self.normal = (x, y, z)
+
+    def glTexCoord2f(self, s, t):
+        self.texcoord = (s, t)
+
+    def glColor3f(self, r, g, b):
+        self.color = (r, g, b, 1.0)
+
+    def glColor4f(self, r, g, b, a):
+        self.color = (r, g, b, a)
+
+    def glMaterialfv(self, face, pname, value):
+        if pname == GL_SPECULAR:
+            self.state["specular"] = tuple(float(v) for v in value)
+        elif pname == GL_EMISSION:
+            self.state["emission"] = tuple(float(v) for v in value)
+        elif pname == GL_SHININESS:
+            self.state["shininess"] = float(value if np.isscalar(value) else value[0])
+
+    def glMaterialf(self, face, pname, value):
+        self.glMaterialfv(face, pname, value)
+
+    # --- capabilities ---
+    def _set_cap(self, cap, on):
+        if cap == GL_TEXTURE_2D:
+            self.texture_enabled = on
+            self.state["texture"] = self.texture_bound if on else False
+        elif cap == GL_BLEND:
+            self.state["blend"] = on
+        elif cap == GL_CULL_FACE:
+            self.state["cull"] = on
+        elif cap == GL_LIGHT1:
+            self.state["light1"] = on
+
+    def glEnable(self, cap):
+        self._set_cap(cap, True)
+
+    def glDisable(self, cap):
+        self._set_cap(cap, False)
+
+    def glBindTexture(self, target, tex):
+        self.texture_bound = tex
+        if self.texture_enabled:
+            self.state["texture"] = tex
+
+    # --- primitives ---
+    def glBegin(self, mode):
+        self.mode = int(mode)
+        self.prim = []
+
+    def glVertex3f(self, x, y, z):
+        self.prim.append(((x, y, z), self.normal, self.texcoord, self.color))
+
+    def glEnd(self):
+        v = self.prim
+        n = len(v)
+        if self.mode == GL_TRIANGLES:
+            idx = list(range(n - n % 3))
+        elif self.mode == GL_QUADS:
+            idx = [q + i for q in range(0, n - n % 4, 4) for i in (0, 1, 2, 0, 2, 3)]
+        elif self.mode == GL_QUAD_STRIP:
+            idx = [2 * q + i for q in range(n // 2 - 1) for i in (0, 1, 3, 0, 3, 2)]
+        elif self.mode in (GL_POLYGON, GL_TRIANGLE_FAN):
+            idx = [j for i in range(1, n - 1) for j in (0, i, i + 1)]
+        elif self.mode == GL_TRIANGLE_STRIP:
+            idx = [j for i in range(n - 2) for j in ((i, i + 1, i + 2) if i % 2 == 0 else (i + 1, i, i + 2))]
+        else:
+            idx = []
+        if idx:
+            pos, nrm, tex, col = (np.array([v[i][k] for i in idx], dtype=np.float64) for k in range(4))
+            self._emit(pos, nrm, tex, col)
+        self.mode = None
+
+    def _emit(self, pos, nrm, tex=None, col=None):
+        m = self.matrix_stack[-1]
+        pos = pos @ m[:3, :3].T + m[:3, 3]
+        nrm = nrm @ np.linalg.inv(m[:3, :3])
+        length = np.linalg.norm(nrm, axis=1, keepdims=True)
+        nrm = nrm / np.where(length > 0, length, 1.0)
+        if tex is None:
+            tex = np.zeros((len(pos), 2))
+        if col is None:
+            col = np.tile(self.color, (len(pos), 1))
+        key = tuple(self.state[k] for k in BAKE_STATE_KEYS)
+        self.batches.setdefault(key, []).append((pos, nrm, tex, col))
+
+    # --- GLUT / GLU solids ---
+    def glutSolidCube(self, size):
+        self._emit(*solid_cube_mesh(size))
+
+    def glutSolidSphere(self, radius, slices, stacks):
+        self._emit(*solid_sphere_mesh(radius, slices, stacks))
+
+    def glutSolidCone(self, base, height, slices, stacks):
+        self._emit(*solid_cone_mesh(base, height, slices, stacks))
+
+    def glutSolidTorus(self, inner, outer, sides, rings):
+        self._emit(*solid_torus_mesh(inner, outer, sides, rings))
+
+    def glutSolidDodecahedron(self):
+        self._emit(*solid_dodecahedron_mesh())
+
+    def draw_indexed_mesh(self, mesh, start=0, end=None):
+        indices = mesh.indices[start:end]
+        self._emit(mesh.positions[indices].astype(np.float64), mesh.normals[indices].astype(np.float64))
+
+    def gluNewQuadric(self):
+        return None
+
+    def gluDeleteQuadric(self, quadric):
+        pass
+
+    def gluCylinder(self, quadric, base, top, height, slices, stacks):
+        self._emit(*cylinder_mesh(base, top, height, slices, stacks))
+
+    def gluDisk(self, quadric, inner, outer, slices, loops):
+        self._emit(*disk_mesh(inner, outer, slices, loops))
+
+    def draw_cached(self, fn, *args, material=None):
+        # Malhas aninhadas são gravadas aqui, não desenhadas no GL real (嵌套的缓存网格被录制，而不是直接绘制)
+        global material_override
+        material_override = material
+        try:
+            fn(*args)
+        finally:
+            material_override = None
+
+    def _ignore(self, *args):
+        pass
+
+    def capture(self, fn, *args):
+        """
+        执行 fn 并拦截其 GL 调用。
+        Executa fn com as chamadas GL intercetadas.
+        """
+        g = globals()
+        hooks = {name: getattr(self, name) for name in BAKE_CAPTURED_CALLS}
+        hooks.update({name: self._ignore for name in BAKE_IGNORED_CALLS})
+        # Os IDs de textura são substituídos por nomes estáveis (纹理ID替换为稳定名称)
+        hooks.update({"tex_floor_id": "floor", "tex_wall_id": "wall"})
+        saved = {name: g[name] for name in hooks}
+        g.update(hooks)
+        try:
+            fn(*args)
+        finally:
+            g.update(saved)
+        return self
+
+    def to_arrays(self):
+        """
+        合并批次为连续数组。
+        Junta os lotes em arrays contíguos.
+        """
+        parts = {"positions": [], "normals": [], "texcoords": [], "colors": []}
+        batches = []
+        first = 0
+        for key, chunks in self.batches.items():
+            count = 0
+            for chunk in chunks:
+                for name, arr in zip(parts, chunk):
+                    parts[name].append(arr)
+                count += len(chunk[0])
+            batches.append(dict(zip(BAKE_STATE_KEYS, key), first=first, count=count))
+            first += count
+        arrays = {}
+        for name, width in (("positions", 3), ("normals", 3), ("texcoords", 2), ("colors", 4)):
+            data = np.vstack(parts[name]) if parts[name] else np.zeros((0, width))
+            arrays[name] = np.ascontiguousarray(data, dtype=np.float32)
+        final = {k: self.state[k] for k in ("texture", "blend", "cull", "light1")}
+        return arrays, {"batches": batches, "final": final}
+
+
+BAKE_STATE_KEYS = ("texture", "blend", "cull", "light1", "specular", "shininess", "emission")
+BAKE_CAPTURED_CALLS = (
+    "glPushMatrix", "glPopMatrix", "glTranslatef", "glRotatef", "glScalef", "glMultMatrixf",
+    "glNormal3f", "glTexCoord2f", "glColor3f", "glColor4f", "glMaterialfv", "glMaterialf",
+    "glEnable", "glDisable", "glBindTexture", "glBegin", "glVertex3f", "glEnd",
+    "glutSolidCube", "glutSolidSphere", "glutSolidCone", "glutSolidTorus", "glutSolidDodecahedron",
+    "gluNewQuadric", "gluDeleteQuadric", "gluCylinder", "gluDisk", "draw_indexed_mesh", "draw_cached",
+)
+BAKE_IGNORED_CALLS = ("glColorMaterial", "glBlendFunc", "glCullFace")
+
+
+def save_blob(path, arrays, meta, version=BAKE_FORMAT_VERSION):
+    """
+    保存版本化二进制文件（JSON 头 + 对齐的原始数组）。
+    Grava um ficheiro binário versionado (cabeçalho JSON + arrays alinhados).
+    """
+    layout = {}
+    offset = 0
+    for name, arr in arrays.items():
+        offset = -(-offset // BAKE_ALIGN) * BAKE_ALIGN
+        layout[name] = {"dtype": arr.dtype.str if arr.dtype.names is None else arr.dtype.descr,
+                        "shape": list(arr.shape), "offset": offset}
+        offset += arr.nbytes
+    header = json.dumps({"arrays": layout, "meta": meta}).encode("utf-8")
+    data_start = -(-(len(BAKE_MAGIC) + 8 + len(header)) // BAKE_ALIGN) * BAKE_ALIGN
+
+    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+    tmp = "%s.%d.tmp" % (path, os.getpid())
+    with open(tmp, "wb") as f:
+        f.write(BAKE_MAGIC)
+        f.write(np.array([version, len(header)], dtype="<u4").tobytes())
+        f.write(header)
+        for name, arr in arrays.items():
+            f.seek(data_start + layout[name]["offset"])
+            f.write(np.ascontiguousarray(arr).tobytes())
+    os.replace(tmp, path)
+
+
+def load_blob(path, version=BAKE_FORMAT_VERSION):
+    """
+    通过 mmap 零拷贝加载二进制文件；版本不符时返回 None。
+    Carrega o ficheiro via mmap sem cópias; devolve None se a versão não coincidir.
+    """
+    try:
+        with open(path, "rb") as f:
+            mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+    except (OSError, ValueError):
+        return None
+    if mm[:len(BAKE_MAGIC)] != BAKE_MAGIC:
+        return None
+    file_version, header_len = np.frombuffer(mm, dtype="<u4", count=2, offset=len(BAKE_MAGIC))
+    if file_version != version:
+        return None
+    header_start = len(BAKE_MAGIC) + 8
+    header = json.loads(mm[header_start:header_start + header_len].decode("utf-8"))
+    data_start = -(-(header_start + int(header_len)) // BAKE_ALIGN) * BAKE_ALIGN
+
+    arrays = {}
+    for name, info in header["arrays"].items():
+        descr = info["dtype"]
+        dtype = np.dtype(descr if isinstance(descr, str) else [tuple(d) for d in descr])
+        shape = tuple(info["shape"])
+        count = int(np.prod(shape)) if shape else 1
+        arrays[name] = np.frombuffer(mm, dtype=dtype, count=count,
+                                     offset=data_start + info["offset"]).reshape(shape)
+    return arrays, header["meta"]
+
+
+_source_digests = {}
+
+
+def _source_digest(obj):
+    """
+    编译后代码的摘要，递归包含它引用的本模块函数、类与常量（任何一处修改都会改变摘要）。
+    Resumo do código compilado, incluindo recursivamente as funções, classes e
+    constantes (nomes em maiúsculas) deste módulo que ele referencia.
+    """
+    obj = getattr(obj, "__wrapped__", obj)
+    digest = _source_digests.get(obj)
+    if digest is None:
+        h = hashlib.sha1()
+        _hash_code(h, obj, set())
+        digest = h.hexdigest()
+        _source_digests[obj] = digest
+    return digest
+
+
+def _hash_code(h, obj, seen):
+    obj = getattr(obj, "__wrapped__", obj)
+    if id(obj) in seen:
+        return
+    seen.add(id(obj))
+    codes = [obj.__code__] if hasattr(obj, "__code__") else \
+        [f.__code__ for _, f in sorted(vars(obj).items()) if hasattr(f, "__code__")]
+    g = globals()
+    while codes:
+        code = codes.pop()
+        h.update(marshal.dumps(code))
+        codes.extend(c for c in code.co_consts if isinstance(c, types.CodeType))
+        for name in code.co_names:
+            # A API GL é trocada em tempo de execução (gravador, GLUT sem janela): fica de fora
+            # GL 接口会在运行时被替换（记录器、无窗口 GLUT），不参与摘要
+            if name not in g or name.startswith("gl") or name in BAKE_CAPTURED_CALLS:
+                continue
+            value = g[name]
+            if isinstance(value, (types.FunctionType, type)):
+                _hash_value(h, value, seen)
+            elif name.isupper():
+                h.update(name.encode())
+                _hash_value(h, value, seen)
+
+
+def _hash_value(h, value, seen):
+    if isinstance(value, (types.FunctionType, type)):
+        if value.__module__ == __name__:
+            _hash_code(h, value, seen)
+    elif isinstance(value, (tuple, list)):
+        h.update(b"[")
+        for item in value:
+            _hash_value(h, item, seen)
+        h.update(b"]")
+    elif isinstance(value, (set, frozenset)):
+        h.update(repr(sorted(map(repr, value))).encode("utf-8"))
+    elif isinstance(value, dict):
+        h.update(b"{")
+        for key in sorted(value, key=repr):
+            h.update(repr(key).encode("utf-8"))
+            _hash_value(h, value[key], seen)
+        h.update(b"}")
+    elif isinstance(value, np.ndarray):
+        h.update(repr((value.dtype.str, value.shape)).encode())
+        h.update(np.ascontiguousarray(value).tobytes())
+    elif isinstance(value, (bool, int, float, complex, str, bytes, type(None))):
+        h.update(repr(value).encode("utf-8"))
+
+
+def bake_key(fn, args):
+    """
+    由源代码与参数计算缓存键。
+    Calcula a chave da cache a partir do código-fonte e dos parâmetros.
+    """
+    h = hashlib.sha1()
+    h.update(str(BAKE_FORMAT_VERSION).encode())
+    for dep in (fn, set_material, GeometryRecorder, extrude_profile):
+        h.update(_source_digest(dep).encode())
+    h.update(repr(args).encode("utf-8"))
+    return h.hexdigest()
+
+
+class BakedMesh:
+    """
+    烘焙网格：mmap 数组 + 按状态分组的批次，首次绘制时上传到 VBO。
+    Malha pré-cozinhada: arrays mapeados + lotes por estado, enviados para VBOs no primeiro desenho.
+    """
+
+    def __init__(self, arrays, meta):
+        self.arrays = arrays
+        self.batches = meta["batches"]
+        self.final = meta["final"]
+        self.vbos = None
+
+    def upload(self):
+        self.vbos = glGenBuffers(4)
+        for vbo, name in zip(self.vbos, ("positions", "normals", "texcoords", "colors")):
+            glBindBuffer(GL_ARRAY_BUFFER, vbo)
+            glBufferData(GL_ARRAY_BUFFER, self.arrays[name].nbytes, self.arrays[name], GL_STATIC_DRAW)
+        glBindBuffer(GL_ARRAY_BUFFER, 0)
+
+    def release(self):
+        if self.vbos is not None:
+            glDeleteBuffers(4, self.vbos)
+            self.vbos = None
+
+    def draw(self, material=None):
+        if self.vbos is None:
+            self.upload()
+
+        glBindBuffer(GL_ARRAY_BUFFER, self.vbos[0]); glVertexPointer(3, GL_FLOAT, 0, None)
+        glBindBuffer(GL_ARRAY_BUFFER, self.vbos[1]); glNormalPointer(GL_FLOAT, 0, None)
+        glBindBuffer(GL_ARRAY_BUFFER, self.vbos[2]); glTexCoordPointer(2, GL_FLOAT, 0, None)
+        glBindBuffer(GL_ARRAY_BUFFER, self.vbos[3]); glColorPointer(4, GL_FLOAT, 0, None)
+        glBindBuffer(GL_ARRAY_BUFFER, 0)
+        for client_state in (GL_VERTEX_ARRAY, GL_NORMAL_ARRAY, GL_TEXTURE_COORD_ARRAY, GL_COLOR_ARRAY):
+            glEnableClientState(client_state)
+
+        if material is not None:
+            # Material substituído: ignora cores e materiais gravados (忽略烘焙的颜色与材质)
+            glDisableClientState(GL_COLOR_ARRAY)
+            set_material(material)
+        for batch in self.batches:
+            _apply_bake_state(batch, materials=material is None)
+            glDrawArrays(GL_TRIANGLES, batch["first"], batch["count"])
+
+        for client_state in (GL_VERTEX_ARRAY, GL_NORMAL_ARRAY, GL_TEXTURE_COORD_ARRAY, GL_COLOR_ARRAY):
+            glDisableClientState(client_state)
+        _apply_bake_state(self.final)
+
+
+def _apply_bake_state(bake_state, materials=True):
+    """
+    应用批次记录的渲染状态（None 表示保持不变）。
+    Aplica o estado gravado num lote (None = manter o estado atual).
+    """
+    texture = bake_state.get("texture")
+    if texture is not None:
+        if texture is False:
+            glDisable(GL_TEXTURE_2D)
+        else:
+            glEnable(GL_TEXTURE_2D)
+            glBindTexture(GL_TEXTURE_2D, tex_floor_id if texture == "floor" else tex_wall_id)
+    for key, cap in (("blend", GL_BLEND), ("cull", GL_CULL_FACE), ("light1", GL_LIGHT1)):
+        value = bake_state.get(key)
+        if value is True:
+            glEnable(cap)
+        elif value is False:
+            glDisable(cap)
+    if bake_state.get("blend"):
+        glBlendFunc(GL_SRC_ALPHA, GL_ONE_MINUS_SRC_ALPHA)
+    if bake_state.get("cull"):
+        glCullFace(GL_BACK)
+    if not materials:
+        return
+    if bake_state.get("specular") is not None:
+        glMaterialfv(GL_FRONT, GL_SPECULAR, bake_state["specular"])
+    if bake_state.get("shininess") is not None:
+        glMaterialf(GL_FRONT, GL_SHININESS, bake_state["shininess"])
+    if bake_state.get("emission") is not None:
+        glMaterialfv(GL_FRONT, GL_EMISSION, bake_state["emission"])
+
+
+def load_or_bake(fn, args=()):
+    """
+    从缓存文件加载网格；缓存不存在或失效时重新烘焙并保存。
+    Carrega a malha da cache; se não existir ou estiver desatualizada, faz o baking e grava.
+    """
+    path = os.path.join(BAKE_CACHE_DIR, "%s-%s.cgb" % (fn.__name__, bake_key(fn, args)[:20]))
+    loaded = load_blob(path)
+    if loaded is None:
+        arrays, meta = GeometryRecorder().capture(fn, *args).to_arrays()
+        try:
+            save_blob(path, arrays, meta)
+            loaded = load_blob(path)
+        except OSError:
+            loaded = None
+        if loaded is None:
+            loaded = (arrays, meta)
+    return BakedMesh(*loaded)
+
+
+def get_baked_mesh(fn, *args):
+    """
+    取得（必要时加载或烘焙）fn(*args) 的网格。
+    Obtém (carregando ou gerando se necessário) a malha de fn(*args).
+    """
+    key = (fn.__name__, args)
+    mesh = baked_meshes.get(key)
+    if mesh is None:
+        mesh = baked_meshes[key] = load_or_bake(fn, args)
+    return mesh
+
+
+def draw_cached(fn, *args, material=None):
+    """
+    绘制 fn(*args) 的烘焙版本；关闭烘焙时直接调用 fn。
+    Desenha a versão pré-cozinhada de fn(*args); sem baking, chama fn diretamente.
+    """
+    global material_override
+    if not USE_BAKED_GEOMETRY:
+        material_override = material
+        try:
+            fn(*args)
+        finally:
+            material_override = None
+        return
+    get_baked_mesh(fn, *args).draw(material)
+
+
+# ============================================================================
+# 8. SCENE DESCRIPTION (场景描述文件)
+# ============================================================================
+
+# Formato de texto (JSON) / 文本格式:
+#   {"version": 1, "objects": [
+#       {"kind": "tree", "position": [x, y, z], "rotation": [yaw, pitch, roll],
+#        "scale": 1.0 ou [sx, sy, sz], "material": "stone"}, ...]}
+# Só "kind" e "position" são obrigatórios; rotation em graus (Y, depois X, depois Z).
+# O formato binário (.cgscene) guarda os mesmos dados num array estruturado e é
+# carregado com mmap, sem criar objetos Python por instância.
+# 二进制格式把同样的数据存为结构化数组，通过 mmap 零拷贝加载。
+
+SCENE_FORMAT_VERSION = 1
+
+SCENE_RECORD_DTYPE = np.dtype([
+    ("kind", "<u2"),
+    ("material", "<i2"),          # -1 = sem substituição (无覆盖)
+    ("position", "<f4", (3,)),
+    ("rotation", "<f4", (3,)),    # yaw, pitch, roll (graus)
+    ("scale", "<f4", (3,)),
+])
+
+# kind -> função de desenho em coordenadas locais (物体类型 -> 局部坐标绘制函数)
+SCENE_KINDS = {
+    "garage": draw_garage,
+    "modern_house": draw_modern_house,
+    "classic_house": draw_classic_house,
+    "tree": draw_tree,
+    "rock": draw_rock,
+}
+# Tipos com estado dinâmico (porta, luzes) não são pré-cozinhados (动态物体不烘焙)
+SCENE_DYNAMIC_KINDS = {"garage"}
+
+
+class Scene:
+    """
+    场景：结构化记录数组（可能是 mmap 视图）+ 类型/材质名称表。
+    Cena: array estruturado de registos (possivelmente uma vista mmap) + tabelas de nomes.
+    """
+
+    def __init__(self, records, kinds, materials):
+        self.records = records
+        self.kinds = list(kinds)
+        self.materials = list(materials)
+
+    def __len__(self):
+        return len(self.records)
+
+
+def parse_scene_json(path):
+    """
+    解析 JSON 场景文件。
+    Lê um ficheiro de cena JSON.
+    """
+    with open(path, "r", encoding="utf-8") as f:
+        doc = json.load(f)
+    if doc.get("version", 1) != SCENE_FORMAT_VERSION:
+        raise ValueError("Unsupported scene version in %s: %r" % (path, doc.get("version")))
+
+    kinds = list(SCENE_KINDS)
+    materials = []
+    objects = doc["objects"]
+    records = np.zeros(len(objects), dtype=SCENE_RECORD_DTYPE)
+    for i, obj in enumerate(objects):
+        if obj["kind"] not in SCENE_KINDS:
+            raise ValueError("Unknown scene object kind %r (object %d)" % (obj["kind"], i))
+        material = obj.get("material")
+        if material is not None and material not in materials:
+            materials.append(material)
+        scale = obj.get("scale", 1.0)
+        records[i] = (kinds.index(obj["kind"]),
+                      -1 if material is None else materials.index(material),
+                      obj["position"],
+                      (list(obj.get("rotation", [])) + [0.0, 0.0, 0.0])[:3],
+                      [scale] * 3 if np.isscalar(scale) else scale)
+    return Scene(records, kinds, materials)
+
+
+def save_scene_binary(scene, path):
+    """
+    保存二进制场景文件。
+    Grava a cena em formato binário.
+    """
+    save_blob(path, {"records": scene.records},
+              {"kinds": scene.kinds, "materials": scene.materials}, version=SCENE_FORMAT_VERSION)
+
+
+def load_scene_binary(path):
+    """
+    通过 mmap 加载二进制场景（零拷贝 NumPy 视图）；文件无效时返回 None。
+    Carrega uma cena binária via mmap (vistas NumPy sem cópia); devolve None se for inválida.
+    """
+    loaded = load_blob(path, version=SCENE_FORMAT_VERSION)
+    if loaded is None:
+        return None
+    arrays, meta = loaded
+    records = arrays.get("records")
+    if records is None or records.dtype != SCENE_RECORD_DTYPE:
+        return None
+    return Scene(records, meta["kinds"], meta["materials"])
+
+
+def compile_scene(src, dst):
+    """
+    将 JSON 场景编译为二进制场景。
+    Compila uma cena JSON para o formato binário.
+    """
+    save_scene_binary(parse_scene_json(src), dst)
+
+
+def load_scene(path):
+    """
+    加载场景文件；JSON 会被编译并缓存到 BAKE_CACHE_DIR，下次直接 mmap。
+    Carrega a cena; um ficheiro JSON é compilado e guardado em BAKE_CACHE_DIR
+    para ser mapeado diretamente da próxima vez.
+    """
+    if not path.endswith(".json"):
+        scene = load_scene_binary(path)
+        if scene is None:
+            raise ValueError("Invalid or outdated scene file: %s" % path)
+        return scene
+
+    with open(path, "rb") as f:
+        digest = hashlib.sha1(f.read()).hexdigest()
+    cached = os.path.join(BAKE_CACHE_DIR, "scene-%s.cgscene" % digest[:20])
+    scene = load_scene_binary(cached)
+    if scene is None:
+        scene = parse_scene_json(path)
+        try:
+            save_scene_binary(scene, cached)
+        except OSError:
+            pass
+    return scene
+
+
+def draw_scene_object(name, material=None):
+    """
+    在当前变换下绘制一个场景物体。
+    Desenha um objeto da cena na transformação atual.
+    """
+    global material_override
+    if name in SCENE_DYNAMIC_KINDS:
+        material_override = material
+        try:
+            SCENE_KINDS[name]()
+        finally:
+            material_override = None
+    else:
+        draw_cached(SCENE_KINDS[name], material=material)
+
+
+def record_matrix(rec):
+    """
+    场景记录的 4x4 模型矩阵（与 draw_scene_record 相同的变换顺序）。
+    Matriz 4x4 de um registo da cena (mesma ordem que draw_scene_record).
+    """
+    m = np.identity(4)
+    m[:3, 3] = rec["position"]
+    yaw, pitch, roll = rec["rotation"].tolist()
+    if yaw: m = m @ _rotation_matrix(yaw, 0, 1, 0)
+    if pitch: m = m @ _rotation_matrix(pitch, 1, 0, 0)
+    if roll: m = m @ _rotation_matrix(roll, 0, 0, 1)
+    return m @ np.diag(list(rec["scale"].tolist()) + [1.0])
+
+
+def draw_scene_record(scene, i, box=None):
+    """
+    绘制场景中的第 i 条记录（或仅画其包围盒）。
+    Desenha o registo i da cena (ou apenas a sua caixa envolvente).
+    """
+    rec = scene.records[i]
+    kind, material = int(rec["kind"]), int(rec["material"])
+    pos, rot, scl = rec["position"].tolist(), rec["rotation"].tolist(), rec["scale"].tolist()
+    glPushMatrix()
+    glTranslatef(*pos)
+    if rot[0]: glRotatef(rot[0], 0, 1, 0)
+    if rot[1]: glRotatef(rot[1], 1, 0, 0)
+    if rot[2]: glRotatef(rot[2], 0, 0, 1)
+    if scl != [1.0, 1.0, 1.0]: glScalef(*scl)
+    if box is not None:
+        draw_box(*box)
+    else:
+        draw_scene_object(scene.kinds[kind], scene.materials[material] if material >= 0 else None)
+    glPopMatrix()
+
+
+def draw_scene_objects(scene):
+    """
+    按场景记录绘制所有物体（远处用替身，近处可做遮挡剔除）。
+    Desenha todos os objetos da cena (impostores ao longe, occlusion culling ao perto).
+    """
+    if scene is None:
+        return
+    if active_view is None:
+        idx, distance = np.arange(len(scene)), IMPOSTOR_DISTANCE
+    else:
+        idx, distance = np.flatnonzero(active_view.cull(scene)), active_view.impostor_distance
+    if impostor_atlas is not None and len(idx):
+        far, rows = impostor_atlas.far_mask(scene, camera_eye, distance)
+        far = far[idx]
+        if far.any():
+            impostor_atlas.draw(scene.records[idx[far]], rows[idx[far]], camera_eye)
+            idx = idx[~far]
+    # As vistas secundárias não emitem queries (次级视图不发出遮挡查询)
+    if occlusion_culler is not None and active_view is None:
+        occlusion_culler.draw(scene, idx)
+        return
+    for i in idx.tolist():
+        draw_scene_record(scene, i)
+
+
+# ============================================================================
+# 9. WORLD STREAMING (分块世界流式加载)
+# ============================================================================
+
+# O mundo é dividido em blocos de WORLD_TILE_SIZE x WORLD_TILE_SIZE. Os blocos perto
+# do carro são gerados num thread em segundo plano (só NumPy, sem GL) e enviados
+# para a GPU no thread principal; os blocos distantes são descartados quando a
+# memória ultrapassa WORLD_MEMORY_BUDGET. O conteúdo procedural depende apenas das
+# coordenadas do bloco, por isso revisitar um bloco gera exatamente o mesmo conteúdo.
+# 世界被切分为固定大小的地块；附近地块在后台线程生成，远处地块在超出内存预算时被回收。
+
+
+class WorldTile:
+    """
+    单个地块：地面网格数组 + 物体记录 + GPU 缓冲区。
+    Um bloco do mundo: arrays do chão + registos dos objetos + buffers na GPU.
+    """
+    __slots__ = ("coords", "floor", "props", "vbos", "nbytes", "last_used")
+
+    def __init__(self, coords, floor, props):
+        self.coords = coords
+        self.floor = floor
+        self.props = props
+        self.vbos = None
+        self.nbytes = sum(a.nbytes for a in floor.values()) + props.records.nbytes
+        self.last_used = 0
+
+    def upload(self):
+        self.vbos = glGenBuffers(3)
+        for vbo, name in zip(self.vbos, ("positions", "normals", "texcoords")):
+            glBindBuffer(GL_ARRAY_BUFFER, vbo)
+            glBufferData(GL_ARRAY_BUFFER, self.floor[name].nbytes, self.floor[name], GL_STATIC_DRAW)
+        glBindBuffer(GL_ARRAY_BUFFER, 0)
+        self.nbytes *= 2    # CPU + GPU
+
+    def release(self):
+        if self.vbos is not None:
+            glDeleteBuffers(3, self.vbos)
+            self.vbos = None
+        if occlusion_culler is not None:
+            occlusion_culler.release(self.props)
+
+    def draw_floor(self):
+        glBindBuffer(GL_ARRAY_BUFFER, self.vbos[0]); glVertexPointer(3, GL_FLOAT, 0, None)
+        glBindBuffer(GL_ARRAY_BUFFER, self.vbos[1]); glNormalPointer(GL_FLOAT, 0, None)
+        glBindBuffer(GL_ARRAY_BUFFER, self.vbos[2]); glTexCoordPointer(2, GL_FLOAT, 0, None)
+        glBindBuffer(GL_ARRAY_BUFFER, 0)
+        glDrawArrays(GL_TRIANGLES, 0, len(self.floor["positions"]))
+
+
+def generate_tile_floor(tx, tz, tile_size=WORLD_TILE_SIZE, steps=WORLD_TILE_STEPS):
+    """
+    生成地块地面网格（纹理坐标与原地面一致，地块之间无缝）。
+    Gera a malha do chão de um bloco (coordenadas de textura iguais às do chão original).
+    """
+    xs = tx * tile_size + np.arange(steps + 1) * (tile_size / steps)
+    zs = tz * tile_size + np.arange(steps + 1) * (tile_size / steps)
+    x1, z1 = np.meshgrid(xs[:-1], zs[:-1], indexing="ij")
+    x2, z2 = x1 + tile_size / steps, z1 + tile_size / steps
+    # Mesma ordem de vértices que draw_floor_geometry (同 draw_floor_geometry 的顶点顺序)
+    quad_x = np.stack([x1, x2, x2, x1], axis=-1).reshape(-1, 4)
+    quad_z = np.stack([z1, z1, z2, z2], axis=-1).reshape(-1, 4)
+    tri = [0, 1, 2, 0, 2, 3]
+    px, pz = quad_x[:, tri].ravel(), quad_z[:, tri].ravel()
+    positions = np.stack([px, np.zeros_like(px), pz], axis=-1).astype(np.float32)
+    normals = np.zeros_like(positions)
+    normals[:, 1] = 1.0
+    texcoords = np.stack([px / 2.0, pz / 2.0], axis=-1).astype(np.float32)
+    return {"positions": positions, "normals": normals, "texcoords": texcoords}
+
+
+def generate_tile_props(tx, tz, authored=None, tile_size=WORLD_TILE_SIZE, seed=WORLD_SEED):
+    """
+    根据地块坐标确定性地生成树木与岩石，并合并该地块内的场景文件物体。
+    Gera árvores e rochas de forma determinística a partir das coordenadas do bloco
+    e junta os objetos da cena que caem dentro do bloco.
+    """
+    rng = np.random.default_rng([seed, tx & 0xFFFFFFFF, tz & 0xFFFFFFFF])
+    kinds = list(SCENE_KINDS)
+    counts = {"tree": rng.poisson(WORLD_TREES_PER_TILE), "rock": rng.poisson(WORLD_ROCKS_PER_TILE)}
+    total = sum(counts.values())
+    records = np.zeros(total, dtype=SCENE_RECORD_DTYPE)
+    records["kind"] = np.repeat([kinds.index(k) for k in counts], list(counts.values()))
+    records["material"] = -1
+    records["scale"] = 1.0
+    xz = (np.array([tx, tz]) + rng.random((total, 2))) * tile_size
+    records["position"][:, 0] = xz[:, 0]
+    records["position"][:, 2] = xz[:, 1]
+    is_rock = records["kind"] == kinds.index("rock")
+    records["position"][is_rock, 1] = 0.5
+    records["rotation"][is_rock, :2] = rng.uniform(-300, 300, (int(is_rock.sum()), 2))
+
+    # Centro do mapa livre, como no cenário original (地图中心保持空旷)
+    keep = (np.abs(xz) > 8).any(axis=1)
+    if authored is None or not len(authored):
+        return Scene(records[keep], kinds, [])
+
+    # Clareira em volta dos objetos da cena (在场景物体周围留出空地)
+    pos = authored.records["position"][:, [0, 2]]
+    keep &= (((xz[:, None, :] - pos[None, :, :]) ** 2).sum(-1) > WORLD_CLEARING_RADIUS ** 2).all(axis=1)
+    placed = authored.records.copy()
+    placed["kind"] = [kinds.index(authored.kinds[k]) for k in placed["kind"].tolist()]
+    return Scene(np.concatenate([placed, records[keep]]), kinds, authored.materials)
+
+
+class WorldStreamer:
+    """
+    管理地块的异步生成、上传、绘制与回收。
+    Gere a geração assíncrona, o envio para a GPU, o desenho e a remoção dos blocos.
+    """
+
+    def __init__(self, scene=None, tile_size=WORLD_TILE_SIZE, radius=WORLD_LOAD_RADIUS,
+                 budget=WORLD_MEMORY_BUDGET, seed=WORLD_SEED):
+        self.tile_size = tile_size
+        self.radius = radius
+        self.budget = budget
+        self.seed = seed
+        self.tiles = {}
+        self.pending = set()
+        self.requests = queue.Queue()
+        self.results = collections.deque()
+        self.frame = 0
+        self.memory = 0
+        self.visible = []
+        # Objetos da cena agrupados por bloco (场景物体按地块分组)
+        self.authored = {}
+        if scene is not None and len(scene):
+            cells = np.floor(scene.records["position"][:, [0, 2]] / tile_size).astype(np.int64)
+            for cell in {tuple(c) for c in cells.tolist()}:
+                mask = (cells[:, 0] == cell[0]) & (cells[:, 1] == cell[1])
+                self.authored[cell] = Scene(scene.records[mask], scene.kinds, scene.materials)
+        self.worker = threading.Thread(target=self._worker, name="world-streamer", daemon=True)
+        self.worker.start()
+
+    def _worker(self):
+        while True:
+            coords = self.requests.get()
+            if coords is None:
+                return
+            tx, tz = coords
+            floor = generate_tile_floor(tx, tz, self.tile_size)
+            props = generate_tile_props(tx, tz, self.authored.get(coords), self.tile_size, self.seed)
+            self.results.append(WorldTile(coords, floor, props))
+
+    def stop(self):
+        self.requests.put(None)
+        self.worker.join(timeout=1.0)
+        for tile in self.tiles.values():
+            tile.release()
+        self.tiles.clear()
+
+    def wanted(self, x, z):
+        cx, cz = int(math.floor(x / self.tile_size)), int(math.floor(z / self.tile_size))
+        r = self.radius
+        cells = [(cx + i, cz + j) for i in range(-r, r + 1) for j in range(-r, r + 1) if i * i + j * j <= r * r + r]
+        cells.sort(key=lambda c: (c[0] - cx) ** 2 + (c[1] - cz) ** 2)
+        return cells
+
+    def update(self, x, z):
+        """
+        每帧调用：请求缺失地块、上传已生成地块、按预算回收远处地块。
+        Chamado a cada frame: pede blocos em falta, envia os prontos e liberta os distantes.
+        """
+        self.frame += 1
+        self.visible = self.wanted(x, z)
+        for coords in self.visible:
+            tile = self.tiles.get(coords)
+            if tile is not None:
+                tile.last_used = self.frame
+            elif coords not in self.pending:
+                self.pending.add(coords)
+                self.requests.put(coords)
+
+        for _ in range(min(len(self.results), WORLD_UPLOADS_PER_FRAME)):
+            tile = self.results.popleft()
+            self.pending.discard(tile.coords)
+            tile.upload()
+            tile.last_used = self.frame
+            self.tiles[tile.coords] = tile
+            self.memory += tile.nbytes
+
+        if self.memory > self.budget:
+            cx, cz = x / self.tile_size, z / self.tile_size
+            for coords in sorted(self.tiles, key=lambda c: -((c[0] - cx) ** 2 + (c[1] - cz) ** 2)):
+                if self.memory <= self.budget or self.tiles[coords].last_used == self.frame:
+                    break
+                tile = self.tiles.pop(coords)
+                tile.release()
+                self.memory -= tile.nbytes
+
+    def draw(self):
+        """
+        绘制当前可见的地块（地面 + 物体）。
+        Desenha os blocos visíveis (chão + objetos).
+        """
+        tiles = [self.tiles[c] for c in self.visible if c in self.tiles]
+        if active_view is not None and tiles:
+            centers = np.array([((t.coords[0] + 0.5) * self.tile_size, 0.0, (t.coords[1] + 0.5) * self.tile_size)
+                                for t in tiles])
+            keep = sphere_mask(active_view.planes, centers, np.full(len(tiles), self.tile_size * 0.75))
+            tiles = [t for t, k in zip(tiles, keep.tolist()) if k]
+
+        glDisable(GL_LIGHT1)
+        glEnable(GL_TEXTURE_2D)
+        glBindTexture(GL_TEXTURE_2D, tex_floor_id)
+        set_material("stone")
+        glEnableClientState(GL_VERTEX_ARRAY)
+        glEnableClientState(GL_NORMAL_ARRAY)
+        glEnableClientState(GL_TEXTURE_COORD_ARRAY)
+        for tile in tiles:
+            tile.draw_floor()
+        glDisableClientState(GL_VERTEX_ARRAY)
+        glDisableClientState(GL_NORMAL_ARRAY)
+        glDisableClientState(GL_TEXTURE_COORD_ARRAY)
+        glDisable(GL_TEXTURE_2D)
+
+        for tile in tiles:
+            draw_scene_objects(tile.props)
+
+
+# ============================================================================
+# 10. BILLBOARD IMPOSTORS (远景公告板替身)
+# ============================================================================
+
+# No arranque cada tipo de objeto é desenhado de IMPOSTOR_ANGLES ângulos para um
+# atlas de textura (FBO). Para lá de IMPOSTOR_DISTANCE o objeto é substituído por um
+# quad virado para a câmara, e todos esses quads são desenhados numa só chamada.
+# 启动时把每种物体从多个角度渲染到纹理图集；超过距离后用面向摄像机的四边形代替。
+
+
+class ImpostorAtlas:
+    """
+    替身纹理图集：每行一种物体，每列一个观察角度。
+    Atlas de impostores: uma linha por tipo de objeto, uma coluna por ângulo.
+    """
+
+    def __init__(self, kinds=IMPOSTOR_KINDS, angles=IMPOSTOR_ANGLES, cell=IMPOSTOR_CELL_SIZE):
+        self.kinds = list(kinds)
+        self.angles = angles
+        self.cell = cell
+        self.texture = None
+        # Por tipo: meia largura, y mínimo, y máximo (每种物体: 半宽, 最低 y, 最高 y)
+        self.extent = np.zeros((len(self.kinds), 3), dtype=np.float32)
+        self._rows = {}
+
+    def build(self):
+        """
+        从缓存加载图集；缓存不存在时用离屏帧缓冲渲染所有角度并保存。
+        Carrega o atlas da cache; se não existir, desenha todos os ângulos num
+        framebuffer fora do ecrã e grava-o.
+        """
+        width, height = self.angles * self.cell, len(self.kinds) * self.cell
+        self.texture = glGenTextures(1)
+        glBindTexture(GL_TEXTURE_2D, self.texture)
+        glTexImage2D(GL_TEXTURE_2D, 0, GL_RGBA, width, height, 0, GL_RGBA, GL_UNSIGNED_BYTE, None)
+        glTexParameteri(GL_TEXTURE_2D, GL_TEXTURE_MIN_FILTER, GL_LINEAR_MIPMAP_LINEAR)
+        glTexParameteri(GL_TEXTURE_2D, GL_TEXTURE_MAG_FILTER, GL_LINEAR)
+        glTexParameteri(GL_TEXTURE_2D, GL_TEXTURE_WRAP_S, GL_CLAMP_TO_EDGE)
+        glTexParameteri(GL_TEXTURE_2D, GL_TEXTURE_WRAP_T, GL_CLAMP_TO_EDGE)
+
+        # Todos os níveis de mipmap vão para a cache: glGenerateMipmap é lento em software
+        # 所有 mipmap 层级都存入缓存：软件渲染下 glGenerateMipmap 很慢
+        path = self.cache_path()
+        loaded = load_blob(path)
+        if loaded is not None:
+            arrays, meta = loaded
+            for level in range(meta["levels"]):
+                pixels = np.ascontiguousarray(arrays["level%d" % level])
+                glTexImage2D(GL_TEXTURE_2D, level, GL_RGBA, pixels.shape[1], pixels.shape[0], 0,
+                             GL_RGBA, GL_UNSIGNED_BYTE, pixels)
+            self.extent[:] = arrays["extent"]
+            self._rows = meta["rows"]
+        else:
+            self._render(width, height)
+            glBindTexture(GL_TEXTURE_2D, self.texture)
+            glGenerateMipmap(GL_TEXTURE_2D)
+            arrays = {"extent": self.extent}
+            levels = int(math.log2(max(width, height))) + 1
+            for level in range(levels):
+                w, h = max(width >> level, 1), max(height >> level, 1)
+                data = glGetTexImage(GL_TEXTURE_2D, level, GL_RGBA, GL_UNSIGNED_BYTE)
+                data = np.frombuffer(data, np.uint8) if isinstance(data, bytes) else np.asarray(data, np.uint8)
+                arrays["level%d" % level] = data.reshape(h, w, 4)
+            try:
+                save_blob(path, arrays, {"rows": self._rows, "levels": levels})
+            except OSError:
+                pass
+        glBindTexture(GL_TEXTURE_2D, 0)
+        return self
+
+    def cache_path(self):
+        """
+        缓存文件路径：依赖各物体的烘焙键与本类的代码。
+        Caminho da cache: depende das chaves de bake de cada tipo e do código desta classe.
+        """
+        h = hashlib.sha1(repr((self.kinds, self.angles, self.cell, light0_pos)).encode("utf-8"))
+        for kind in self.kinds:
+            h.update(bake_key(SCENE_KINDS[kind], ()).encode())
+        for dep in (ImpostorAtlas, BakedMesh):
+            h.update(_source_digest(dep).encode())
+        return os.path.join(BAKE_CACHE_DIR, "impostors-%s.cgb" % h.hexdigest()[:20])
+
+    def _render(self, width, height):
+        """
+        用离屏帧缓冲渲染所有角度。
+        Desenha todos os ângulos num framebuffer fora do ecrã.
+        """
+        fbo = glGenFramebuffers(1)
+        depth = glGenRenderbuffers(1)
+        glBindFramebuffer(GL_FRAMEBUFFER, fbo)
+        glFramebufferTexture2D(GL_FRAMEBUFFER, GL_COLOR_ATTACHMENT0, GL_TEXTURE_2D, self.texture, 0)
+        glBindRenderbuffer(GL_RENDERBUFFER, depth)
+        glRenderbufferStorage(GL_RENDERBUFFER, GL_DEPTH_COMPONENT24, width, height)
+        glFramebufferRenderbuffer(GL_FRAMEBUFFER, GL_DEPTH_ATTACHMENT, GL_RENDERBUFFER, depth)
+
+        viewport = glGetIntegerv(GL_VIEWPORT)
+        glPushAttrib(GL_ALL_ATTRIB_BITS)
+        glEnable(GL_SCISSOR_TEST)
+        glClearColor(0.0, 0.0, 0.0, 0.0)
+        glDisable(GL_LIGHT1); glDisable(GL_LIGHT2); glDisable(GL_LIGHT3)
+        glLightfv(GL_LIGHT0, GL_DIFFUSE, [1.0, 0.9, 0.8, 1.0])
+        glLightfv(GL_LIGHT0, GL_AMBIENT, [0.3, 0.3, 0.3, 1.0])
+
+        for row, kind in enumerate(self.kinds):
+            mesh = get_baked_mesh(SCENE_KINDS[kind])
+            pos = mesh.arrays["positions"]
+            radius = float(np.sqrt(pos[:, 0] ** 2 + pos[:, 2] ** 2).max()) * 1.02
+            y0, y1 = float(pos[:, 1].min()), float(pos[:, 1].max()) * 1.02
+            self.extent[row] = (radius, y0, y1)
+            self._rows[kind] = row
+            for col in range(self.angles):
+                theta = 2 * math.pi * col / self.angles
+                glViewport(col * self.cell, row * self.cell, self.cell, self.cell)
+                glScissor(col * self.cell, row * self.cell, self.cell, self.cell)
+                glClear(GL_COLOR_BUFFER_BIT | GL_DEPTH_BUFFER_BIT)
+                glMatrixMode(GL_PROJECTION)
+                glLoadIdentity()
+                glOrtho(-radius, radius, y0, y1, 0.1, 4 * radius)
+                glMatrixMode(GL_MODELVIEW)
+                glLoadIdentity()
+                gluLookAt(2 * radius * math.sin(theta), 0, 2 * radius * math.cos(theta), 0, 0, 0, 0, 1, 0)
+                glLightfv(GL_LIGHT0, GL_POSITION, light0_pos)
+                mesh.draw()
+
+        glPopAttrib()
+        glBindFramebuffer(GL_FRAMEBUFFER, 0)
+        glDeleteFramebuffers(1, [fbo])
+        glDeleteRenderbuffers(1, [depth])
+        glViewport(*viewport)
+        set_projection()
+
+    def far_mask(self, scene, eye, distance=IMPOSTOR_DISTANCE):
+        """
+        返回应使用替身绘制的记录掩码。
+        Devolve a máscara dos registos que devem ser desenhados como impostores.
+        """
+        rows = np.array([self._rows.get(k, -1) for k in scene.kinds], dtype=np.int16)[scene.records["kind"]]
+        pos = scene.records["position"]
+        d2 = (pos[:, 0] - eye[0]) ** 2 + (pos[:, 2] - eye[2]) ** 2
+        return (rows >= 0) & (scene.records["material"] < 0) & (d2 > distance * distance), rows
+
+    def draw(self, records, rows, eye):
+        """
+        一次绘制调用画出所有替身四边形。
+        Desenha todos os quads dos impostores numa só chamada.
+        """
+        n = len(records)
+        if n == 0:
+            return
+        pos = records["position"].astype(np.float32)
+        to_eye = np.stack([eye[0] - pos[:, 0], eye[2] - pos[:, 2]], axis=-1)
+        to_eye /= np.maximum(np.linalg.norm(to_eye, axis=1, keepdims=True), 1e-6)
+        right = np.stack([to_eye[:, 1], np.zeros(n, np.float32), -to_eye[:, 0]], axis=-1)
+
+        radius, y0, y1 = self.extent[rows].T
+        scale = records["scale"]
+        half = (radius * scale[:, 0])[:, None] * right
+        lo = (y0 * scale[:, 1])[:, None] * np.array([0, 1, 0], np.float32)
+        hi = (y1 * scale[:, 1])[:, None] * np.array([0, 1, 0], np.float32)
+        verts = np.stack([pos - half + lo, pos + half + lo, pos + half + hi, pos - half + hi], axis=1)
+
+        # Ângulo de vista no referencial do objeto (物体局部坐标下的观察角)
+        theta = np.arctan2(to_eye[:, 0], to_eye[:, 1]) - np.radians(records["rotation"][:, 0])
+        col = np.round(theta / (2 * math.pi / self.angles)).astype(np.int64) % self.angles
+        u0, u1 = col / self.angles, (col + 1) / self.angles
+        v0, v1 = rows / len(self.kinds), (rows + 1) / len(self.kinds)
+        tex = np.stack([np.stack([u0, v0], -1), np.stack([u1, v0], -1),
+                        np.stack([u1, v1], -1), np.stack([u0, v1], -1)], axis=1)
+
+        verts = np.ascontiguousarray(verts, dtype=np.float32).reshape(-1, 3)
+        tex = np.ascontiguousarray(tex, dtype=np.float32).reshape(-1, 2)
+
+        glDisable(GL_LIGHTING)
+        glEnable(GL_TEXTURE_2D)
+        glBindTexture(GL_TEXTURE_2D, self.texture)
+        glEnable(GL_ALPHA_TEST)
+        glAlphaFunc(GL_GREATER, 0.5)
+        if state.is_night:
+            glColor3f(0.15, 0.15, 0.25)
+        else:
+            glColor3f(1.0, 1.0, 1.0)
+        glEnableClientState(GL_VERTEX_ARRAY)
+        glEnableClientState(GL_TEXTURE_COORD_ARRAY)
+        glVertexPointer(3, GL_FLOAT, 0, verts)
+        glTexCoordPointer(2, GL_FLOAT, 0, tex)
+        glDrawArrays(GL_QUADS, 0, len(verts))
+        glDisableClientState(GL_VERTEX_ARRAY)
+        glDisableClientState(GL_TEXTURE_COORD_ARRAY)
+        glDisable(GL_ALPHA_TEST)
+        glDisable(GL_TEXTURE_2D)
+        glEnable(GL_LIGHTING)
+
+
+def build_impostor_atlas():
+    """
+    创建替身图集；不支持帧缓冲对象时返回 None。
+    Cria o atlas de impostores; devolve None se não houver suporte para FBOs.
+    """
+    if not bool(glGenFramebuffers):
+        return None
+    return ImpostorAtlas().build()
+
+
+# ============================================================================
+# 11. OCCLUSION CULLING (遮挡剔除)
+# ============================================================================
+
+# Objetos grandes (OCCLUDER_KINDS) são desenhados primeiro. Os restantes usam
+# occlusion queries com coerência temporal: o resultado de um frame só é lido no
+# frame seguinte (sem bloquear a GPU); objetos escondidos são testados apenas com
+# a sua caixa envolvente, objetos visíveis são re-testados a cada
+# OCCLUSION_VISIBLE_INTERVAL frames.
+# 大物体先画；其它物体使用带时间相干性的遮挡查询，被遮挡的物体只画包围盒来测试。
+
+
+def garage_interior_visible():
+    """
+    车库门“入口”测试：摄像机在车库内，或在门前且门洞在屏幕上可见。
+    Teste do portal da porta da garagem: câmara dentro da garagem, ou à frente
+    da porta com a abertura visível no ecrã. A porta fechada não chega a
+    selar a abertura (folga lateral), por isso o portal é sempre a abertura toda.
+    """
+    w, h, d, th = GARAGE_DIMS
+    mv = np.array(glGetFloatv(GL_MODELVIEW_MATRIX), dtype=np.float64).reshape(4, 4)
+    try:
+        eye = np.linalg.inv(mv)[3, :3]    # olho em coordenadas da garagem (车库局部坐标中的眼睛)
+    except np.linalg.LinAlgError:
+        return True     # vista degenerada: conservador (退化视图：保守处理)
+    if -w/2 <= eye[0] <= w/2 and -d <= eye[2] <= 0 and 0 <= eye[1] <= h:
+        return True
+
+    if eye[2] <= 0:
+        return False
+    proj = np.array(glGetFloatv(GL_PROJECTION_MATRIX), dtype=np.float64).reshape(4, 4)
+    corners = np.array([[-w/2, 0, 0, 1], [w/2, 0, 0, 1], [w/2, h, 0, 1], [-w/2, h, 0, 1]])
+    clip = corners @ mv @ proj
+    if (clip[:, 3] <= 1e-6).any():
+        return True     # portal atravessa o plano da câmara: conservador (保守处理)
+    ndc = clip[:, :2] / clip[:, 3:4]
+    return bool((ndc.min(axis=0) <= 1.0).all() and (ndc.max(axis=0) >= -1.0).all())
+
+
+class OcclusionCuller:
+    """
+    基于硬件遮挡查询的剔除器（每个场景保存自己的查询对象与可见性）。
+    Culling com occlusion queries (cada cena guarda as suas queries e visibilidade).
+    """
+
+    def __init__(self):
+        self.bounds = {}
+        self.frame = 0
+        self.drawn = 0
+        self.culled = 0
+
+    def _occlusion(self, scene):
+        occ = getattr(scene, "occlusion", None)
+        if occ is None or len(occ["queries"]) != len(scene):
+            self.release(scene)
+            n = len(scene)
+            occ = {"queries": glGenQueries(n) if n else np.zeros(0, np.uint32),
+                   "visible": np.ones(n, dtype=bool),
+                   "issued": np.zeros(n, dtype=bool)}
+            scene.occlusion = occ
+        return occ
+
+    def release(self, scene):
+        """
+        删除场景的查询对象（卸载地块或更换场景时调用）。
+        Apaga as queries da cena (ao descarregar um bloco ou trocar de cena).
+        """
+        occ = getattr(scene, "occlusion", None)
+        if occ is not None:
+            if len(occ["queries"]):
+                glDeleteQueries(len(occ["queries"]), occ["queries"])
+            scene.occlusion = None
+
+    def _bounds(self, kind):
+        b = self.bounds.get(kind)
+        if b is None:
+            pos = get_baked_mesh(SCENE_KINDS[kind]).arrays["positions"]
+            b = self.bounds[kind] = (pos.min(axis=0).tolist(), pos.max(axis=0).tolist())
+        return b
+
+    def begin_frame(self):
+        self.frame += 1
+        self.drawn = 0
+        self.culled = 0
+
+    def draw(self, scene, idx):
+        """
+        以遮挡剔除方式绘制 scene 中索引为 idx 的记录。
+        Desenha os registos idx da cena com occlusion culling.
+        """
+        occ = self._occlusion(scene)
+        queries, visible, issued = occ["queries"], occ["visible"], occ["issued"]
+        rec = scene.records
+        kinds = scene.kinds
+        occluder = np.array([k in OCCLUDER_KINDS or k in SCENE_DYNAMIC_KINDS for k in kinds])[rec["kind"][idx]]
+
+        # 1. Oclusores (遮挡物)
+        for i in idx[occluder].tolist():
+            draw_scene_record(scene, i)
+        self.drawn += int(occluder.sum())
+        idx = idx[~occluder]
+
+        # 2. Resultados do frame anterior (读取上一帧的查询结果)
+        for i in idx[issued[idx]].tolist():
+            q = int(queries[i])
+            if glGetQueryObjectuiv(q, GL_QUERY_RESULT_AVAILABLE):
+                visible[i] = glGetQueryObjectuiv(q, GL_QUERY_RESULT) > 0
+                issued[i] = False
+
+        # 3. Objetos visíveis: desenhar (re-testar periodicamente)
+        shown = idx[visible[idx]]
+        for i in shown.tolist():
+            query = not issued[i] and (i + self.frame) % OCCLUSION_VISIBLE_INTERVAL == 0
+            if query:
+                glBeginQuery(GL_SAMPLES_PASSED, int(queries[i]))
+            draw_scene_record(scene, i)
+            if query:
+                glEndQuery(GL_SAMPLES_PASSED)
+                issued[i] = True
+        self.drawn += len(shown)
+
+        # 4. Objetos escondidos: testar só a caixa envolvente (被遮挡物体只测试包围盒)
+        hidden = idx[~visible[idx] & ~issued[idx]]
+        self.culled += int((~visible[idx]).sum())
+        if not len(hidden):
+            return
+        glPushAttrib(GL_ENABLE_BIT | GL_COLOR_BUFFER_BIT | GL_DEPTH_BUFFER_BIT)
+        glDisable(GL_LIGHTING)
+        glDisable(GL_TEXTURE_2D)
+        glDisable(GL_CULL_FACE)
+        glColorMask(GL_FALSE, GL_FALSE, GL_FALSE, GL_FALSE)
+        glDepthMask(GL_FALSE)
+        for i in hidden.tolist():
+            glBeginQuery(GL_SAMPLES_PASSED, int(queries[i]))
+            draw_scene_record(scene, i, box=self._bounds(kinds[rec["kind"][i]]))
+            glEndQuery(GL_SAMPLES_PASSED)
+            issued[i] = True
+        glPopAttrib()
+
+
+def draw_box(lo, hi):
+    """
+    绘制轴对齐包围盒（仅用于遮挡查询）。
+    Desenha uma caixa alinhada com os eixos (só para occlusion queries).
+    """
+    x0, y0, z0 = lo
+    x1, y1, z1 = hi
+    glBegin(GL_QUADS)
+    glVertex3f(x0, y0, z0); glVertex3f(x1, y0, z0); glVertex3f(x1, y1, z0); glVertex3f(x0, y1, z0)
+    glVertex3f(x0, y0, z1); glVertex3f(x1, y0, z1); glVertex3f(x1, y1, z1); glVertex3f(x0, y1, z1)
+    glVertex3f(x0, y0, z0); glVertex3f(x0, y0, z1); glVertex3f(x0, y1, z1); glVertex3f(x0, y1, z0)
+    glVertex3f(x1, y0, z0); glVertex3f(x1, y0, z1); glVertex3f(x1, y1, z1); glVertex3f(x1, y1, z0)
+    glVertex3f(x0, y0, z0); glVertex3f(x1, y0, z0); glVertex3f(x1, y0, z1); glVertex3f(x0, y0, z1)
+    glVertex3f(x0, y1, z0); glVertex3f(x1, y1, z0); glVertex3f(x1, y1, z1); glVertex3f(x0, y1, z1)
+    glEnd()
+
+
+# ============================================================================
+# 12. SIMULATION THREAD (模拟线程)
+# ============================================================================
+
+# A simulação corre numa thread própria a SIM_RATE Hz sobre um estado privado.
+# Cada tick publica um snapshot imutável (tuplo) trocando uma única referência,
+# por isso a renderização nunca precisa de locks: lê o par (anterior, atual) e
+# interpola entre os dois.
+# 模拟在独立线程中以固定频率运行；每个 tick 通过替换一个引用发布不可变快照，
+# 渲染线程无需加锁，只读取（上一个，当前）快照对并在两者之间插值。
+
+
+def step_door(s, dt):
+    """
+    车门与车库门沿关键帧轨道运动（与帧率无关）。
+    As portas do carro e da garagem seguem as suas trilhas de keyframes (independente da taxa de frames).
+    """
+    car_door, garage_door = animation_tracks["car_door"], animation_tracks["garage_door"]
+    s.car_door_angle = car_door.advance(s.car_door_angle, car_door.end if s.car_door_open else car_door.start, dt)
+    if AUTO_GARAGE_DOOR:
+        # Porta da garagem automática, comandada pelas zonas (由触发区域控制的自动车库门)
+        s.garage_door_target = garage_door.end if s.car_in_garage or s.car_at_garage_door else garage_door.start
+    if s.garage_door_target >= 0.0:
+        s.garage_door_height = garage_door.advance(s.garage_door_height, s.garage_door_target, dt)
+        if s.garage_door_height == s.garage_door_target:
+            s.garage_door_target = -1.0
+
+
+def apply_special_key(s, k):
+    """
+    方向键：转向与移动。
+    Setas: direção e deslocamento.
+    """
+    # [REQUISITO: O volante poderá controlar o ângulo de viragem do veículo] (方向盘控制车辆转向角度)
+    if k == GLUT_KEY_LEFT:
+        s.steering_angle = min(s.steering_angle + STEER_SPEED, MAX_STEER)
+    elif k == GLUT_KEY_RIGHT:
+        s.steering_angle = max(s.steering_angle - STEER_SPEED, -MAX_STEER)
+
+    # [REQ 5] O veículo deve poder deslocar-se.
+    # Mude 'MOVE_SPEED' (no início do ficheiro) para alterar a velocidade. 修改文件开头的 'MOVE_SPEED' 来改变车速。
+    if k == GLUT_KEY_UP:
+        move_car(s, MOVE_SPEED)
+    elif k == GLUT_KEY_DOWN:
+        move_car(s, -MOVE_SPEED)
+
+
+def move_car(s, distance):
+    """
+    沿车头方向移动汽车（负数为倒车）。
+    Desloca o carro na direção em que aponta (negativo = marcha-atrás).
+    """
+    s.car_pos[0] -= distance * math.sin(s.car_yaw)
+    s.car_pos[2] -= distance * math.cos(s.car_yaw)
+    # [REQUISITO: O carro poderá virar além de se deslocar em linha recta] (车除了直线移动外还能转弯)
+    s.car_yaw += (distance / WHEELBASE) * math.tan(math.radians(s.steering_angle))
+    # [REQ 4] Rodas giram ao deslocar.
+    # Para rodar as rodas mais depressa, mude '15' para '30'. 想要轮子转得更快，把 '15' 改成 '30'。
+    s.wheel_rotation += 15 * distance / MOVE_SPEED
+
+
+def apply_key(s, k):
+    """
+    影响模拟状态的普通按键。
+    Teclas comuns que alteram o estado da simulação.
+    """
+    # [REQ 2] Tecla para abrir porta. 打开车门
+    if k=='o': s.car_door_open = not s.car_door_open
+
+    # [REQ 5] Teclas para abrir/fechar garagem (a porta anima até ao fim). 打开/关闭车库门
+    if k=='g': s.garage_door_target = animation_tracks["garage_door"].end
+    if k=='f': s.garage_door_target = animation_tracks["garage_door"].start
+
+    if k==' ': s.steering_angle = 0.0
+    if k=='n': s.is_night = not s.is_night
+    if k=='h': s.headlights_on = not s.headlights_on
+
+
+def blend_fields(names, a, b, alpha):
+    """
+    在两个状态元组之间插值（只插值 SIM_INTERPOLATED 中的字段）。
+    Interpola entre dois tuplos de estado (só os campos de SIM_INTERPOLATED).
+    """
+    for name, x, y in zip(names, a, b):
+        if name in SIM_INTERPOLATED:
+            if isinstance(y, tuple):
+                y = [u + (v - u) * alpha for u, v in zip(x, y)]
+            else:
+                y = x + (y - x) * alpha
+        elif isinstance(y, tuple):
+            y = list(y)
+        yield name, y
+
+
+class SimulationThread:
+    """
+    固定频率的模拟线程，发布双缓冲的状态快照。
+    Thread de simulação a frequência fixa que publica snapshots do estado.
+    """
+
+    def __init__(self, rate=SIM_RATE):
+        self.dt = 1.0 / rate
+        self.state = state.copy()     # estado privado da simulação (模拟私有状态)
+        self.commands = collections.deque()
+        snap = self.snapshot(time.perf_counter())
+        self.latest = (snap, snap)
+        self.running = True
+        self.thread = threading.Thread(target=self.run, name="simulation", daemon=True)
+
+    def start(self):
+        self.thread.start()
+
+    def stop(self):
+        self.running = False
+        self.thread.join()
+
+    def post(self, fn, *args):
+        """
+        从输入回调提交命令（在下一个 tick 执行）。
+        Envia um comando dos callbacks de input (aplicado no próximo tick).
+        """
+        self.commands.append((fn, args))
+
+    def snapshot(self, t):
+        s = self.state
+        return (t,) + tuple(tuple(v) if isinstance(v, list) else v
+                            for v in (getattr(s, name) for name in SIM_FIELDS))
+
+    def tick(self, t):
+        while self.commands:
+            fn, args = self.commands.popleft()
+            fn(self.state, *args)
+        if command_server is not None:
+            command_server.tick(self.state)
+        step_autopilot(self.state, self.dt)
+        step_triggers(self.state)
+        step_door(self.state, self.dt)
+        recorder = replay_recorder
+        if recorder is not None:
+            recorder.record(t, self.state)
+        # Troca atómica de uma referência: sem locks (单个引用替换，无需加锁)
+        self.latest = (self.latest[1], self.snapshot(t))
+
+    def run(self):
+        next_t = time.perf_counter()
+        while self.running:
+            now = time.perf_counter()
+            if now < next_t:
+                time.sleep(next_t - now)
+                continue
+            self.tick(next_t)
+            next_t += self.dt
+            if now - next_t > 0.25:     # atraso grande: não tentar recuperar (落后太多则跳过)
+                next_t = now
+
+    def apply(self, now=None):
+        """
+        渲染线程：把最新快照（插值后）写入渲染用的 state。
+        Thread de renderização: copia o snapshot mais recente (interpolado)
+        para o 'state' usado pelas funções draw_*.
+        """
+        prev, cur = self.latest
+        if now is None:
+            now = time.perf_counter()
+        alpha = 0.0 if cur[0] <= prev[0] else min(1.0, max(0.0, (now - cur[0]) / self.dt))
+        for name, value in blend_fields(SIM_FIELDS, prev[1:], cur[1:], alpha):
+            setattr(state, name, value)
+
+
+# ============================================================================
+# 13. FRAME CAPTURE (帧捕获)
+# ============================================================================
+
+# A leitura dos píxeis usa um anel de PBOs: glReadPixels do frame N só copia
+# para a PBO (assíncrono) e os dados só são lidos CAPTURE_PBO_COUNT-1 frames
+# depois, sem parar o pipeline. A codificação (PNG ou vídeo raw rgb24) corre num
+# pool de processos.
+# 使用 PBO 环形缓冲异步读取像素：第 N 帧的数据在几帧之后才映射读取，不会阻塞管线；
+# 编码（PNG 或 raw rgb24 视频）在进程池中完成。
+
+
+def _png_chunk(tag, data):
+    return struct.pack(">I", len(data)) + tag + data + struct.pack(">I", zlib.crc32(tag + data) & 0xFFFFFFFF)
+
+
+def encode_frame(path, fmt, width, height, pixels, index):
+    """
+    在工作进程中编码一帧（OpenGL 的行从下到上，需要翻转）。
+    Codifica um frame num processo do pool (as linhas do OpenGL vêm de baixo
+    para cima e são invertidas aqui).
+    """
+    rows = np.frombuffer(pixels, dtype=np.uint8).reshape(height, width * 3)[::-1]
+    if fmt == "raw":
+        # Cada frame tem posição fixa no ficheiro: a ordem de escrita não importa
+        # 每帧在文件中的位置固定，写入顺序无关紧要
+        fd = os.open(path, os.O_WRONLY | os.O_CREAT, 0o644)
+        try:
+            os.pwrite(fd, rows.tobytes(), index * width * height * 3)
+        finally:
+            os.close(fd)
+        return path
+    filtered = np.zeros((height, width * 3 + 1), dtype=np.uint8)     # filtro 0 por linha (每行过滤类型 0)
+    filtered[:, 1:] = rows
+    name = os.path.join(path, "frame_%06d.png" % index)
+    with open(name, "wb") as f:
+        f.write(b"\x89PNG\r\n\x1a\n"
+                + _png_chunk(b"IHDR", struct.pack(">IIBBBBB", width, height, 8, 2, 0, 0, 0))
+                + _png_chunk(b"IDAT", zlib.compress(filtered.tobytes(), 1))     # nível 1: rápido (快速压缩)
+                + _png_chunk(b"IEND", b""))
+    return name
+
+
+class FrameCapture:
+    """
+    基于 PBO 环形缓冲的异步帧捕获器。
+    Captura assíncrona de frames com um anel de PBOs.
+    """
+
+    def __init__(self, directory=None, fmt=None, pbo_count=CAPTURE_PBO_COUNT, workers=CAPTURE_WORKERS):
+        self.fmt = fmt or CAPTURE_FORMAT
+        self.path = os.path.join(directory or CAPTURE_DIR, time.strftime("%Y%m%d-%H%M%S"))
+        os.makedirs(self.path, exist_ok=True)
+        self.pool = futures.ProcessPoolExecutor(
+            workers, mp_context=multiprocessing.get_context("spawn"))
+        self.pending = collections.deque()
+        self.pbos = []
+        self.slots = [None] * pbo_count      # frame guardado em cada PBO (每个 PBO 中的帧号)
+        self.size = None
+        self.frame = 0
+        self.first = 0                       # primeiro frame com o tamanho atual (当前尺寸的第一帧)
+        self.started = time.perf_counter()
+
+    def _allocate(self, width, height):
+        self._drain()
+        if self.pbos:
+            glDeleteBuffers(len(self.pbos), self.pbos)
+        self.pbos = [int(b) for b in np.atleast_1d(glGenBuffers(len(self.slots)))]
+        for pbo in self.pbos:
+            glBindBuffer(GL_PIXEL_PACK_BUFFER, pbo)
+            glBufferData(GL_PIXEL_PACK_BUFFER, width * height * 3, None, GL_STREAM_READ)
+        glBindBuffer(GL_PIXEL_PACK_BUFFER, 0)
+        self.size = (width, height)
+        self.first = self.frame
+
+    def _target(self):
+        width, height = self.size
+        if self.fmt == "raw":
+            return os.path.join(self.path, "frames-%dx%d.rgb" % (width, height))
+        return self.path
+
+    def _collect(self, slot):
+        frame = self.slots[slot]
+        if frame is None:
+            return
+        width, height = self.size
+        glBindBuffer(GL_PIXEL_PACK_BUFFER, self.pbos[slot])
+        ptr = glMapBuffer(GL_PIXEL_PACK_BUFFER, GL_READ_ONLY)
+        pixels = ctypes.string_at(ptr, width * height * 3)
+        glUnmapBuffer(GL_PIXEL_PACK_BUFFER)
+        glBindBuffer(GL_PIXEL_PACK_BUFFER, 0)
+        self.slots[slot] = None
+
+        index = frame - self.first if self.fmt == "raw" else frame
+        self.pending.append(self.pool.submit(encode_frame, self._target(), self.fmt, width, height, pixels, index))
+        while self.pending and (self.pending[0].done() or len(self.pending) > CAPTURE_MAX_PENDING):
+            self.pending.popleft().result()
+
+    def _drain(self):
+        for slot in sorted(range(len(self.slots)), key=lambda s: -1 if self.slots[s] is None else self.slots[s]):
+            self._collect(slot)
+
+    def capture(self):
+        """
+        在 glutSwapBuffers 之前调用：异步读取当前帧，并取回较早的一帧。
+        Chamar antes de glutSwapBuffers: lê o frame atual para uma PBO e
+        recolhe o frame de há CAPTURE_PBO_COUNT-1 frames.
+        """
+        x, y, width, height = (int(v) for v in glGetIntegerv(GL_VIEWPORT))
+        if (width, height) != self.size:
+            self._allocate(width, height)
+        n = len(self.slots)
+        slot = self.frame % n
+        glBindBuffer(GL_PIXEL_PACK_BUFFER, self.pbos[slot])
+        glPixelStorei(GL_PACK_ALIGNMENT, 1)
+        raw_glReadPixels(x, y, width, height, GL_RGB, GL_UNSIGNED_BYTE, ctypes.c_void_p(0))
+        glBindBuffer(GL_PIXEL_PACK_BUFFER, 0)
+        self.slots[slot] = self.frame
+        self.frame += 1
+        self._collect((slot + 1) % n)
+
+    def stop(self):
+        """
+        结束录制：取回剩余帧并等待编码完成。
+        Termina a gravação: recolhe os frames restantes e espera pela codificação.
+        """
+        self._drain()
+        if self.pbos:
+            glDeleteBuffers(len(self.pbos), self.pbos)
+            self.pbos = []
+        for future in self.pending:
+            future.result()
+        self.pending.clear()
+        self.pool.shutdown(wait=True)
+        elapsed = time.perf_counter() - self.started
+        if self.fmt == "raw" and self.size is not None:
+            with open(os.path.join(self.path, "capture.json"), "w") as f:
+                json.dump({"format": "rgb24", "width": self.size[0], "height": self.size[1],
+                           "frames": self.frame - self.first, "fps": round(self.frame / max(elapsed, 1e-6), 2)}, f)
+        print("Capture: %d frames -> %s" % (self.frame, self.path))
+
+
+def toggle_capture():
+    """
+    开始/停止录制（按键 'r'）。
+    Inicia/termina a gravação (tecla 'r').
+    """
+    global frame_capture
+    if frame_capture is None:
+        frame_capture = FrameCapture()
+        print("Capture: recording to %s" % frame_capture.path)
+    else:
+        frame_capture.stop()
+        frame_capture = None
+
+
+# ============================================================================
+# 14. REPLAYS & BATCH RENDERING (回放与批量渲染)
+# ============================================================================
+
+# Um replay é a sequência de estados (State.to_bytes) gravada a cada tick da
+# simulação, guardada no mesmo formato binário das malhas (save_blob/load_blob).
+# O render em lote divide os frames dos jobs por processos, cada um com o seu
+# contexto OpenGL headless (EGL), e grava a saída ordenada por job/frame.
+# 回放是每个模拟 tick 记录的状态序列；批量渲染把各任务的帧分给多个进程，
+# 每个进程有自己的无窗口 OpenGL 上下文（EGL），输出按任务/帧编号排序。
+
+REPLAY_FORMAT_VERSION = 1
+BATCH_JOB_DEFAULTS = dict({name: default for name, fmt, default in STATE_LAYOUT
+                           if name in ("camera_mode", "cam_yaw", "cam_pitch", "cam_dist")},
+                          start=0.0, end=None)
+
+replay_recorder = None
+_batch_replay = None
+
+
+class ReplayRecorder:
+    """
+    记录每个模拟 tick 的状态。
+    Grava o estado de cada tick da simulação.
+    """
+
+    def __init__(self):
+        self.times = []
+        self.states = []
+
+    def record(self, t, s):
+        self.states.append(s.to_bytes())
+        self.times.append(t)
+
+    def save(self, path):
+        n = min(len(self.times), len(self.states))
+        times = np.array(self.times[:n], dtype=np.float64)
+        states = np.frombuffer(b"".join(self.states[:n]), dtype=np.uint8).reshape(n, State._struct.size)
+        save_blob(path, {"time": times - (times[0] if n else 0.0), "state": states},
+                  {"layout": [[name, fmt] for name, fmt, default in STATE_LAYOUT]},
+                  version=REPLAY_FORMAT_VERSION)
+
+
+class Replay:
+    """
+    已加载的回放（mmap 视图），可按时间取插值后的状态。
+    Replay carregado (vistas mmap); devolve o estado interpolado num instante.
+    """
+
+    def __init__(self, times, states):
+        self.times = times
+        self.states = states
+
+    def __len__(self):
+        return len(self.times)
+
+    @property
+    def duration(self):
+        return float(self.times[-1]) if len(self.times) else 0.0
+
+    def state_at(self, t):
+        i = int(np.searchsorted(self.times, t, side="right"))
+        a = State.from_bytes(self.states[max(i - 1, 0)].tobytes()).astuple()
+        if i <= 0 or i >= len(self.times):
+            return State.fromtuple(a)
+        b = State.from_bytes(self.states[i].tobytes()).astuple()
+        t0, t1 = float(self.times[i - 1]), float(self.times[i])
+        alpha = (t - t0) / (t1 - t0) if t1 > t0 else 0.0
+        return State(**dict(blend_fields(State.__slots__, a, b, alpha)))
+
+
+def load_replay(path):
+    """
+    加载回放文件；文件无效或状态布局不同时返回 None。
+    Carrega um replay; devolve None se o ficheiro for inválido ou o layout do estado mudou.
+    """
+    loaded = load_blob(path, version=REPLAY_FORMAT_VERSION)
+    if loaded is None:
+        return None
+    arrays, meta = loaded
+    if meta.get("layout") != [[name, fmt] for name, fmt, default in STATE_LAYOUT]:
+        return None
+    return Replay(arrays["time"], arrays["state"])
+
+
+def toggle_replay_recording():
+    """
+    开始/停止记录回放（按键 'l'）。
+    Inicia/termina a gravação de um replay (tecla 'l').
+    """
+    global replay_recorder
+    if replay_recorder is None:
+        replay_recorder = ReplayRecorder()
+        print("Replay: recording")
+    else:
+        recorder, replay_recorder = replay_recorder, None
+        path = os.path.join(REPLAY_DIR, time.strftime("%Y%m%d-%H%M%S") + ".cgreplay")
+        recorder.save(path)
+        print("Replay: %d states -> %s" % (len(recorder.times), path))
+
+
+def create_headless_context(width, height):
+    """
+    创建无窗口的 EGL pbuffer 上下文（导入 OpenGL 前需设置 PYOPENGL_PLATFORM=egl）。
+    Cria um contexto EGL pbuffer sem janela (requer PYOPENGL_PLATFORM=egl antes
+    de importar o OpenGL).
+    """
+    from OpenGL import EGL
+    display = EGL.eglGetDisplay(EGL.EGL_DEFAULT_DISPLAY)
+    major, minor = EGL.EGLint(), EGL.EGLint()
+    if not EGL.eglInitialize(display, ctypes.pointer(major), ctypes.pointer(minor)):
+        raise RuntimeError("eglInitialize failed")
+    attrs = (EGL.EGLint * 13)(EGL.EGL_SURFACE_TYPE, EGL.EGL_PBUFFER_BIT,
+                              EGL.EGL_RED_SIZE, 8, EGL.EGL_GREEN_SIZE, 8, EGL.EGL_BLUE_SIZE, 8,
+                              EGL.EGL_DEPTH_SIZE, 24, EGL.EGL_RENDERABLE_TYPE, EGL.EGL_OPENGL_BIT,
+                              EGL.EGL_NONE)
+    config, count = EGL.EGLConfig(), EGL.EGLint()
+    if not EGL.eglChooseConfig(display, attrs, ctypes.pointer(config), 1, ctypes.pointer(count)) or not count.value:
+        raise RuntimeError("no EGL config for an OpenGL pbuffer")
+    surface = EGL.eglCreatePbufferSurface(display, config, (EGL.EGLint * 5)(EGL.EGL_WIDTH, width,
+                                                                             EGL.EGL_HEIGHT, height,
+                                                                             EGL.EGL_NONE))
+    EGL.eglBindAPI(EGL.EGL_OPENGL_API)
+    context = EGL.eglCreateContext(display, config, EGL.EGL_NO_CONTEXT, None)
+    if not EGL.eglMakeCurrent(display, surface, surface, context):
+        raise RuntimeError("eglMakeCurrent failed")
+    return display, surface, context
+
+
+_headless_meshes = {}
+
+
+def _draw_headless_mesh(key, build):
+    mesh = _headless_meshes.get(key)
+    if mesh is None:
+        mesh = _headless_meshes[key] = tuple(np.ascontiguousarray(a, dtype=np.float32) for a in build())
+    positions, normals = mesh
+    glEnableClientState(GL_VERTEX_ARRAY)
+    glEnableClientState(GL_NORMAL_ARRAY)
+    glVertexPointer(3, GL_FLOAT, 0, positions)
+    glNormalPointer(GL_FLOAT, 0, normals)
+    glDrawArrays(GL_TRIANGLES, 0, len(positions))
+    glDisableClientState(GL_NORMAL_ARRAY)
+    glDisableClientState(GL_VERTEX_ARRAY)
+
+
+def install_headless_glut():
+    """
+    无 glutInit 时，用 CPU 网格替换 GLUT 的实体绘制函数。
+    Sem glutInit, substitui os sólidos do GLUT pelas malhas geradas na CPU.
+    """
+    g = globals()
+    g["glutSolidCube"] = lambda size: _draw_headless_mesh(("cube", size), lambda: solid_cube_mesh(size))
+    g["glutSolidSphere"] = lambda r, sl, st: _draw_headless_mesh(("sphere", r, sl, st),
+                                                                 lambda: solid_sphere_mesh(r, sl, st))
+    g["glutSolidCone"] = lambda b, h, sl, st: _draw_headless_mesh(("cone", b, h, sl, st),
+                                                                  lambda: solid_cone_mesh(b, h, sl, st))
+    g["glutSolidTorus"] = lambda i, o, sd, rg: _draw_headless_mesh(("torus", i, o, sd, rg),
+                                                                   lambda: solid_torus_mesh(i, o, sd, rg))
+    g["glutSolidDodecahedron"] = lambda: _draw_headless_mesh(("dodecahedron",), solid_dodecahedron_mesh)
+    g["glutSwapBuffers"] = glFlush
+    g["glutPostRedisplay"] = lambda: None
+
+
+def setup_headless(width=800, height=600, finish=True):
+    """
+    创建（一次）无窗口上下文并初始化场景，无需 GLUT。
+    Cria (uma vez) um contexto sem janela e inicializa a cena, sem GLUT.
+    finish=False deixa as tarefas adiadas na fila (para medir o primeiro frame).
+    """
+    global headless_context, USE_SIM_THREAD, USE_OCCLUSION_QUERIES
+    if headless_context is not None:
+        return headless_context
+    USE_SIM_THREAD = False
+    # As queries usam o frame anterior; entre frames não consecutivos dariam erros
+    # 遮挡查询依赖上一帧，不连续的帧会出错
+    USE_OCCLUSION_QUERIES = False
+    with startup.phase("context"):
+        headless_context = create_headless_context(width, height)
+        install_headless_glut()
+    init()
+    glViewport(0, 0, width, height)
+    if finish:
+        startup.finish()
+    return headless_context
+
+
+def _batch_worker_init(replay_path, width, height):
+    global _batch_replay
+    setup_headless(width, height)
+    _batch_replay = load_replay(replay_path)
+
+
+def _render_chunk(job, frames, target, fmt, width, height):
+    global state
+    glPixelStorei(GL_PACK_ALIGNMENT, 1)
+    for index, t in frames:
+        s = _batch_replay.state_at(t)
+        s.camera_mode, s.cam_yaw, s.cam_pitch, s.cam_dist = (job["camera_mode"], job["cam_yaw"],
+                                                             job["cam_pitch"], job["cam_dist"])
+        state = s
+        draw_scene()
+        pixels = glReadPixels(0, 0, width, height, GL_RGB, GL_UNSIGNED_BYTE)
+        encode_frame(target, fmt, width, height, bytes(pixels), index)
+    return len(frames)
+
+
+def render_batch(replay, jobs, output, fps=BATCH_FPS, fmt="png", width=800, height=600,
+                 workers=BATCH_WORKERS):
+    """
+    批量渲染回放：jobs 为 {camera_mode, cam_yaw, cam_pitch, cam_dist, start, end} 列表。
+    Renderiza um replay em lote. 'jobs' é uma lista de dicionários com
+    camera_mode, cam_yaw, cam_pitch, cam_dist, start e end (segundos).
+    Saída: output/job_NNN/ (PNG ou raw) e output/manifest.json.
+    """
+    loaded = load_replay(replay)
+    if loaded is None:
+        raise ValueError("invalid replay file: %s" % replay)
+
+    tasks = []
+    manifest = []
+    for j, job in enumerate(jobs):
+        job = dict(BATCH_JOB_DEFAULTS, **job)
+        end = loaded.duration if job["end"] is None else min(job["end"], loaded.duration)
+        times = np.arange(job["start"], end + 1e-9, 1.0 / fps)
+        target = os.path.join(output, "job_%03d" % j)
+        os.makedirs(target, exist_ok=True)
+        if fmt == "raw":
+            target = os.path.join(target, "frames-%dx%d.rgb" % (width, height))
+        for k in range(0, len(times), BATCH_CHUNK):
+            frames = [(i, float(t)) for i, t in enumerate(times[k:k + BATCH_CHUNK], k)]
+            tasks.append((job, frames, target, fmt, width, height))
+        manifest.append(dict(job, end=end, frames=len(times), path=os.path.relpath(target, output)))
+
+    # Os processos herdam o ambiente: OpenGL via EGL, uma thread de llvmpipe por processo
+    # 子进程继承环境变量：通过 EGL 使用 OpenGL，每个进程只用一个 llvmpipe 线程
+    saved = {k: os.environ.get(k) for k in ("PYOPENGL_PLATFORM", "EGL_PLATFORM", "LP_NUM_THREADS")}
+    os.environ["PYOPENGL_PLATFORM"] = "egl"
+    os.environ.setdefault("EGL_PLATFORM", "surfaceless")
+    os.environ.setdefault("LP_NUM_THREADS", "1")
+    try:
+        with futures.ProcessPoolExecutor(
+                workers, mp_context=multiprocessing.get_context("spawn"),
+                initializer=_batch_worker_init, initargs=(replay, width, height)) as pool:
+            pending = [pool.submit(_render_chunk, *task) for task in tasks]
+            total = sum(len(task[1]) for task in tasks)
+            done = 0
+            for future in futures.as_completed(pending):
+                done += future.result()
+                print("\rBatch: %d/%d frames" % (done, total), end="", flush=True)
+            print()
+    finally:
+        for k, v in saved.items():
+            if v is None:
+                os.environ.pop(k, None)
+            else:
+                os.environ[k] = v
+
+    with open(os.path.join(output, "manifest.json"), "w") as f:
+        json.dump({"replay": os.path.abspath(replay), "fps": fps, "format": fmt,
+                   "width": width, "height": height, "jobs": manifest}, f, indent=2)
+    return manifest
+
+
+# ============================================================================
+# 15. DRIVING ENVIRONMENT (驾驶环境)
+# ============================================================================
+
+# Interface ao estilo Gym para conduzir o carro por código (controladores de
+# estacionamento): reset()/step(action) sem janela nem OpenGL; a observação
+# renderizada (câmaras existentes, baixa resolução) é opcional.
+# Gym 风格的编程接口：reset()/step(action) 不需要窗口或 OpenGL；渲染观测可选。
+
+
+class Colliders:
+    """
+    xz 平面上的静态碰撞盒（车身高度以下的物体轮廓 + 车库墙和门）。
+    Caixas de colisão estáticas no plano xz (contorno dos objetos abaixo da
+    altura do carro + paredes e porta da garagem).
+    """
+
+    def __init__(self, scene, height=CAR_HEIGHT):
+        w, h, d, th = GARAGE_DIMS
+        walls = ((-w/2 - 0.1, -d, -w/2 + 0.1, 0.0), (w/2 - 0.1, -d, w/2 + 0.1, 0.0),
+                 (-w/2, -d - 0.1, w/2, -d + 0.1))
+        boxes, doors, garages = [], [], []
+        footprints = {}
+        for i in range(len(scene)):
+            rec = scene.records[i]
+            kind = scene.kinds[int(rec["kind"])]
+            m = record_matrix(rec)
+            if kind == "garage":
+                boxes.extend(_transform_box(m, box) for box in walls)
+                doors.append(_transform_box(m, (-w/2, -0.1, w/2, 0.1)))
+                garages.append(_transform_box(m, (-w/2, -d, w/2, 0.0)))
+                continue
+            points = footprints.get(kind)
+            if points is None:
+                points = footprints[kind] = load_or_bake(SCENE_KINDS[kind]).arrays["positions"].astype(np.float64)
+            world = points @ m[:3, :3].T + m[:3, 3]
+            low = world[world[:, 1] < height]
+            if len(low):
+                boxes.append((low[:, 0].min(), low[:, 2].min(), low[:, 0].max(), low[:, 2].max()))
+        self.height = height
+        self.boxes = np.array(boxes + doors, dtype=np.float64).reshape(-1, 4)
+        self.is_door = np.arange(len(self.boxes)) >= len(boxes)
+        self.corners = self.boxes[:, [[0, 1], [2, 1], [2, 3], [0, 3]]]      # (M, 4, 2)
+        self.garages = np.array(garages, dtype=np.float64).reshape(-1, 4)
+
+    def hit(self, x, z, yaw, door_height=0.0):
+        """
+        汽车（有向包围盒）是否与任何碰撞盒相交（分离轴测试）。
+        Testa se o carro (caixa orientada) interseta alguma caixa (teorema do eixo separador).
+        """
+        return bool(self.hit_many(np.array([x]), np.array([z]), np.array([yaw]), np.array([door_height]))[0])
+
+    def hit_many(self, x, z, yaw, door_height):
+        """
+        hit() 的批量版本：N 辆车一次测试，返回 (N,) 布尔数组。
+        Versão em lote de hit(): testa N carros de uma vez e devolve um array (N,).
+        """
+        corners = car_corners(x, z, yaw)                                     # (N, 4, 2)
+        lo, hi = corners.min(axis=1), corners.max(axis=1)
+        b = self.boxes
+        candidate = ((b[:, 0] <= hi[:, :1]) & (b[:, 2] >= lo[:, :1]) &
+                     (b[:, 1] <= hi[:, 1:]) & (b[:, 3] >= lo[:, 1:]) &
+                     (~self.is_door | (door_height[:, None] < self.height)))   # (N, M)
+        rows = np.flatnonzero(candidate.any(axis=1))
+        result = np.zeros(len(x), dtype=bool)
+        if not len(rows):
+            return result
+        rel = self.corners[None] - np.stack([x[rows], z[rows]], axis=-1)[:, None, None, :]   # (n, M, 4, 2)
+        c, s = np.cos(yaw[rows])[:, None, None], np.sin(yaw[rows])[:, None, None]
+        pu = rel[..., 0] * c - rel[..., 1] * s
+        pv = rel[..., 0] * s + rel[..., 1] * c
+        x0, z0, x1, z1 = CAR_FOOTPRINT
+        separated = ((pu.max(axis=-1) < x0) | (pu.min(axis=-1) > x1) |
+                     (pv.max(axis=-1) < z0) | (pv.min(axis=-1) > z1))
+        result[rows] = (candidate[rows] & ~separated).any(axis=1)
+        return result
+
+    def in_garage(self, x, z, yaw):
+        """
+        汽车是否完全位于某个车库内。
+        O carro está completamente dentro de uma garagem?
+        """
+        return bool(self.in_garage_many(np.array([x]), np.array([z]), np.array([yaw]))[0])
+
+    def in_garage_many(self, x, z, yaw):
+        corners = car_corners(x, z, yaw)
+        lo, hi = corners.min(axis=1), corners.max(axis=1)
+        g = self.garages
+        return ((g[:, 0] <= lo[:, :1]) & (g[:, 1] <= lo[:, 1:]) &
+                (g[:, 2] >= hi[:, :1]) & (g[:, 3] >= hi[:, 1:])).any(axis=1)
+
+
+def _transform_box(m, box):
+    x0, z0, x1, z1 = box
+    corners = np.array([[x0, 0, z0, 1], [x1, 0, z0, 1], [x1, 0, z1, 1], [x0, 0, z1, 1]]) @ m.T
+    return (corners[:, 0].min(), corners[:, 2].min(), corners[:, 0].max(), corners[:, 2].max())
+
+
+def car_corners(x, z, yaw):
+    """
+    汽车轮廓四个角的世界坐标 (..., 4, 2)；x, z, yaw 可以是数组。
+    Cantos do contorno do carro em coordenadas do mundo (..., 4, 2); x, z e yaw podem ser arrays.
+    """
+    x, z, yaw = (np.asarray(v, dtype=np.float64)[..., None] for v in (x, z, yaw))
+    c, s = np.cos(yaw), np.sin(yaw)
+    x0, z0, x1, z1 = CAR_FOOTPRINT
+    lx = np.array([x0, x1, x1, x0])
+    lz = np.array([z0, z0, z1, z1])
+    return np.stack([x + lx * c + lz * s, z - lx * s + lz * c], axis=-1)
+
+
+class OffscreenTarget:
+    """
+    离屏帧缓冲（颜色 + 深度渲染缓冲；texture=True 时颜色是可采样的纹理）。
+    Framebuffer fora do ecrã (renderbuffers de cor e profundidade; com texture=True
+    a cor é uma textura que pode ser usada no desenho).
+    """
+
+    def __init__(self, width, height, texture=False):
+        self.width, self.height = width, height
+        self.texture = texture
+        previous = int(glGetIntegerv(GL_FRAMEBUFFER_BINDING))
+        self.fbo = glGenFramebuffers(1)
+        glBindFramebuffer(GL_FRAMEBUFFER, self.fbo)
+        if texture:
+            self.color = glGenTextures(1)
+            self.depth = glGenRenderbuffers(1)
+            glBindTexture(GL_TEXTURE_2D, self.color)
+            glTexImage2D(GL_TEXTURE_2D, 0, GL_RGBA8, width, height, 0, GL_RGBA, GL_UNSIGNED_BYTE, None)
+            glTexParameteri(GL_TEXTURE_2D, GL_TEXTURE_MIN_FILTER, GL_LINEAR)
+            glTexParameteri(GL_TEXTURE_2D, GL_TEXTURE_MAG_FILTER, GL_LINEAR)
+            glTexParameteri(GL_TEXTURE_2D, GL_TEXTURE_WRAP_S, GL_CLAMP_TO_EDGE)
+            glTexParameteri(GL_TEXTURE_2D, GL_TEXTURE_WRAP_T, GL_CLAMP_TO_EDGE)
+            glBindTexture(GL_TEXTURE_2D, 0)
+            glFramebufferTexture2D(GL_FRAMEBUFFER, GL_COLOR_ATTACHMENT0, GL_TEXTURE_2D, self.color, 0)
+        else:
+            self.color, self.depth = glGenRenderbuffers(2)
+            glBindRenderbuffer(GL_RENDERBUFFER, self.color)
+            glRenderbufferStorage(GL_RENDERBUFFER, GL_RGBA8, width, height)
+            glFramebufferRenderbuffer(GL_FRAMEBUFFER, GL_COLOR_ATTACHMENT0, GL_RENDERBUFFER, self.color)
+        glBindRenderbuffer(GL_RENDERBUFFER, self.depth)
+        glRenderbufferStorage(GL_RENDERBUFFER, GL_DEPTH_COMPONENT24, width, height)
+        glFramebufferRenderbuffer(GL_FRAMEBUFFER, GL_DEPTH_ATTACHMENT, GL_RENDERBUFFER, self.depth)
+        status = glCheckFramebufferStatus(GL_FRAMEBUFFER)
+        glBindRenderbuffer(GL_RENDERBUFFER, 0)
+        glBindFramebuffer(GL_FRAMEBUFFER, previous)
+        if status != GL_FRAMEBUFFER_COMPLETE:
+            self.release()
+            raise RuntimeError("incomplete framebuffer: 0x%x" % status)
+        self.viewport = None
+        self.previous = 0
+
+    def bind(self):
+        self.viewport = glGetIntegerv(GL_VIEWPORT)
+        self.previous = int(glGetIntegerv(GL_FRAMEBUFFER_BINDING))
+        glBindFramebuffer(GL_FRAMEBUFFER, self.fbo)
+        glViewport(0, 0, self.width, self.height)
+
+    def unbind(self):
+        glBindFramebuffer(GL_FRAMEBUFFER, self.previous)
+        if self.viewport is not None:
+            glViewport(*self.viewport)
+
+    def read(self):
+        """
+        读回颜色缓冲 (height, width, 3)，第一行在上。
+        Lê o buffer de cor (height, width, 3), com a primeira linha em cima.
+        """
+        glPixelStorei(GL_PACK_ALIGNMENT, 1)
+        pixels = glReadPixels(0, 0, self.width, self.height, GL_RGB, GL_UNSIGNED_BYTE)
+        return np.frombuffer(pixels, dtype=np.uint8).reshape(self.height, self.width, 3)[::-1]
+
+    def release(self):
+        if self.texture:
+            glDeleteTextures([self.color])
+            glDeleteRenderbuffers(1, [self.depth])
+        else:
+            glDeleteRenderbuffers(2, [self.color, self.depth])
+        glDeleteFramebuffers(1, [self.fbo])
+
+
+class DrivingEnv:
+    """
+    Gym 风格的驾驶环境。
+    Ambiente de condução ao estilo Gym.
+
+    action = (throttle, steering), ambos em [-1, 1].
+    obs = [x, z, sin(yaw), cos(yaw), speed, steering, garage_door_height, collision]
+    (float32); com render_size=(w, h) passa a {"state": obs, "image": (h, w, 3) uint8}.
+    reward = aproximação ao lugar de estacionamento na garagem, -1 por colisão.
+    """
+
+    def __init__(self, scene_file=None, render_size=None, camera_mode=ENV_CAMERA_MODE,
+                 max_steps=ENV_MAX_STEPS, dt=1.0 / SIM_RATE, headless=True):
+        self.scene = load_scene(scene_file or SCENE_FILE)
+        self.colliders = Colliders(self.scene)
+        self.triggers = build_trigger_zones(self.scene)
+        g = self.colliders.garages
+        # Lugar de estacionamento: centro da primeira garagem (停车位：第一个车库的中心)
+        self.target = (float(g[0, 0] + g[0, 2]) / 2, float(g[0, 1] + g[0, 3]) / 2) if len(g) else (0.0, 0.0)
+        self.camera_mode = camera_mode
+        self.max_steps = max_steps
+        self.dt = dt
+        self.render_size = render_size
+        self.target_fbo = None
+        if render_size is not None:
+            if headless:
+                setup_headless()
+            self.target_fbo = OffscreenTarget(*render_size)
+        self.state = None
+        self.steps = 0
+        self.speed = 0.0
+        self.distance = 0.0
+        self.collision = False
+
+    def reset(self, **values):
+        """
+        重置环境；values 可覆盖 State 的初始字段（如 car_pos、garage_door_height）。
+        Reinicia o ambiente; 'values' substitui campos iniciais do State
+        (ex: car_pos, garage_door_height).
+        """
+        self.state = State(**dict({"camera_mode": self.camera_mode}, **values))
+        self.triggers.update(self.state.car_pos[0], self.state.car_pos[2], self.state)
+        set_zone_flags(self.state, self.triggers.names_inside())
+        self.steps = 0
+        self.speed = 0.0
+        self.collision = False
+        self.distance = self._distance()
+        return self._observe()
+
+    def step(self, action):
+        throttle, steering = (min(1.0, max(-1.0, float(a))) for a in action)
+        s = self.state
+        s.steering_angle = steering * MAX_STEER
+        pos, yaw, wheel = s.car_pos[:], s.car_yaw, s.wheel_rotation
+        move_car(s, throttle * MOVE_SPEED)
+        self.collision = self.colliders.hit(s.car_pos[0], s.car_pos[2], s.car_yaw, s.garage_door_height)
+        if self.collision:
+            s.car_pos, s.car_yaw, s.wheel_rotation = pos, yaw, wheel
+        self.speed = 0.0 if self.collision else throttle * MOVE_SPEED / self.dt
+        self.triggers.update(s.car_pos[0], s.car_pos[2], s)
+        step_door(s, self.dt)
+        self.steps += 1
+
+        distance = self._distance()
+        reward = self.distance - distance - (1.0 if self.collision else 0.0)
+        self.distance = distance
+        parked = self.colliders.in_garage(s.car_pos[0], s.car_pos[2], s.car_yaw)
+        done = parked or self.steps >= self.max_steps
+        info = {"distance": distance, "parked": parked, "collision": self.collision, "steps": self.steps}
+        return self._observe(), reward, done, info
+
+    def _distance(self):
+        return math.hypot(self.state.car_pos[0] - self.target[0], self.state.car_pos[2] - self.target[1])
+
+    def _observe(self):
+        s = self.state
+        obs = np.array([s.car_pos[0], s.car_pos[2], math.sin(s.car_yaw), math.cos(s.car_yaw), self.speed,
+                        s.steering_angle / MAX_STEER, s.garage_door_height, float(self.collision)],
+                       dtype=np.float32)
+        if self.target_fbo is None:
+            return obs
+        return {"state": obs, "image": self.render()}
+
+    def render(self):
+        """
+        用当前摄像机模式渲染低分辨率观测图像。
+        Renderiza a observação (baixa resolução) com o modo de câmara atual.
+        """
+        global state, scene
+        saved = state, scene
+        state, scene = self.state, self.scene
+        try:
+            self.target_fbo.bind()
+            render_frame(aspect=self.target_fbo.width / self.target_fbo.height)
+            image = self.target_fbo.read()
+            self.target_fbo.unbind()
+        finally:
+            state, scene = saved
+        return image
+
+    def close(self):
+        if self.target_fbo is not None:
+            self.target_fbo.release()
+            self.target_fbo = None
+        if occlusion_culler is not None:
+            occlusion_culler.release(self.scene)
+
+
+class VecDrivingEnv:
+    """
+    N 个独立的驾驶环境，一次 NumPy 批量更新；观测图像平铺在同一个帧缓冲中渲染。
+    N ambientes de condução independentes, atualizados em lote com NumPy; as
+    imagens de observação são desenhadas lado a lado num só framebuffer e lidas
+    com um único glReadPixels por passo.
+
+    actions: (N, 2) com (throttle, steering); obs: (N, 8) como DrivingEnv.
+    Ambientes terminados são reiniciados automaticamente; a última observação
+    fica em info["final_obs"]. info["zones"] (N, Z) diz em que zonas de disparo
+    está cada carro (nomes em env.triggers.names).
+    """
+
+    def __init__(self, num_envs, scene_file=None, render_size=None, camera_mode=ENV_CAMERA_MODE,
+                 max_steps=ENV_MAX_STEPS, dt=1.0 / SIM_RATE, headless=True):
+        self.num_envs = num_envs
+        self.scene = load_scene(scene_file or SCENE_FILE)
+        self.colliders = Colliders(self.scene)
+        self.triggers = build_trigger_zones(self.scene, flags=False)
+        g = self.colliders.garages
+        self.target = np.array([(g[0, 0] + g[0, 2]) / 2, (g[0, 1] + g[0, 3]) / 2] if len(g) else [0.0, 0.0])
+        self.camera_mode = camera_mode
+        self.max_steps = max_steps
+        self.dt = dt
+
+        self.pos = np.zeros((num_envs, 3))
+        self.yaw = np.zeros(num_envs)
+        self.steering = np.zeros(num_envs)
+        self.wheel = np.zeros(num_envs)
+        self.door = np.zeros(num_envs)
+        # Animação das portas, por ambiente, avançada com step_door (门动画，每个环境用 step_door 推进)
+        self.door_target = np.full(num_envs, -1.0)
+        self.car_door_open = np.zeros(num_envs, dtype=bool)
+        self.car_door_angle = np.zeros(num_envs)
+        self.speed = np.zeros(num_envs)
+        self.collision = np.zeros(num_envs, dtype=bool)
+        self.distance = np.zeros(num_envs)
+        self.steps = np.zeros(num_envs, dtype=np.int64)
+        self.initial = State()
+
+        self.render_size = render_size
+        self.target_fbo = None
+        if render_size is not None:
+            if headless:
+                setup_headless()
+            width, height = render_size
+            self.cols = int(math.ceil(math.sqrt(num_envs)))
+            self.rows = int(math.ceil(num_envs / self.cols))
+            self.target_fbo = OffscreenTarget(self.cols * width, self.rows * height)
+
+    def reset(self, **values):
+        """
+        重置所有环境；values 可覆盖 State 的初始字段。
+        Reinicia todos os ambientes; 'values' substitui campos iniciais do State.
+        """
+        self.initial = State(**dict({"camera_mode": self.camera_mode}, **values))
+        self._reset(np.ones(self.num_envs, dtype=bool))
+        self.triggers.update(self.pos[:, 0], self.pos[:, 2], self)
+        return self._observe()
+
+    def _reset(self, mask):
+        s = self.initial
+        self.pos[mask] = s.car_pos
+        self.yaw[mask] = s.car_yaw
+        self.steering[mask] = s.steering_angle
+        self.wheel[mask] = s.wheel_rotation
+        self.door[mask] = s.garage_door_height
+        self.door_target[mask] = s.garage_door_target
+        self.car_door_open[mask] = s.car_door_open
+        self.car_door_angle[mask] = s.car_door_angle
+        self.speed[mask] = 0.0
+        self.collision[mask] = False
+        self.steps[mask] = 0
+        self.distance[mask] = self._distance()[mask]
+
+    def step(self, actions):
+        actions = np.clip(np.asarray(actions, dtype=np.float64).reshape(self.num_envs, 2), -1.0, 1.0)
+        self.steering = actions[:, 1] * MAX_STEER
+        # Mesmo modelo que move_car, para todos os carros de uma vez (与 move_car 相同的模型，批量计算)
+        distance = actions[:, 0] * MOVE_SPEED
+        x = self.pos[:, 0] - distance * np.sin(self.yaw)
+        z = self.pos[:, 2] - distance * np.cos(self.yaw)
+        yaw = self.yaw + (distance / WHEELBASE) * np.tan(np.radians(self.steering))
+        self.collision = self.colliders.hit_many(x, z, yaw, self.door)
+        free = ~self.collision
+        self.pos[free, 0] = x[free]
+        self.pos[free, 2] = z[free]
+        self.yaw[free] = yaw[free]
+        self.wheel[free] += 15 * distance[free] / MOVE_SPEED
+        self.speed = np.where(free, distance / self.dt, 0.0)
+        # Como DrivingEnv: zonas primeiro, depois as portas (与 DrivingEnv 相同：先更新区域，再推进门)
+        self.triggers.update(self.pos[:, 0], self.pos[:, 2], self)
+        self._step_doors()
+        self.steps += 1
+
+        distance = self._distance()
+        reward = self.distance - distance - self.collision
+        self.distance = distance
+        parked = self.colliders.in_garage_many(self.pos[:, 0], self.pos[:, 2], self.yaw)
+        done = parked | (self.steps >= self.max_steps)
+        info = {"distance": distance.copy(), "parked": parked, "collision": self.collision.copy(),
+                "steps": self.steps.copy()}
+        if done.any():
+            info["final_obs"] = self._state_obs()
+            self._reset(done)
+            # Zonas de todas as viaturas num só passo (所有车辆的区域一次计算)
+            self.triggers.update(self.pos[:, 0], self.pos[:, 2], self)
+        info["zones"] = self.triggers.inside.copy()
+        return self._observe(), reward, done, info
+
+    def _step_doors(self):
+        """
+        在所有环境上一次推进车门与车库门（与 step_door 相同的轨道与规则）。
+        Avança as portas de todos os ambientes de uma vez (mesmas trilhas e regras de step_door).
+        """
+        car_door, garage_door = animation_tracks["car_door"], animation_tracks["garage_door"]
+        self.car_door_angle = car_door.advance_many(
+            self.car_door_angle, np.where(self.car_door_open, car_door.end, car_door.start), self.dt)
+        if AUTO_GARAGE_DOOR:
+            # Porta automática: carro no interior ou em frente a uma garagem (车在车库内或门前)
+            inside = self.triggers.inside
+            near = np.zeros(self.num_envs, dtype=bool)
+            if inside.shape[0] == self.num_envs:
+                near = inside[:, np.isin(self.triggers.names, list(GARAGE_ZONE_FLAGS))].any(axis=1)
+            self.door_target = np.where(near, garage_door.end, garage_door.start)
+        moving = self.door_target >= 0.0
+        if moving.any():
+            self.door[moving] = garage_door.advance_many(self.door[moving], self.door_target[moving], self.dt)
+            self.door_target[moving & (self.door == self.door_target)] = -1.0
+
+    def _distance(self):
+        return np.hypot(self.pos[:, 0] - self.target[0], self.pos[:, 2] - self.target[1])
+
+    def _state_obs(self):
+        return np.column_stack([self.pos[:, 0], self.pos[:, 2], np.sin(self.yaw), np.cos(self.yaw), self.speed,
+                                self.steering / MAX_STEER, self.door, self.collision]).astype(np.float32)
+
+    def _observe(self):
+        obs = self._state_obs()
+        if self.target_fbo is None:
+            return obs
+        return {"state": obs, "image": self.render()}
+
+    def env_state(self, i):
+        """
+        第 i 个环境的 State（用于渲染）。
+        State do ambiente i (usado na renderização).
+        """
+        s = self.initial.copy()
+        s.car_pos = self.pos[i].tolist()
+        s.car_yaw = float(self.yaw[i])
+        s.steering_angle = float(self.steering[i])
+        s.wheel_rotation = float(self.wheel[i])
+        s.garage_door_height = float(self.door[i])
+        s.garage_door_target = float(self.door_target[i])
+        s.car_door_open = bool(self.car_door_open[i])
+        s.car_door_angle = float(self.car_door_angle[i])
+        set_zone_flags(s, self.triggers.names_inside(i))
+        return s
+
+    def render(self):
+        """
+        把所有环境平铺渲染到同一个帧缓冲，只读回一次，返回 (N, h, w, 3)。
+        Desenha todos os ambientes em mosaico num só framebuffer, lê-o uma vez
+        e devolve (N, h, w, 3).
+        """
+        global state, scene
+        width, height = self.render_size
+        saved = state, scene
+        scene = self.scene
+        try:
+            self.target_fbo.bind()
+            glEnable(GL_SCISSOR_TEST)
+            for i in range(self.num_envs):
+                x, y = (i % self.cols) * width, (i // self.cols) * height
+                glViewport(x, y, width, height)
+                glScissor(x, y, width, height)
+                state = self.env_state(i)
+                render_frame(aspect=width / height)
+            glDisable(GL_SCISSOR_TEST)
+            image = self.target_fbo.read()
+            self.target_fbo.unbind()
+        finally:
+            state, scene = saved
+        # read() devolve a primeira linha em cima: a linha de mosaicos 0 fica em baixo
+        # read() 返回的图像第一行在上：第 0 行瓦片在底部
+        tiles = image.reshape(self.rows, height, self.cols, width, 3)[::-1].transpose(0, 2, 1, 3, 4)
+        return tiles.reshape(-1, height, width, 3)[:self.num_envs]
+
+    def close(self):
+        if self.target_fbo is not None:
+            self.target_fbo.release()
+            self.target_fbo = None
+        if occlusion_culler is not None:
+            occlusion_culler.release(self.scene)
+
+
+# ============================================================================
+# 16. TELEMETRY (遥测)
+# ============================================================================
+
+# Servidor asyncio numa thread própria. O render só publica a amostra mais
+# recente (troca de uma referência); o servidor envia-a a TELEMETRY_RATE Hz a
+# todos os clientes. Clientes lentos (buffer de escrita cheio) são desligados em
+# vez de atrasar o render.
+# asyncio 服务器运行在独立线程；渲染线程只替换“最新样本”的引用，服务器按固定频率
+# 广播给所有订阅者；写缓冲满的慢客户端会被断开，而不是拖慢渲染。
+
+TELEMETRY_FIELDS = (("time", "d"), ("frame", "I"), ("x", "f"), ("y", "f"), ("z", "f"), ("yaw", "f"),
+                    ("steering_angle", "f"), ("speed", "f"), ("headlights_on", "?"), ("car_door_open", "?"),
+                    ("car_door_angle", "f"), ("garage_door_height", "f"), ("is_night", "?"),
+                    ("camera_mode", "B"), ("frame_ms", "f"), ("fps", "f"))
+TELEMETRY_STRUCT = struct.Struct("<" + "".join(fmt for name, fmt in TELEMETRY_FIELDS))
+
+
+async def start_local_server(handler, address):
+    """
+    在 TCP (host, port) 或 Unix 套接字路径上启动 asyncio 服务器；返回 (server, 实际地址)。
+    Inicia um servidor asyncio em TCP (host, porta) ou num socket Unix; devolve (server, endereço real).
+    """
+    if isinstance(address, str):
+        if os.path.exists(address):
+            os.unlink(address)
+        return await asyncio.start_unix_server(handler, address), address
+    server = await asyncio.start_server(handler, *address)
+    return server, server.sockets[0].getsockname()[:2]     # porta real se for 0 (端口为 0 时的实际端口)
+
+
+def encode_telemetry(sample, fmt="json"):
+    """
+    把样本编码为一行 JSON 或定长二进制记录（TELEMETRY_STRUCT）。
+    Codifica uma amostra como linha JSON ou registo binário de tamanho fixo (TELEMETRY_STRUCT).
+    """
+    if fmt == "binary":
+        return TELEMETRY_STRUCT.pack(*sample)
+    return (json.dumps(dict(zip((name for name, f in TELEMETRY_FIELDS), sample)),
+                       separators=(",", ":")) + "\n").encode("utf-8")
+
+
+class TelemetryServer:
+    """
+    本地遥测服务器（TCP 或 Unix 套接字），支持多个订阅者。
+    Servidor de telemetria local (TCP ou socket Unix) com vários subscritores.
+    """
+
+    def __init__(self, address=None, rate=None, fmt=None):
+        self.address = address or TELEMETRY_ADDRESS
+        self.rate = rate or TELEMETRY_RATE
+        self.fmt = fmt or TELEMETRY_FORMAT
+        self.latest = None
+        self.clients = set()
+        self.tasks = set()
+        self.dropped = 0
+        self.frame = 0
+        self.last = None                    # (tempo, posição) para calcular a velocidade (计算速度用)
+        self.frame_times = collections.deque(maxlen=30)
+        self.running = True
+        self.ready = threading.Event()
+        self.loop = asyncio.new_event_loop()
+        self.thread = threading.Thread(target=self.loop.run_until_complete, args=(self._serve(),),
+                                       name="telemetry", daemon=True)
+
+    def start(self):
+        self.thread.start()
+        self.ready.wait()
+        return self
+
+    def stop(self):
+        self.running = False
+        self.thread.join()
+
+    def publish(self, s, frame_ms, now=None):
+        """
+        渲染线程调用：根据 state 生成最新样本（不加锁，只替换引用）。
+        Chamado pelo render: cria a amostra mais recente a partir do estado
+        (sem locks, apenas troca de referência).
+        """
+        now = time.perf_counter() if now is None else now
+        pos = s.car_pos
+        speed = 0.0
+        if self.last is not None and now > self.last[0]:
+            speed = math.hypot(pos[0] - self.last[1][0], pos[2] - self.last[1][2]) / (now - self.last[0])
+        self.last = (now, tuple(pos))
+        self.frame_times.append(now)
+        fps = (len(self.frame_times) - 1) / (now - self.frame_times[0]) if len(self.frame_times) > 1 else 0.0
+        self.frame += 1
+        self.latest = (time.time(), self.frame, pos[0], pos[1], pos[2], s.car_yaw, s.steering_angle, speed,
+                       s.headlights_on, s.car_door_open, s.car_door_angle, s.garage_door_height, s.is_night,
+                       s.camera_mode, frame_ms, fps)
+
+    async def _serve(self):
+        server, self.address = await start_local_server(self._client, self.address)
+        self.ready.set()
+        sent = None
+        async with server:
+            while self.running:
+                sample = self.latest
+                if sample is not None and sample is not sent:
+                    sent = sample
+                    self._broadcast(encode_telemetry(sample, self.fmt))
+                await asyncio.sleep(1.0 / self.rate)
+            for writer in list(self.clients):
+                writer.transport.abort()
+            if self.tasks:
+                await asyncio.wait(self.tasks, timeout=1.0)
+        if isinstance(self.address, str) and os.path.exists(self.address):
+            os.unlink(self.address)
+
+    def _broadcast(self, message):
+        for writer in list(self.clients):
+            if writer.transport.get_write_buffer_size() > TELEMETRY_MAX_BUFFER:
+                # Cliente lento: desligar em vez de acumular (慢客户端：断开而不是继续堆积)
+                self.clients.discard(writer)
+                self.dropped += 1
+                writer.transport.abort()
+            else:
+                writer.write(message)
+
+    async def _client(self, reader, writer):
+        task = asyncio.current_task()
+        self.tasks.add(task)
+        # Buffer do kernel pequeno: a pressão chega depressa ao buffer de escrita (内核缓冲区小，背压很快可见)
+        writer.get_extra_info("socket").setsockopt(socket.SOL_SOCKET, socket.SO_SNDBUF, TELEMETRY_MAX_BUFFER)
+        self.clients.add(writer)
+        try:
+            while await reader.read(1024):
+                pass
+        except ConnectionError:
+            pass
+        finally:
+            self.clients.discard(writer)
+            self.tasks.discard(task)
+            writer.close()
+
+
+def run_telemetry_standin(address=None, fmt=None):
+    """
+    无窗口的替身服务器：DrivingEnv 绕圈行驶并发送遥测，用于测试客户端。
+    Servidor substituto sem janela: um DrivingEnv anda em círculos e envia
+    telemetria, para testar clientes.
+    """
+    server = TelemetryServer(address, fmt=fmt).start()
+    print("Telemetry stand-in on %s (%s)" % (server.address, server.fmt))
+    env = DrivingEnv()
+    env.reset()
+    dt = 1.0 / SIM_RATE
+    try:
+        while True:
+            t = time.perf_counter()
+            obs, reward, done, info = env.step((0.5, 1.0))
+            if done:
+                env.reset()
+            server.publish(env.state, (time.perf_counter() - t) * 1000.0)
+            time.sleep(max(0.0, dt - (time.perf_counter() - t)))
+    except KeyboardInterrupt:
+        server.stop()
+
+
+# ============================================================================
+# 17. REMOTE CONTROL (远程控制)
+# ============================================================================
+
+# Canal de comandos local para testes automáticos. Cada linha recebida é um
+# lote JSON (lista de comandos, ou um só comando) e entra inteiro numa deque
+# (sem locks); a simulação esvazia a fila uma vez por tick e aplica cada lote
+# no mesmo tick, pela ordem de chegada.
+# 本地命令通道：每行是一个 JSON 批次，整批放入无锁 deque；模拟每个 tick 取一次，
+# 同一批命令在同一个 tick 内按顺序执行。
+#
+#   {"cmd": "steer", "angle": 20}               ângulo do volante (graus)
+#   {"cmd": "throttle", "value": 1, "ticks": 30} acelerador [-1, 1] durante N ticks
+#   {"cmd": "headlights", "on": true}           sem "on" = alternar
+#   {"cmd": "garage", "height": 5}              altura da porta da garagem (0..5)
+#   {"cmd": "camera", "mode": 2}
+#   {"cmd": "key", "key": "n"}                  qualquer tecla de apply_key
+
+def _remote_number(value):
+    number = float(value)
+    if not math.isfinite(number):
+        raise ValueError("not a finite number: %r" % (value,))
+    return number
+
+
+def _remote_bool(value):
+    if isinstance(value, (bool, int)) and value in (0, 1):
+        return bool(value)
+    raise ValueError("not a boolean: %r" % (value,))
+
+
+def _remote_key(value):
+    if not isinstance(value, str) or not value:
+        raise ValueError("not a key: %r" % (value,))
+    return value.lower()
+
+
+# comando -> ((campo, conversão, obrigatório), ...) -- (命令 -> 字段, 转换函数, 是否必需)
+# Os campos são validados e convertidos em submit, por isso _apply nunca falha com dados do cliente.
+REMOTE_COMMANDS = {
+    "steer": (("angle", _remote_number, True),),
+    "throttle": (("value", _remote_number, True), ("ticks", int, False)),
+    "headlights": (("on", _remote_bool, False),),
+    "garage": (("height", _remote_number, True),),
+    "camera": (("mode", int, True),),
+    "key": (("key", _remote_key, True),),
+}
+
+
+def validate_remote_command(command):
+    """
+    校验一条远程命令并转换字段类型；无效时抛出 ValueError。
+    Valida um comando remoto e converte os campos; ValueError se for inválido.
+    """
+    if not isinstance(command, dict) or command.get("cmd") not in REMOTE_COMMANDS:
+        raise ValueError("unknown command: %r" % (command,))
+    cmd = command["cmd"]
+    clean = {"cmd": cmd}
+    for field, convert, required in REMOTE_COMMANDS[cmd]:
+        if field not in command:
+            if required:
+                raise ValueError("%s: missing %r" % (cmd, field))
+            continue
+        try:
+            clean[field] = convert(command[field])
+        except (TypeError, ValueError, OverflowError):
+            raise ValueError("%s: invalid %r: %r" % (cmd, field, command[field])) from None
+    return clean
+
+
+class CommandServer:
+    """
+    远程控制服务器：接收批量命令，在模拟 tick 中执行。
+    Servidor de controlo remoto: recebe lotes de comandos e aplica-os nos ticks da simulação.
+    """
+
+    def __init__(self, address=None):
+        self.address = address or COMMAND_ADDRESS
+        self.queue = collections.deque()
+        self.throttle = 0.0
+        self.throttle_ticks = 0
+        self.ticks = 0
+        self.received = 0
+        self.clients = {}
+        self.running = True
+        self.ready = threading.Event()
+        self.loop = asyncio.new_event_loop()
+        self.thread = threading.Thread(target=self.loop.run_until_complete, args=(self._serve(),),
+                                       name="remote-control", daemon=True)
+
+    def start(self):
+        self.thread.start()
+        self.ready.wait()
+        return self
+
+    def stop(self):
+        self.running = False
+        self.thread.join()
+
+    def submit(self, batch):
+        """
+        校验并排队一批命令；返回排队的命令数。
+        Valida e põe um lote na fila; devolve o número de comandos.
+        """
+        if isinstance(batch, dict):
+            batch = [batch]
+        if not isinstance(batch, list):
+            raise ValueError("expected a command or a list of commands: %r" % (batch,))
+        batch = [validate_remote_command(command) for command in batch]
+        self.queue.append(batch)
+        self.received += len(batch)
+        return len(batch)
+
+    def tick(self, s):
+        """
+        每个模拟 tick 调用一次：执行排队的批次，并施加油门。
+        Chamado uma vez por tick: aplica os lotes na fila e o acelerador ativo.
+        """
+        while self.queue:
+            for command in self.queue.popleft():
+                self._apply(s, command)
+        if self.throttle_ticks > 0:
+            move_car(s, self.throttle * MOVE_SPEED)
+            self.throttle_ticks -= 1
+        self.ticks += 1
+
+    def _apply(self, s, c):
+        # c já vem validado e convertido por submit (已由 submit 校验并转换)
+        cmd = c["cmd"]
+        if cmd == "steer":
+            s.steering_angle = max(-MAX_STEER, min(MAX_STEER, c["angle"]))
+        elif cmd == "throttle":
+            self.throttle = max(-1.0, min(1.0, c["value"]))
+            self.throttle_ticks = c.get("ticks", 1)
+        elif cmd == "headlights":
+            s.headlights_on = c["on"] if "on" in c else not s.headlights_on
+        elif cmd == "garage":
+            garage_door = animation_tracks["garage_door"]
+            s.garage_door_height = max(garage_door.start, min(garage_door.end, c["height"]))
+            s.garage_door_target = -1.0
+        elif cmd == "camera":
+            # Estado da câmara pertence ao render (摄像机状态属于渲染端)
+            state.camera_mode = s.camera_mode = c["mode"] % 3
+        elif cmd == "key":
+            apply_key(s, c["key"])
+
+    async def _serve(self):
+        server, self.address = await start_local_server(self._client, self.address)
+        self.ready.set()
+        async with server:
+            while self.running:
+                await asyncio.sleep(0.1)
+            for writer in list(self.clients):
+                writer.transport.abort()
+            if self.clients:
+                await asyncio.wait(self.clients.values(), timeout=1.0)
+        if isinstance(self.address, str) and os.path.exists(self.address):
+            os.unlink(self.address)
+
+    async def _client(self, reader, writer):
+        self.clients[writer] = asyncio.current_task()
+        try:
+            while True:
+                line = await reader.readline()
+                if not line:
+                    break
+                try:
+                    reply = {"queued": self.submit(json.loads(line)), "tick": self.ticks}
+                except ValueError as exc:           # inclui JSON inválido (包括无效 JSON)
+                    reply = {"error": str(exc)}
+                writer.write((json.dumps(reply) + "\n").encode("utf-8"))
+                await writer.drain()
+        except ConnectionError:
+            pass
+        finally:
+            self.clients.pop(writer, None)
+            writer.close()
+
+
+# ============================================================================
+# 18. GL RESOURCE TRACKING (GL 资源跟踪)
+# ============================================================================
+
+# Bytes por pixel dos formatos usados (所用格式的每像素字节数)
+GL_FORMAT_BYTES = {int(GL_RGB): 3, int(GL_RGBA): 4, int(GL_RGB8): 3, int(GL_RGBA8): 4,
+                   int(GL_DEPTH_COMPONENT): 4, int(GL_DEPTH_COMPONENT24): 4}
+
+# Criação -> (tipo, remoção). As listas de desenho ficam com 0 bytes (o driver não diz o tamanho).
+# 创建函数 -> (类型, 删除函数)。显示列表的大小记为 0（驱动不提供）。
+GL_RESOURCE_CALLS = {
+    "glGenTextures": ("texture", "glDeleteTextures"),
+    "glGenBuffers": ("buffer", "glDeleteBuffers"),
+    "glGenFramebuffers": ("framebuffer", "glDeleteFramebuffers"),
+    "glGenRenderbuffers": ("renderbuffer", "glDeleteRenderbuffers"),
+    "glGenQueries": ("query", "glDeleteQueries"),
+    "glGenLists": ("list", "glDeleteLists"),
+    "gluNewQuadric": ("quadric", "gluDeleteQuadric"),
+}
+
+
+class GLResourceTracker:
+    """
+    GL 资源登记：拦截创建/删除调用，记录数量、估计大小和创建位置。
+    Registo de recursos GL: interceta criação/remoção e guarda contagens,
+    tamanho estimado e local de criação.
+    """
+
+    def __init__(self):
+        self.live = {kind: {} for kind, _ in GL_RESOURCE_CALLS.values()}
+        self.bound = {}             # alvo -> handle ligado (目标 -> 当前绑定的句柄)
+        self.saved = {}
+        self.frames = 0
+        self.window = collections.deque()   # contagens dos últimos frames (最近几帧的资源数)
+        self.last_report = time.perf_counter()
+
+    def install(self):
+        """
+        像烘焙记录器一样替换模块中的 GL 函数。
+        Substitui as funções GL do módulo, como o gravador de bake.
+        """
+        g = globals()
+        hooks = {}
+        for gen, (kind, delete) in GL_RESOURCE_CALLS.items():
+            hooks[gen] = self._creator(g[gen], kind)
+            hooks[delete] = self._deleter(g[delete], kind)
+        hooks["glBindTexture"] = self._binder(g["glBindTexture"], "texture")
+        hooks["glBindBuffer"] = self._binder(g["glBindBuffer"], "buffer")
+        hooks["glBindRenderbuffer"] = self._binder(g["glBindRenderbuffer"], "renderbuffer")
+        hooks["glTexImage2D"] = self._tex_image(g["glTexImage2D"])
+        hooks["glGenerateMipmap"] = self._mipmap(g["glGenerateMipmap"])
+        hooks["glBufferData"] = self._buffer_data(g["glBufferData"])
+        hooks["glRenderbufferStorage"] = self._storage(g["glRenderbufferStorage"])
+        # Funções em falta no driver ficam por embrulhar: bool(glGenQueries) continua a valer
+        # 驱动不支持的函数不包装，bool(glGenQueries) 等检测仍然有效
+        hooks = {name: hook for name, hook in hooks.items() if bool(g[name])}
+        self.saved = {name: g[name] for name in hooks}
+        g.update(hooks)
+        return self
+
+    def uninstall(self):
+        globals().update(self.saved)
+        self.saved = {}
+
+    # --- wrappers ---
+    def _creator(self, fn, kind):
+        def create(*args):
+            result = fn(*args)
+            frame = sys._getframe(1)
+            code = frame.f_code
+            site = "%s:%d" % (getattr(code, "co_qualname", code.co_name), frame.f_lineno)
+            if kind == "list":
+                handles = range(int(result), int(result) + int(args[0]))
+            elif kind == "quadric":
+                handles = [id(result)]      # ponteiro ctypes não é hashable (ctypes 指针不可哈希)
+            else:
+                handles = np.atleast_1d(result).tolist()
+            for handle in handles:
+                self.live[kind][handle] = [0, site, result]
+            return result
+        return create
+
+    def _deleter(self, fn, kind):
+        def delete(*args):
+            if kind == "list":
+                handles = range(int(args[0]), int(args[0]) + int(args[1]))
+            elif kind == "quadric":
+                handles = [id(args[0])]
+            else:
+                handles = np.atleast_1d(args[-1]).tolist()
+            for handle in handles:
+                self.live[kind].pop(handle, None)
+            return fn(*args)
+        return delete
+
+    def _binder(self, fn, kind):
+        def bind(target, handle):
+            self.bound[kind if kind != "buffer" else int(target)] = int(handle)
+            return fn(target, handle)
+        return bind
+
+    def _resize(self, key, kind, nbytes, add=False):
+        entry = self.live[kind].get(self.bound.get(key))
+        if entry is not None:
+            entry[0] = entry[0] + nbytes if add else nbytes
+
+    def _tex_image(self, fn):
+        def tex_image(target, level, fmt, width, height, *args):
+            nbytes = width * height * GL_FORMAT_BYTES.get(int(fmt), 4)
+            self._resize("texture", "texture", nbytes, add=level > 0)
+            return fn(target, level, fmt, width, height, *args)
+        return tex_image
+
+    def _mipmap(self, fn):
+        def mipmap(target):
+            entry = self.live["texture"].get(self.bound.get("texture"))
+            if entry is not None:
+                entry[0] = entry[0] * 4 // 3
+            return fn(target)
+        return mipmap
+
+    def _buffer_data(self, fn):
+        def buffer_data(target, size, *args):
+            self._resize(int(target), "buffer", int(size))
+            return fn(target, size, *args)
+        return buffer_data
+
+    def _storage(self, fn):
+        def storage(target, fmt, width, height):
+            self._resize("renderbuffer", "renderbuffer", width * height * GL_FORMAT_BYTES.get(int(fmt), 4))
+            return fn(target, fmt, width, height)
+        return storage
+
+    # --- reporting ---
+    def count(self):
+        return sum(len(v) for v in self.live.values())
+
+    def nbytes(self):
+        return sum(e[0] for v in self.live.values() for e in v.values())
+
+    def summary(self):
+        """
+        每种资源的数量、字节数和创建位置。
+        Contagem, bytes e locais de criação por tipo de recurso.
+        """
+        result = {}
+        for kind, entries in self.live.items():
+            sites = collections.Counter(e[1] for e in entries.values())
+            result[kind] = {"count": len(entries), "bytes": sum(e[0] for e in entries.values()),
+                            "sites": dict(sites.most_common())}
+        return result
+
+    def report(self):
+        lines = ["GL resources: %d live, %.2f MB" % (self.count(), self.nbytes() / 1e6)]
+        for kind, info in self.summary().items():
+            if info["count"]:
+                sites = ", ".join("%s x%d" % item for item in list(info["sites"].items())[:3])
+                lines.append("  %-12s %5d %10.1f KB   %s" % (kind, info["count"], info["bytes"] / 1e3, sites))
+        return "\n".join(lines)
+
+    def end_frame(self):
+        """
+        每帧调用：定期打印报告；断言模式下资源数超过最近 N 帧的最小值太多则失败（间歇性泄漏也能发现）。
+        Chamado a cada frame: imprime o relatório periodicamente e, no modo de
+        asserção, falha se os recursos vivos passam o mínimo dos últimos
+        RESOURCE_LEAK_FRAMES frames em mais de RESOURCE_LEAK_MARGIN (apanha
+        também fugas intermitentes, não só crescimento em frames seguidos).
+        """
+        self.frames += 1
+        count = self.count()
+        if RESOURCE_LEAK_FRAMES:
+            self.window.append(count)
+            while len(self.window) > RESOURCE_LEAK_FRAMES:
+                self.window.popleft()
+            baseline = min(self.window)
+            if len(self.window) == RESOURCE_LEAK_FRAMES and count > baseline + RESOURCE_LEAK_MARGIN:
+                raise AssertionError("GL resources grew from %d to %d within %d frames\n%s"
+                                     % (baseline, count, RESOURCE_LEAK_FRAMES, self.report()))
+        now = time.perf_counter()
+        if RESOURCE_REPORT_INTERVAL and now - self.last_report >= RESOURCE_REPORT_INTERVAL:
+            self.last_report = now
+            print(self.report())
+
+
+# ============================================================================
+# 19. GL CALL STATISTICS (GL 调用统计)
+# ============================================================================
+
+# Primitivas por modo para n vértices (每种模式下 n 个顶点的图元数)
+GL_PRIMITIVES = {
+    int(GL_POINTS): lambda n: n,
+    int(GL_LINES): lambda n: n // 2,
+    int(GL_LINE_STRIP): lambda n: max(n - 1, 0),
+    int(GL_LINE_LOOP): lambda n: n if n > 1 else 0,
+    int(GL_TRIANGLES): lambda n: n // 3,
+    int(GL_TRIANGLE_STRIP): lambda n: max(n - 2, 0),
+    int(GL_TRIANGLE_FAN): lambda n: max(n - 2, 0),
+    int(GL_QUADS): lambda n: n // 4,
+    int(GL_QUAD_STRIP): lambda n: max(n // 2 - 1, 0),
+    int(GL_POLYGON): lambda n: 1 if n >= 3 else 0,
+}
+
+# Sólidos GLUT/GLU -> (primitivas, vértices), estimados pela tesselação (按细分估算)
+GL_SOLID_COSTS = {
+    "glutSolidCube": lambda size: (6, 24),
+    "glutSolidSphere": lambda r, slices, stacks: (2 * slices * stacks, 2 * (slices + 1) * stacks),
+    "glutSolidCone": lambda b, h, slices, stacks: (slices + 2 * slices * stacks,
+                                                   slices + 2 + 2 * (slices + 1) * stacks),
+    "glutSolidTorus": lambda i, o, sides, rings: (sides * rings, 2 * (sides + 1) * rings),
+    "glutSolidDodecahedron": lambda: (12, 60),
+    "gluCylinder": lambda q, b, t, h, slices, stacks: (slices * stacks, 2 * (slices + 1) * stacks),
+    "gluDisk": lambda q, i, o, slices, loops: (slices * loops, 2 * (slices + 1) * loops),
+}
+
+
+def _module_gl_names():
+    """
+    本模块代码中引用的 GL/GLU/GLUT 函数名。
+    Nomes de funções GL/GLU/GLUT referidos no código deste módulo.
+    """
+    codes = []
+    for obj in list(globals().values()):
+        if isinstance(obj, type) and obj.__module__ == __name__:
+            codes += [f.__code__ for f in vars(obj).values() if hasattr(f, "__code__")]
+        elif getattr(obj, "__module__", None) == __name__ and hasattr(obj, "__code__"):
+            codes.append(obj.__code__)
+    names = set()
+    while codes:
+        code = codes.pop()
+        names.update(code.co_names)
+        codes += [c for c in code.co_consts if hasattr(c, "co_names")]
+    g = globals()
+    return sorted(n for n in names if n[:2] == "gl" and n in g and callable(g[n]) and bool(g[n]))
+
+
+class GLCallCounter:
+    """
+    GL 调用计数：每帧、每个 draw_* 函数的调用数、图元数和顶点数。
+    Contador de chamadas GL: chamadas, primitivas e vértices por frame e por função draw_*.
+    """
+
+    def __init__(self):
+        self.calls = collections.Counter()
+        # função draw_* mais interior -> [chamadas, primitivas, vértices] (最内层 draw_* 函数)
+        self.by_function = collections.defaultdict(lambda: [0, 0, 0])
+        self.stack = ["<frame>"]
+        self.primitives = 0
+        self.vertices = 0
+        self.mode = None
+        self.pending = 0
+        self.frames = 0
+        self.last = None
+        self.saved = {}
+        self.saved_kinds = {}
+
+    def install(self):
+        """
+        替换本模块使用的 GL 入口和 draw_* 函数（与烘焙记录器相同的方式）。
+        Substitui as entradas GL usadas pelo módulo e as funções draw_* (como o gravador de bake).
+        """
+        g = globals()
+        hooks = {}
+        for name in _module_gl_names():
+            fn = g[name]
+            if name == "glBegin":
+                hooks[name] = self._begin(fn)
+            elif name == "glEnd":
+                hooks[name] = self._end(fn)
+            elif name.startswith("glVertex") and not name.startswith("glVertexPointer"):
+                hooks[name] = self._vertex(name, fn)
+            elif name in ("glDrawArrays", "glDrawElements"):
+                hooks[name] = self._draw(name, fn)
+            else:
+                hooks[name] = self._call(name, fn, GL_SOLID_COSTS.get(name))
+        for name, fn in g.items():
+            if name.startswith("draw_") and getattr(fn, "__module__", None) == __name__ and hasattr(fn, "__code__"):
+                hooks[name] = self._cached_scope(fn) if name == "draw_cached" else self._scope(fn)
+        self.saved = {name: g[name] for name in hooks}
+        g.update(hooks)
+        self.saved_kinds = dict(SCENE_KINDS)
+        SCENE_KINDS.update({k: hooks.get(fn.__name__, fn) for k, fn in SCENE_KINDS.items()})
+        return self
+
+    def uninstall(self):
+        globals().update(self.saved)
+        SCENE_KINDS.update(self.saved_kinds)
+        self.saved = {}
+
+    # --- wrappers ---
+    def _scope(self, fn):
+        stack = self.stack
+
+        def scope(*args, **kwargs):
+            stack.append(fn.__name__)
+            try:
+                return fn(*args, **kwargs)
+            finally:
+                stack.pop()
+        scope.__name__ = fn.__name__
+        scope.__wrapped__ = fn      # a chave do bake usa o código original (烘焙键使用原始代码)
+        return scope
+
+    def _cached_scope(self, fn):
+        # A malha cozinhada conta para a função que a gerou, não para draw_cached (烘焙网格计入生成它的函数)
+        stack = self.stack
+
+        def draw_cached(mesh_fn, *args, **kwargs):
+            stack.append(getattr(mesh_fn, "__name__", fn.__name__))
+            try:
+                return fn(mesh_fn, *args, **kwargs)
+            finally:
+                stack.pop()
+        draw_cached.__wrapped__ = fn
+        return draw_cached
+
+    def _count(self, name, primitives=0, vertices=0):
+        self.calls[name] += 1
+        entry = self.by_function[self.stack[-1]]
+        entry[0] += 1
+        if primitives or vertices:
+            entry[1] += primitives
+            entry[2] += vertices
+            self.primitives += primitives
+            self.vertices += vertices
+
+    def _call(self, name, fn, cost=None):
+        def call(*args):
+            self._count(name, *(cost(*args) if cost else ()))
+            return fn(*args)
+        return call
+
+    def _begin(self, fn):
+        def begin(mode):
+            self._count("glBegin")
+            self.mode, self.pending = int(mode), 0
+            return fn(mode)
+        return begin
+
+    def _vertex(self, name, fn):
+        def vertex(*args):
+            self._count(name, 0, 1)
+            self.pending += 1
+            return fn(*args)
+        return vertex
+
+    def _end(self, fn):
+        def end():
+            self._count("glEnd", GL_PRIMITIVES.get(self.mode, lambda n: 0)(self.pending))
+            self.mode = None
+            return fn()
+        return end
+
+    def _draw(self, name, fn):
+        def draw(mode, *args):
+            n = int(args[1] if name == "glDrawArrays" else args[0])
+            self._count(name, GL_PRIMITIVES.get(int(mode), lambda n: 0)(n), n)
+            return fn(mode, *args)
+        return draw
+
+    # --- results ---
+    def end_frame(self):
+        """
+        结束一帧：保存统计并清零。
+        Fecha o frame: guarda as estatísticas e recomeça a contagem.
+        """
+        self.last = {
+            "calls": sum(self.calls.values()),
+            "primitives": self.primitives,
+            "vertices": self.vertices,
+            "by_call": dict(self.calls.most_common()),
+            "by_function": {name: dict(zip(("calls", "primitives", "vertices"), v))
+                            for name, v in sorted(self.by_function.items(), key=lambda kv: -kv[1][0])},
+        }
+        self.calls.clear()
+        self.by_function.clear()
+        self.primitives = self.vertices = 0
+        self.frames += 1
+        return self.last
+
+    def frame_stats(self):
+        """
+        上一帧的统计。
+        Estatísticas do último frame.
+        """
+        return self.last
+
+
+def mean_gl_stats(frames):
+    """
+    多帧统计的平均值（与 end_frame 的格式相同）。
+    Média das estatísticas de vários frames (no mesmo formato de end_frame).
+    """
+    n = len(frames)
+    by_call = collections.Counter()
+    by_function = collections.defaultdict(collections.Counter)
+    for f in frames:
+        by_call.update(f["by_call"])
+        for name, counts in f["by_function"].items():
+            by_function[name].update(counts)
+    return {
+        "calls": sum(f["calls"] for f in frames) / n,
+        "primitives": sum(f["primitives"] for f in frames) / n,
+        "vertices": sum(f["vertices"] for f in frames) / n,
+        "by_call": {name: c / n for name, c in by_call.most_common()},
+        "by_function": {name: {k: v[k] / n for k in ("calls", "primitives", "vertices")}
+                        for name, v in sorted(by_function.items(), key=lambda kv: -kv[1]["calls"])},
+    }
+
+
+def format_gl_stats(stats, top=10):
+    lines = ["GL calls: %d, primitives: %d, vertices: %d" % (stats["calls"], stats["primitives"], stats["vertices"])]
+    lines.append("  %-28s %8s %10s %10s" % ("function", "calls", "prims", "verts"))
+    for name, f in list(stats["by_function"].items())[:top]:
+        lines.append("  %-28s %8d %10d %10d" % (name, f["calls"], f["primitives"], f["vertices"]))
+    lines.append("  top calls: " + ", ".join("%s x%d" % kv for kv in list(stats["by_call"].items())[:top]))
+    return "\n".join(lines)
+
+
+def run_benchmark(frames=120, width=800, height=600, counted_frames=5):
+    """
+    无窗口基准：先计时（不计数），再用 GLCallCounter 统计几帧。
+    Benchmark sem janela: primeiro mede o tempo (sem contagem), depois conta
+    as chamadas GL de alguns frames com GLCallCounter.
+    """
+    setup_headless(width, height, finish=False)
+    aspect = width / height
+    if startup.first_frame is None:
+        render_frame(aspect)
+        glFinish()
+        startup.frame_presented()
+    startup.finish()
+    times = []
+    for i in range(frames):
+        state.cam_yaw = 2 * math.pi * i / frames
+        t = time.perf_counter()
+        render_frame(aspect)
+        glFinish()
+        times.append((time.perf_counter() - t) * 1000.0)
+    times.sort()
+    result = {"frames": frames, "mean_ms": sum(times) / frames, "p95_ms": times[int(frames * 0.95) - 1],
+              "first_frame_ms": startup.first_frame * 1000.0, "loaded_ms": startup.done * 1000.0,
+              "startup_ms": {name: t * 1000.0 for name, t in startup.phases.items()}}
+
+    counter = gl_stats or GLCallCounter().install()
+    per_frame = []
+    for i in range(counted_frames):
+        state.cam_yaw = 2 * math.pi * i / counted_frames
+        render_frame(aspect)
+        per_frame.append(counter.end_frame())
+    if gl_stats is None:
+        counter.uninstall()
+    # A linha "Per frame" e a tabela vêm da mesma média (每帧平均值与明细表使用同一组帧)
+    result["gl"] = mean_gl_stats(per_frame)
+    result["gl_mean"] = {k: result["gl"][k] for k in ("calls", "primitives", "vertices")}
+
+    print(startup.report())
+    print("Benchmark: %d frames %dx%d, mean %.2f ms, p95 %.2f ms (%.1f fps)"
+          % (frames, width, height, result["mean_ms"], result["p95_ms"], 1000.0 / result["mean_ms"]))
+    print("Per frame (mean of %d): %d GL calls, %d primitives, %d vertices"
+          % (counted_frames, result["gl_mean"]["calls"], result["gl_mean"]["primitives"], result["gl_mean"]["vertices"]))
+    print(format_gl_stats(result["gl"]))
+    if gl_resources is not None:
+        print(gl_resources.report())
+    return result
+
+
+# ============================================================================
+# 20. STARTUP (启动流程)
+# ============================================================================
+
+# O arranque é medido por fases. Com FAST_STARTUP, o trabalho que não é preciso
+# para o primeiro frame (atlas de impostores, servidores) fica numa fila e corre
+# depois de o primeiro frame aparecer, uma tarefa por tick de update().
+# A geometria vem da cache de bake e o atlas de impostores da mesma cache.
+# Dica: `python -m CG_PROJETO` reutiliza o bytecode em __pycache__; executar o
+# ficheiro diretamente recompila o módulo inteiro em cada arranque.
+# 启动分阶段计时；FAST_STARTUP 时，第一帧不需要的工作（替身图集、服务器）延后到第一帧显示之后，
+# 每个 update() tick 执行一项。用 `python -m CG_PROJETO` 启动可复用缓存的字节码。
+
+
+class Startup:
+    """
+    启动计时与延后任务队列。
+    Medição do arranque e fila de tarefas adiadas.
+    """
+
+    def __init__(self):
+        self.phases = {"imports": time.perf_counter() - STARTUP_T0}
+        self.deferred = collections.deque()
+        self.first_frame = None
+        self.done = None
+
+    def phase(self, name):
+        return _StartupPhase(self, name)
+
+    def defer(self, name, fn, *args):
+        """
+        第一帧之后再执行 fn；关闭 FAST_STARTUP 时立即执行。
+        Executa fn depois do primeiro frame; sem FAST_STARTUP, executa já.
+        """
+        if FAST_STARTUP:
+            self.deferred.append((name, fn, args))
+        else:
+            with self.phase(name):
+                fn(*args)
+
+    def frame_presented(self):
+        if self.first_frame is None:
+            self.first_frame = time.perf_counter() - STARTUP_T0
+            if not self.deferred:
+                self._finished()
+
+    def run_deferred(self):
+        """
+        执行一项延后任务（在 update() 中每个 tick 调用）。
+        Executa uma tarefa adiada (chamado a cada tick de update()).
+        """
+        if self.deferred and self.first_frame is not None:
+            name, fn, args = self.deferred.popleft()
+            with self.phase("deferred: " + name):
+                fn(*args)
+            if not self.deferred:
+                self._finished()
+
+    def finish(self):
+        """
+        立即执行所有延后任务（无窗口渲染、基准测试）。
+        Executa já todas as tarefas adiadas (render sem janela, benchmarks).
+        """
+        while self.deferred:
+            name, fn, args = self.deferred.popleft()
+            with self.phase("deferred: " + name):
+                fn(*args)
+        self._finished()
+
+    def _finished(self):
+        if self.done is None:
+            self.done = time.perf_counter() - STARTUP_T0
+            if PRINT_STARTUP_REPORT:
+                print(self.report())
+
+    def report(self):
+        lines = ["Startup: first frame %s, fully loaded %s" % (
+            "%.0f ms" % (self.first_frame * 1000) if self.first_frame is not None else "-",
+            "%.0f ms" % (self.done * 1000) if self.done is not None else "-")]
+        lines += ["  %-24s %8.1f ms" % (name, t * 1000) for name, t in self.phases.items()]
+        return "\n".join(lines)
+
+
+class _StartupPhase:
+    def __init__(self, startup, name):
+        self.startup = startup
+        self.name = name
+
+    def __enter__(self):
+        self.t = time.perf_counter()
+
+    def __exit__(self, *exc):
+        self.startup.phases[self.name] = self.startup.phases.get(self.name, 0.0) + time.perf_counter() - self.t
+
+
+def init_impostors():
+    global impostor_atlas
+    impostor_atlas = build_impostor_atlas()
+
+
+def start_services():
+    """
+    启动遥测与远程控制服务器（如已启用）。
+    Inicia os servidores de telemetria e controlo remoto (se ativos).
+    """
+    global telemetry, command_server
+    if USE_TELEMETRY and telemetry is None:
+        telemetry = TelemetryServer().start()
+    if USE_COMMAND_SERVER and command_server is None:
+        command_server = CommandServer().start()
+
+
+startup = Startup()
+
+
+# ============================================================================
+# 21. PARTICLES (粒子)
+# ============================================================================
+
+# Fumo do escape e pó das rodas traseiras. Todo o estado vive em arrays NumPy
+# pré-alocados usados como buffer circular; cada tick é um passo vetorizado e o
+# desenho é uma só chamada (quads virados para a câmara: os point sprites do
+# pipeline fixo não permitem tamanho por partícula).
+# 排气烟雾与后轮扬尘：全部状态存放在预分配的 NumPy 环形缓冲区中，每个 tick 一次向量化更新，
+# 一次绘制调用（面向摄像机的四边形；固定管线的点精灵不支持逐粒子大小）。
+
+PARTICLE_KINDS = {
+    "exhaust": dict(color=(0.55, 0.55, 0.58), alpha=0.45, life=1.6, size=0.10, growth=0.45,
+                    accel=(0.0, 0.5, 0.0), spread=0.05, jitter=0.4),
+    "dust": dict(color=(0.55, 0.45, 0.33), alpha=0.5, life=1.0, size=0.18, growth=0.8,
+                 accel=(0.0, -0.8, 0.0), spread=0.25, jitter=1.0),
+}
+# Emissores no referencial do carro: (tipo, posição local, velocidade local)
+# 车身坐标系中的发射器：(类型, 局部位置, 局部速度)
+PARTICLE_EMITTERS = (
+    ("exhaust", (-0.5, 0.1, 2.15), (0.0, 0.1, 1.2)),
+    ("exhaust", (0.5, 0.1, 2.15), (0.0, 0.1, 1.2)),
+    ("dust", (-1.05, -0.3, 1.4), (0.0, 0.8, 0.5)),
+    ("dust", (1.05, -0.3, 1.4), (0.0, 0.8, 0.5)),
+)
+PARTICLE_EMIT_MAX = 256         # máximo por emissor e por tick (每个发射器每 tick 上限)
+PARTICLE_DRAG = 1.2
+
+
+class ParticleSystem:
+    """
+    向量化粒子系统（环形缓冲区，稳态下不分配内存）。
+    Sistema de partículas vetorizado (buffer circular, sem alocações em regime estável).
+    """
+
+    def __init__(self, capacity=None):
+        n = self.capacity = capacity or PARTICLE_CAPACITY
+        f32 = np.float32
+        self.pos = np.zeros((n, 3), f32)
+        self.vel = np.zeros((n, 3), f32)
+        self.acc = np.zeros((n, 3), f32)
+        self.age = np.ones(n, f32)
+        self.life = np.ones(n, f32)
+        self.size = np.zeros(n, f32)
+        self.growth = np.zeros(n, f32)
+        self.alpha = np.zeros(n, f32)
+        self.verts = np.zeros((n, 4, 3), f32)
+        self.colors = np.zeros((n, 4, 4), f32)
+        self.texcoords = np.tile(np.array([[0, 0], [1, 0], [1, 1], [0, 1]], f32), (n, 1, 1))
+        self._tmp = np.zeros((n, 3), f32)
+        self._up = np.zeros((n, 3), f32)
+        self._a = np.zeros(n, f32)
+        self._noise = np.zeros((PARTICLE_EMIT_MAX, 3))
+        self.rng = np.random.default_rng()
+        self.head = 0
+        self.count = 0
+        self.carry = [0.0] * len(PARTICLE_EMITTERS)
+        self.last_pos = None
+        self.last_time = None
+        self.texture = None
+
+    def step(self, s, now=None):
+        """
+        一个 tick：按车速发射，然后积分所有粒子。
+        Um tick: emite conforme a velocidade do carro e integra todas as partículas.
+        """
+        now = time.perf_counter() if now is None else now
+        x, z = s.car_pos[0], s.car_pos[2]
+        if self.last_time is None:
+            self.last_time, self.last_pos = now, (x, z)
+            return
+        dt = min(now - self.last_time, 0.1)
+        if dt <= 0.0:
+            return
+        speed = math.hypot(x - self.last_pos[0], z - self.last_pos[1]) / dt
+        self.last_time, self.last_pos = now, (x, z)
+
+        if speed > 0.2:
+            c, sn = math.cos(s.car_yaw), math.sin(s.car_yaw)
+            shade = 0.35 if s.is_night else 1.0
+            for i, (kind, (lx, ly, lz), (vx, vy, vz)) in enumerate(PARTICLE_EMITTERS):
+                rate = PARTICLE_EXHAUST_RATE if kind == "exhaust" else PARTICLE_DUST_RATE * min(speed / 10.0, 1.0)
+                self.carry[i] += rate * dt
+                k = min(int(self.carry[i]), PARTICLE_EMIT_MAX)
+                self.carry[i] -= int(self.carry[i])
+                if k:
+                    origin = (x + lx * c + lz * sn, 0.35 + ly, z - lx * sn + lz * c)
+                    velocity = (vx * c + vz * sn, vy, -vx * sn + vz * c)
+                    self.emit(kind, k, origin, velocity, shade)
+
+        n = self.count
+        tmp = self._tmp[:n]
+        vel, pos = self.vel[:n], self.pos[:n]
+        np.multiply(self.acc[:n], dt, out=tmp)
+        vel += tmp
+        vel *= math.exp(-PARTICLE_DRAG * dt)
+        np.multiply(vel, dt, out=tmp)
+        pos += tmp
+        np.maximum(pos[:, 1], 0.02, out=pos[:, 1])
+        self.age[:n] += dt
+        np.multiply(self.growth[:n], dt, out=self._a[:n])
+        self.size[:n] += self._a[:n]
+
+    def emit(self, kind, k, origin, velocity, shade=1.0):
+        """
+        在环形缓冲区中写入 k 个新粒子（覆盖最旧的）。
+        Escreve k partículas novas no buffer circular (substitui as mais antigas).
+        """
+        first = min(k, self.capacity - self.head)
+        self._fill(slice(self.head, self.head + first), first, kind, origin, velocity, shade)
+        if k > first:
+            self._fill(slice(0, k - first), k - first, kind, origin, velocity, shade)
+        self.head = (self.head + k) % self.capacity
+        self.count = min(self.count + k, self.capacity)
+
+    def _fill(self, sl, k, kind, origin, velocity, shade):
+        p = PARTICLE_KINDS[kind]
+        noise = self._noise[:k]
+        self.rng.random(out=noise)
+        noise -= 0.5
+        noise *= p["spread"]
+        noise += origin
+        self.pos[sl] = noise
+        self.rng.random(out=noise)
+        noise -= 0.5
+        noise *= p["jitter"]
+        noise += velocity
+        self.vel[sl] = noise
+        self.acc[sl] = p["accel"]
+        self.age[sl] = 0.0
+        self.life[sl] = p["life"]
+        self.size[sl] = p["size"]
+        self.growth[sl] = p["growth"]
+        self.alpha[sl] = p["alpha"]
+        self.colors[sl, :, 0] = p["color"][0] * shade
+        self.colors[sl, :, 1] = p["color"][1] * shade
+        self.colors[sl, :, 2] = p["color"][2] * shade
+
+    def _build_texture(self):
+        y, x = np.mgrid[-1:1:32j, -1:1:32j]
+        alpha = np.clip(1.0 - np.sqrt(x * x + y * y), 0.0, 1.0) ** 1.5
+        image = np.empty((32, 32, 4), np.uint8)
+        image[..., :3] = 255
+        image[..., 3] = (alpha * 255).astype(np.uint8)
+        self.texture = glGenTextures(1)
+        glBindTexture(GL_TEXTURE_2D, self.texture)
+        glTexImage2D(GL_TEXTURE_2D, 0, GL_RGBA, 32, 32, 0, GL_RGBA, GL_UNSIGNED_BYTE, image)
+        glTexParameteri(GL_TEXTURE_2D, GL_TEXTURE_MIN_FILTER, GL_LINEAR)
+        glTexParameteri(GL_TEXTURE_2D, GL_TEXTURE_MAG_FILTER, GL_LINEAR)
+        glBindTexture(GL_TEXTURE_2D, 0)
+
+    def draw(self):
+        """
+        一次 glDrawArrays 画出所有粒子（需在设置摄像机之后调用）。
+        Desenha todas as partículas com um só glDrawArrays (depois de a câmara estar definida).
+        """
+        n = self.count
+        if n == 0:
+            return
+        if self.texture is None:
+            self._build_texture()
+        # Eixos da câmara em coordenadas do mundo (摄像机在世界坐标中的轴)
+        view = glGetFloatv(GL_MODELVIEW_MATRIX)
+        right, up = view[:3, 0], view[:3, 1]
+
+        a = self._a[:n]
+        np.divide(self.age[:n], self.life[:n], out=a)
+        np.subtract(1.0, a, out=a)
+        np.maximum(a, 0.0, out=a)
+        a *= self.alpha[:n]
+        self.colors[:n, :, 3] = a[:, None]
+
+        pos, v = self.pos[:n], self.verts[:n]
+        r, u = self._tmp[:n], self._up[:n]
+        np.multiply(self.size[:n, None], right, out=r)
+        np.multiply(self.size[:n, None], up, out=u)
+        np.subtract(pos, r, out=v[:, 0]); v[:, 0] -= u
+        np.add(pos, r, out=v[:, 1]); v[:, 1] -= u
+        np.add(pos, r, out=v[:, 2]); v[:, 2] += u
+        np.subtract(pos, r, out=v[:, 3]); v[:, 3] += u
+
+        glPushAttrib(GL_ENABLE_BIT | GL_DEPTH_BUFFER_BIT | GL_COLOR_BUFFER_BIT | GL_TEXTURE_BIT)
+        glDisable(GL_LIGHTING)
+        glEnable(GL_BLEND)
+        glBlendFunc(GL_SRC_ALPHA, GL_ONE_MINUS_SRC_ALPHA)
+        glDepthMask(GL_FALSE)
+        glEnable(GL_TEXTURE_2D)
+        glBindTexture(GL_TEXTURE_2D, self.texture)
+        glTexEnvi(GL_TEXTURE_ENV, GL_TEXTURE_ENV_MODE, GL_MODULATE)
+        glEnableClientState(GL_VERTEX_ARRAY)
+        glEnableClientState(GL_COLOR_ARRAY)
+        glEnableClientState(GL_TEXTURE_COORD_ARRAY)
+        glVertexPointer(3, GL_FLOAT, 0, self.verts)
+        glColorPointer(4, GL_FLOAT, 0, self.colors)
+        glTexCoordPointer(2, GL_FLOAT, 0, self.texcoords)
+        glDrawArrays(GL_QUADS, 0, 4 * n)
+        glDisableClientState(GL_VERTEX_ARRAY)
+        glDisableClientState(GL_COLOR_ARRAY)
+        glDisableClientState(GL_TEXTURE_COORD_ARRAY)
+        glPopAttrib()
+
+
+# ============================================================================
+# 22. TIRE TRACKS (轮胎印)
+# ============================================================================
+
+# Marcas das rodas traseiras no chão: anel de quads com capacidade fixa num VBO.
+# Os quads novos são escritos numa cópia em CPU e enviados com glBufferSubData
+# só para os slots alterados; o mais antigo é substituído quando o anel enche.
+# 后轮在地面留下的印记：固定容量的四边形环形 VBO。新印记先写入 CPU 副本，
+# 绘制时只用 glBufferSubData 上传改动的槽位；环满时覆盖最旧的印记。
+
+TRACK_WHEELS = ((-1.05, 1.2), (1.05, 1.2))     # rodas traseiras (x, z locais) / 后轮局部坐标
+TRACK_COLOR = (0.08, 0.07, 0.06, 0.45)
+TRACK_VERTEX = 7                                # x, y, z, r, g, b, a
+
+
+class TireTracks:
+    """
+    轮胎印环形缓冲区（内存与绘制开销恒定）。
+    Buffer circular de marcas de pneus (memória e custo de desenho constantes).
+    """
+
+    def __init__(self, capacity=None):
+        self.capacity = capacity or TRACK_CAPACITY
+        self.quads = np.zeros((self.capacity, 4, TRACK_VERTEX), np.float32)
+        self.quads[:, :, 3:] = TRACK_COLOR
+        self.head = 0
+        self.count = 0
+        self.pending = 0        # slots escritos desde o último upload (待上传的槽位数)
+        self.edges = [None] * len(TRACK_WHEELS)
+        self.vbo = None
+
+    def step(self, s):
+        """
+        车轮每前进 TRACK_SEGMENT 就追加一段印记。
+        Acrescenta um segmento por roda a cada TRACK_SEGMENT percorrido.
+        """
+        x, z = s.car_pos[0], s.car_pos[2]
+        c, sn = math.cos(s.car_yaw), math.sin(s.car_yaw)
+        half = TRACK_WIDTH / 2.0
+        for i, (lx, lz) in enumerate(TRACK_WHEELS):
+            px, pz = x + lx * c + lz * sn, z - lx * sn + lz * c
+            prev = self.edges[i]
+            if prev is None:
+                self.edges[i] = (px, pz, None, None)
+                continue
+            dx, dz = px - prev[0], pz - prev[1]
+            d = math.hypot(dx, dz)
+            if d < TRACK_SEGMENT:
+                continue
+            nx, nz = -dz / d * half, dx / d * half
+            left, right = (px + nx, pz + nz), (px - nx, pz - nz)
+            if d > 4.0 * TRACK_SEGMENT:
+                # Salto (reset, replay): começa um rasto novo (跳变时重新开始)
+                self.edges[i] = (px, pz, left, right)
+                continue
+            start_left = prev[2] or (prev[0] + nx, prev[1] + nz)
+            start_right = prev[3] or (prev[0] - nx, prev[1] - nz)
+            self.append(start_left, start_right, right, left)
+            self.edges[i] = (px, pz, left, right)
+
+    def append(self, *corners):
+        quad = self.quads[self.head]
+        for j, (cx, cz) in enumerate(corners):
+            quad[j, 0] = cx
+            quad[j, 2] = cz
+        self.head = (self.head + 1) % self.capacity
+        self.count = min(self.count + 1, self.capacity)
+        self.pending = min(self.pending + 1, self.capacity)
+
+    def _upload(self):
+        if self.vbo is None:
+            self.vbo = glGenBuffers(1)
+            glBindBuffer(GL_ARRAY_BUFFER, self.vbo)
+            glBufferData(GL_ARRAY_BUFFER, self.quads.nbytes, None, GL_DYNAMIC_DRAW)
+        else:
+            glBindBuffer(GL_ARRAY_BUFFER, self.vbo)
+        # Intervalo [head - pending, head) do anel, no máximo dois pedaços (最多两段)
+        start = (self.head - self.pending) % self.capacity
+        size = self.quads[0].nbytes
+        for lo, hi in ((start, min(start + self.pending, self.capacity)),
+                       (0, max(start + self.pending - self.capacity, 0))):
+            if hi > lo:
+                glBufferSubData(GL_ARRAY_BUFFER, lo * size, (hi - lo) * size, self.quads[lo:hi])
+        self.pending = 0
+
+    def release(self):
+        if self.vbo is not None:
+            glDeleteBuffers(1, [self.vbo])
+            self.vbo = None
+            self.pending = self.count
+
+    def draw(self):
+        """
+        以多边形偏移在地面上一次画出所有印记。
+        Desenha todas as marcas sobre o chão numa só chamada, com polygon offset.
+        """
+        if self.count == 0:
+            return
+        if self.vbo is None or self.pending:
+            self._upload()
+        glPushAttrib(GL_ENABLE_BIT | GL_DEPTH_BUFFER_BIT | GL_COLOR_BUFFER_BIT | GL_POLYGON_BIT)
+        glDisable(GL_LIGHTING)
+        glDisable(GL_TEXTURE_2D)
+        glDisable(GL_CULL_FACE)
+        glEnable(GL_BLEND)
+        glBlendFunc(GL_SRC_ALPHA, GL_ONE_MINUS_SRC_ALPHA)
+        glDepthMask(GL_FALSE)
+        glEnable(GL_POLYGON_OFFSET_FILL)
+        glPolygonOffset(-1.0, -2.0)
+        stride = TRACK_VERTEX * 4
+        glBindBuffer(GL_ARRAY_BUFFER, self.vbo)
+        glEnableClientState(GL_VERTEX_ARRAY)
+        glEnableClientState(GL_COLOR_ARRAY)
+        glVertexPointer(3, GL_FLOAT, stride, ctypes.c_void_p(0))
+        glColorPointer(4, GL_FLOAT, stride, ctypes.c_void_p(12))
+        glBindBuffer(GL_ARRAY_BUFFER, 0)
+        glDrawArrays(GL_QUADS, 0, 4 * self.count)
+        glDisableClientState(GL_VERTEX_ARRAY)
+        glDisableClientState(GL_COLOR_ARRAY)
+        glPopAttrib()
+
+
+# ============================================================================
+# 23. SECONDARY VIEWS (次级视图)
+# ============================================================================
+
+# Espelho retrovisor e vistas picture-in-picture desenhados para texturas (FBO).
+# Cada vista tem resolução, intervalo de atualização e viés de LOD próprios; as
+# vistas com o mesmo intervalo alternam de frame. Os objetos são cortados pelo
+# frustum da vista e, onde este se sobrepõe ao da vista principal (com o olho
+# perto), reutilizam a visibilidade das occlusion queries da vista principal em
+# vez de emitir queries novas.
+# 后视镜与画中画视图渲染到纹理；每个视图有独立的分辨率、更新间隔和 LOD 偏置。
+# 物体先按视图视锥剔除，与主视图视锥重叠处直接复用主视图的遮挡查询结果。
+
+# Câmaras das vistas: (olho, alvo, vetor up) em coordenadas do mundo (视图摄像机)
+def mirror_camera(s):
+    c, sn = math.cos(s.car_yaw), math.sin(s.car_yaw)
+    x, y, z = s.car_pos[0], 1.35, s.car_pos[2]
+    return (x, y, z), (x + 10.0 * sn, y - 1.0, z + 10.0 * c), (0.0, 1.0, 0.0)
+
+
+def map_camera(s):
+    x, z = s.car_pos[0], s.car_pos[2]
+    return (x, 80.0, z), (x, 0.0, z), (-math.sin(s.car_yaw), 0.0, -math.cos(s.car_yaw))
+
+
+VIEW_CAMERAS = {"mirror": mirror_camera, "map": map_camera}
+kind_radii = {}
+
+
+def frustum_planes():
+    """
+    由当前投影与模型视图矩阵得到 6 个归一化的视锥平面 (6, 4)。
+    Os 6 planos normalizados do frustum das matrizes atuais (6, 4).
+    """
+    mv = np.array(glGetFloatv(GL_MODELVIEW_MATRIX), dtype=np.float64).reshape(4, 4)
+    proj = np.array(glGetFloatv(GL_PROJECTION_MATRIX), dtype=np.float64).reshape(4, 4)
+    m = mv @ proj
+    planes = np.array([m[:, 3] + m[:, i // 2] if i % 2 == 0 else m[:, 3] - m[:, i // 2] for i in range(6)])
+    return planes / np.linalg.norm(planes[:, :3], axis=1, keepdims=True)
+
+
+def sphere_mask(planes, centers, radii):
+    """
+    包围球与视锥相交的掩码。
+    Máscara das esferas envolventes que intersetam o frustum.
+    """
+    d = centers @ planes[:, :3].T + planes[:, 3]
+    return (d >= -radii[:, None]).all(axis=1)
+
+
+def scene_radii(scene):
+    """
+    场景记录的包围球半径（缓存在场景上）。
+    Raios das esferas envolventes dos registos (guardados na cena).
+    """
+    radii = getattr(scene, "radii", None)
+    if radii is None or len(radii) != len(scene):
+        for k in scene.kinds:
+            if k not in kind_radii:
+                pos = get_baked_mesh(SCENE_KINDS[k]).arrays["positions"]
+                kind_radii[k] = float(np.linalg.norm(pos, axis=1).max()) if len(pos) else 1.0
+        per_kind = np.array([kind_radii[k] for k in scene.kinds])
+        radii = scene.radii = per_kind[scene.records["kind"]] * np.abs(scene.records["scale"]).max(axis=1)
+    return radii
+
+
+class RenderView:
+    """
+    渲染到纹理的次级视图。
+    Uma vista secundária renderizada para textura.
+    """
+
+    def __init__(self, name, size, interval=1, lod_bias=1.0, fov=45.0, far=300.0,
+                 extent=None, car=True, enabled=True, phase=0):
+        self.name = name
+        self.size = size
+        self.interval = interval
+        # Os impostores rodam só em Y: vistos de cima ficariam de perfil (替身只绕 Y 轴旋转，俯视时不可见)
+        self.impostor_distance = math.inf if extent is not None else IMPOSTOR_DISTANCE * lod_bias
+        self.fov, self.far, self.extent = fov, far, extent
+        self.car = car
+        self.enabled = enabled
+        self.phase = phase
+        self.target = None
+        self.planes = None
+        self.eye = None
+        self.frames = 0
+        self.state = None           # State da última renderização (最近一次渲染所用的 State)
+        self.rendered_frame = -1
+
+    @property
+    def texture(self):
+        return self.target.color if self.target is not None else None
+
+    def cull(self, scene):
+        """
+        返回本视图需要绘制的记录掩码。
+        Máscara dos registos a desenhar nesta vista.
+        """
+        radii = scene_radii(scene)
+        keep = sphere_mask(self.planes, scene.records["position"], radii)
+        occlusion = getattr(scene, "occlusion", None)
+        if occlusion is not None and secondary_views.shares_occlusion(self):
+            keep &= ~secondary_views.main_mask(scene, radii) | occlusion["visible"]
+        return keep
+
+    def render(self):
+        global camera_eye, active_view
+        if self.target is None:
+            self.target = OffscreenTarget(*self.size, texture=True)
+        w, h = self.size
+        eye, target, up = VIEW_CAMERAS[self.name](state)
+        self.target.bind()
+        clear_sky()
+        glMatrixMode(GL_PROJECTION)
+        glLoadIdentity()
+        if self.extent is not None:
+            glOrtho(-self.extent * w / h, self.extent * w / h, -self.extent, self.extent, 1.0, self.far)
+        else:
+            gluPerspective(self.fov, w / h, 0.1, self.far)
+        glMatrixMode(GL_MODELVIEW)
+        glLoadIdentity()
+        gluLookAt(*eye, *target, *up)
+        self.planes, self.eye = frustum_planes(), eye
+        saved, camera_eye, active_view = camera_eye, eye, self
+        try:
+            setup_lights()
+            if world is not None:
+                world.draw()
+            else:
+                draw_mosaic_floor()
+                draw_scene_objects(scene)
+            if tire_tracks is not None:
+                tire_tracks.draw()
+            if self.car:
+                draw_complete_car()
+        finally:
+            camera_eye, active_view = saved, None
+            self.target.unbind()
+        self.frames += 1
+        self.state = state
+
+    def release(self):
+        if self.target is not None:
+            self.target.release()
+            self.target = None
+
+
+class SecondaryViews:
+    """
+    管理所有次级视图：按间隔轮流渲染，并提供主视图的剔除结果。
+    Gere as vistas secundárias: renderiza-as à vez e partilha o culling da vista principal.
+    """
+
+    def __init__(self, config=None):
+        config = SECONDARY_VIEWS if config is None else config
+        self.views = {name: RenderView(name, phase=i, **cfg) for i, (name, cfg) in enumerate(config.items())}
+        self.frame = 0
+        self.main_planes = None
+        self.main_eye = None
+
+    def capture_main(self):
+        """
+        记录主视图的视锥（在主视图设置摄像机之后调用）。
+        Guarda o frustum da vista principal (depois de a câmara principal estar definida).
+        """
+        self.frame += 1
+        self.main_planes, self.main_eye = frustum_planes(), camera_eye
+
+    def render_stale(self):
+        """
+        立即重画属于另一个 State 的视图（在画车之前调用，镜子才不会显示别的环境）。
+        Redesenha já as vistas feitas para outro State (mosaicos de VecDrivingEnv,
+        render_batch), antes de o carro usar a textura do espelho.
+        """
+        self._render([v for v in self.views.values() if v.enabled and v.state is not state])
+
+    def shares_occlusion(self, view):
+        return self.main_planes is not None and math.dist(view.eye, self.main_eye) < VIEW_REUSE_DISTANCE
+
+    def main_mask(self, scene, radii):
+        cached = getattr(scene, "main_mask", None)
+        if cached is None or cached[0] != self.frame:
+            cached = scene.main_mask = (self.frame, sphere_mask(self.main_planes, scene.records["position"], radii))
+        return cached[1]
+
+    def render_due(self):
+        """
+        渲染本帧到期的视图（不改变主视图的矩阵）。
+        Renderiza as vistas que tocam neste frame (sem alterar as matrizes principais).
+        """
+        self._render([v for v in self.views.values() if v.enabled and v.rendered_frame != self.frame
+                      and (v.state is not state or (self.frame + v.phase) % v.interval == 0)])
+
+    def _render(self, due):
+        if not due:
+            return
+        # O mosaico de VecDrivingEnv usa scissor: desligar para limpar a textura toda (关闭裁剪测试)
+        glPushAttrib(GL_SCISSOR_BIT)
+        glDisable(GL_SCISSOR_TEST)
+        glMatrixMode(GL_PROJECTION)
+        glPushMatrix()
+        glMatrixMode(GL_MODELVIEW)
+        glPushMatrix()
+        for view in due:
+            view.render()
+            view.rendered_frame = self.frame
+        glMatrixMode(GL_PROJECTION)
+        glPopMatrix()
+        glMatrixMode(GL_MODELVIEW)
+        glPopMatrix()
+        glPopAttrib()
+
+    def toggle(self, name):
+        view = self.views.get(name)
+        if view is not None:
+            view.enabled = not view.enabled
+
+    def draw_overlays(self):
+        """
+        在屏幕右上角画出小地图（画中画）。
+        Desenha o mapa (picture-in-picture) no canto superior direito.
+        """
+        view = self.views.get("map")
+        if view is None or not view.enabled or not view.frames:
+            return
+        _, _, w, h = glGetIntegerv(GL_VIEWPORT)
+        size = MAP_OVERLAY_SIZE
+        x0, y0 = w - size - 10, h - size - 10
+        glPushAttrib(GL_ENABLE_BIT | GL_TEXTURE_BIT)
+        glDisable(GL_LIGHTING)
+        glDisable(GL_DEPTH_TEST)
+        glEnable(GL_TEXTURE_2D)
+        glBindTexture(GL_TEXTURE_2D, view.texture)
+        glTexEnvi(GL_TEXTURE_ENV, GL_TEXTURE_ENV_MODE, GL_REPLACE)
+        glMatrixMode(GL_PROJECTION)
+        glPushMatrix()
+        glLoadIdentity()
+        glOrtho(0, w, 0, h, -1, 1)
+        glMatrixMode(GL_MODELVIEW)
+        glPushMatrix()
+        glLoadIdentity()
+        glBegin(GL_QUADS)
+        glTexCoord2f(0, 0); glVertex2f(x0, y0)
+        glTexCoord2f(1, 0); glVertex2f(x0 + size, y0)
+        glTexCoord2f(1, 1); glVertex2f(x0 + size, y0 + size)
+        glTexCoord2f(0, 1); glVertex2f(x0, y0 + size)
+        glEnd()
+        glPopMatrix()
+        glMatrixMode(GL_PROJECTION)
+        glPopMatrix()
+        glMatrixMode(GL_MODELVIEW)
+        glPopAttrib()
+
+    def release(self):
+        for view in self.views.values():
+            view.release()
+
+
+def draw_mirror_glass():
+    """
+    用后视镜视图的纹理画两面镜子（左右翻转，各取一半）。
+    Desenha o vidro dos espelhos com a textura da vista "mirror" (invertida, metade cada).
+    """
+    view = secondary_views.views.get("mirror")
+    if view is None or not view.frames:
+        return
+    glPushAttrib(GL_ENABLE_BIT | GL_TEXTURE_BIT)
+    glDisable(GL_LIGHTING)
+    glEnable(GL_TEXTURE_2D)
+    glBindTexture(GL_TEXTURE_2D, view.texture)
+    glTexEnvi(GL_TEXTURE_ENV, GL_TEXTURE_ENV_MODE, GL_REPLACE)
+    for s in [-1, 1]:
+        u0, u1 = (1.0, 0.5) if s < 0 else (0.5, 0.0)
+        glPushMatrix()
+        glTranslatef(s * 0.9, 0.8, -0.7)
+        glRotatef(s * -15, 0, 1, 0)
+        glBegin(GL_QUADS)
+        glTexCoord2f(u0, 0); glVertex3f(-0.2, -0.1, 0.16)
+        glTexCoord2f(u1, 0); glVertex3f(0.2, -0.1, 0.16)
+        glTexCoord2f(u1, 1); glVertex3f(0.2, 0.1, 0.16)
+        glTexCoord2f(u0, 1); glVertex3f(-0.2, 0.1, 0.16)
+        glEnd()
+        glPopMatrix()
+    glPopAttrib()
+
+
+def init_secondary_views():
+    """
+    创建次级视图（需要 FBO 支持）。
+    Cria as vistas secundárias (requer suporte de FBO).
+    """
+    if not bool(glGenFramebuffers):
+        return None
+    return SecondaryViews()
+
+
+# ============================================================================
+# 24. TRIGGER ZONES (触发区域)
+# ============================================================================
+
+# Volumes com nome (caixas no plano xz) registados numa grelha uniforme. Uma vez
+# por tick de simulação todas as viaturas são testadas só contra as zonas da
+# sua célula, e as mudanças geram eventos de entrada/saída para os subscritores
+# (luzes da garagem, porta automática). O código de desenho lê apenas as flags
+# que os subscritores deixam no State.
+# 命名触发区域（xz 平面上的盒子）注册在均匀网格中；每个模拟 tick 对所有车辆只测试所在格子的区域，
+# 状态变化时向订阅者发出进入/离开事件。绘制代码只读取订阅者写入 State 的标志。
+
+# Zona -> flag do State mantida pelos eventos (区域 -> 由事件维护的 State 标志)
+GARAGE_ZONE_FLAGS = {"garage": "car_in_garage", "garage_apron": "car_at_garage_door"}
+
+
+class TriggerZones:
+    """
+    触发区域的空间索引与进入/离开事件。
+    Índice espacial das zonas de disparo e eventos de entrada/saída.
+
+    Os handlers são chamados como handler(context, vehicle, zone_id).
+    """
+
+    def __init__(self, cell=TRIGGER_CELL_SIZE):
+        self.cell = cell
+        self.names = []
+        self.boxes = np.zeros((0, 4))
+        self.grid = {}
+        self.handlers = collections.defaultdict(list)
+        self.inside = np.zeros((0, 0), dtype=bool)     # (viaturas, zonas) / (车辆, 区域)
+
+    def add(self, name, box):
+        """
+        注册区域 box = (x0, z0, x1, z1)，返回其编号。
+        Regista a zona box = (x0, z0, x1, z1) e devolve o seu número.
+        """
+        zone = len(self.names)
+        self.names.append(name)
+        self.boxes = np.vstack([self.boxes, np.asarray(box, dtype=np.float64)])
+        x0, z0, x1, z1 = box
+        for cx in range(int(math.floor(x0 / self.cell)), int(math.floor(x1 / self.cell)) + 1):
+            for cz in range(int(math.floor(z0 / self.cell)), int(math.floor(z1 / self.cell)) + 1):
+                self.grid.setdefault((cx, cz), []).append(zone)
+        self.inside = np.zeros((len(self.inside), len(self.names)), dtype=bool)
+        return zone
+
+    def subscribe(self, name, on_enter=None, on_exit=None):
+        self.handlers[name].append((on_enter, on_exit))
+
+    def query(self, x, z):
+        """
+        返回 (N, Z) 布尔矩阵：每辆车位于哪些区域。
+        Devolve uma matriz (N, Z): em que zonas está cada viatura.
+        """
+        x, z = np.atleast_1d(np.asarray(x, dtype=np.float64)), np.atleast_1d(np.asarray(z, dtype=np.float64))
+        result = np.zeros((len(x), len(self.names)), dtype=bool)
+        if not self.grid or not len(x):
+            return result
+        # Chave inteira por célula (每个格子一个整数键): cx * 2^32 + cz
+        cx = np.floor(x / self.cell).astype(np.int64)
+        cz = np.floor(z / self.cell).astype(np.int64)
+        keys, inverse, counts = np.unique((cx << 32) + cz, return_inverse=True, return_counts=True)
+        groups = np.split(np.argsort(inverse, kind="stable"), np.cumsum(counts)[:-1])
+        for key, rows in zip(keys.tolist(), groups):
+            kx, kz = divmod(key + (1 << 31), 1 << 32)
+            zones = self.grid.get((kx, kz - (1 << 31)))
+            if zones is None:
+                continue
+            b = self.boxes[zones]
+            px, pz = x[rows, None], z[rows, None]
+            result[np.ix_(rows, zones)] = (b[:, 0] <= px) & (px <= b[:, 2]) & (b[:, 1] <= pz) & (pz <= b[:, 3])
+        return result
+
+    def update(self, x, z, context=None):
+        """
+        每个模拟 tick 调用一次：更新所有车辆所在区域并分发事件（先离开后进入）。
+        Chamado uma vez por tick: atualiza as zonas de todas as viaturas e envia
+        os eventos (saídas antes das entradas). Devolve (entered, exited).
+        """
+        now = self.query(x, z)
+        if self.inside.shape != now.shape:
+            self.inside = np.zeros_like(now)
+        entered, exited = now & ~self.inside, self.inside & ~now
+        self.inside = now
+        for which, events in ((1, exited), (0, entered)):
+            for vehicle, zone in np.argwhere(events).tolist():
+                for handler in self.handlers.get(self.names[zone], ()):
+                    if handler[which] is not None:
+                        handler[which](context, vehicle, zone)
+        return entered, exited
+
+    def names_inside(self, vehicle=0):
+        if vehicle >= len(self.inside):
+            return set()
+        return {self.names[zone] for zone in np.flatnonzero(self.inside[vehicle]).tolist()}
+
+
+def set_zone_flags(s, names):
+    """
+    按所在区域设置 State 标志（用于没有事件历史的状态）。
+    Define as flags do State a partir das zonas (para estados sem histórico de eventos).
+    """
+    for name, flag in GARAGE_ZONE_FLAGS.items():
+        setattr(s, flag, name in names)
+
+
+def build_trigger_zones(scene, flags=True):
+    """
+    由场景生成触发区域：每个车库的内部与门前区域。
+    Cria as zonas de disparo da cena: interior e frente de cada garagem.
+    flags=True liga as zonas às flags do State (GARAGE_ZONE_FLAGS).
+    """
+    zones = TriggerZones()
+    w, h, d, th = GARAGE_DIMS
+    for i in range(len(scene)):
+        rec = scene.records[i]
+        if scene.kinds[int(rec["kind"])] != "garage":
+            continue
+        m = record_matrix(rec)
+        zones.add("garage", _transform_box(m, (-w/2, -d, w/2, 0.0)))
+        zones.add("garage_apron", _transform_box(m, (-w/2 - 2.0, 0.0, w/2 + 2.0, GARAGE_APRON_DEPTH)))
+    if flags:
+        for name, flag in GARAGE_ZONE_FLAGS.items():
+            zones.subscribe(name, lambda s, vehicle, zone, flag=flag: setattr(s, flag, True),
+                            lambda s, vehicle, zone, flag=flag: setattr(s, flag, False))
+    return zones
+
+
+def step_triggers(s):
+    """
+    模拟 tick 中调用：用主车辆位置更新触发区域。
+    Chamado no tick da simulação com a posição do carro principal.
+    """
+    if triggers is not None:
+        triggers.update(s.car_pos[0], s.car_pos[2], s)
+
+
+# ============================================================================
+# 25. CAMERA COLLISION (摄像机碰撞)
+# ============================================================================
+
+# A câmara orbital e a de seguir lançam um raio do carro até à posição desejada
+# contra uma BVH das caixas envolventes da geometria estática (construída uma
+# vez com a cena). Se o raio bate nalguma coisa, a câmara aproxima-se com
+# suavização, sem nunca ficar dentro da geometria; a porta da garagem (dinâmica)
+# é testada à parte.
+# 轨道/跟随摄像机从车辆向期望位置发射射线，与静态几何包围盒的 BVH 求交（随场景构建一次）；
+# 被遮挡时平滑地拉近，但绝不进入几何体内部。车库门是动态的，单独测试。
+
+CAMERA_NEAR_MARGIN = 0.15       # distância mínima à geometria, sem suavização (与几何体的硬性最小距离)
+CAMERA_MIN_OFFSET = 0.3         # distância horizontal mínima ao carro (与车辆的最小水平距离)
+
+
+def _camera_eye(pivot, direction, dist):
+    """
+    沿方向放置眼睛，并保持与车辆的最小水平距离：眼睛在目标正上方时 up 向量共线，gluLookAt 矩阵奇异。
+    Coloca o olho ao longo da direção, mantendo uma distância horizontal mínima
+    ao pivô: um olho na vertical do alvo torna a matriz do gluLookAt singular.
+    """
+    dist = max(dist, CAMERA_MIN_OFFSET)
+    eye = [p + c * dist for p, c in zip(pivot, direction)]
+    hx, hz = eye[0] - pivot[0], eye[2] - pivot[2]
+    horizontal = math.hypot(hx, hz)
+    if horizontal < CAMERA_MIN_OFFSET:
+        hx, hz = (hx / horizontal, hz / horizontal) if horizontal > 1e-9 else (0.0, 1.0)
+        eye[0] = pivot[0] + hx * CAMERA_MIN_OFFSET
+        eye[2] = pivot[2] + hz * CAMERA_MIN_OFFSET
+    return tuple(eye)
+
+
+def garage_camera_boxes():
+    """
+    车库静态部分的三维包围盒（局部坐标）：左右墙、后墙、屋顶。
+    Caixas 3D das partes estáticas da garagem (coordenadas locais).
+    """
+    w, h, d, th = GARAGE_DIMS
+    return [(-w/2 - 0.1, 0.0, -d, -w/2 + 0.1, h, 0.0),
+            (w/2 - 0.1, 0.0, -d, w/2 + 0.1, h, 0.0),
+            (-w/2, 0.0, -d - 0.1, w/2, h, -d + 0.1),
+            (-(w + 1)/2, h - th/2, -d - 0.5, (w + 1)/2, h + th/2, 0.5)]
+
+
+def _world_box(m, box):
+    x0, y0, z0, x1, y1, z1 = box
+    corners = np.array([[x, y, z, 1.0] for x in (x0, x1) for y in (y0, y1) for z in (z0, z1)]) @ m.T
+    return tuple(corners[:, :3].min(axis=0).tolist()) + tuple(corners[:, :3].max(axis=0).tolist())
+
+
+def _slab(b, ox, oy, oz, ix, iy, iz):
+    """
+    射线与盒子 (x0, y0, z0, x1, y1, z1) 的进入/离开参数（ix.. 为方向的倒数）。
+    Parâmetros de entrada/saída do raio na caixa (ix.. = inverso da direção).
+    """
+    t1, t2 = (b[0] - ox) * ix, (b[3] - ox) * ix
+    near, far = min(t1, t2), max(t1, t2)
+    t1, t2 = (b[1] - oy) * iy, (b[4] - oy) * iy
+    near, far = max(near, min(t1, t2)), min(far, max(t1, t2))
+    t1, t2 = (b[2] - oz) * iz, (b[5] - oz) * iz
+    return max(near, min(t1, t2)), min(far, max(t1, t2))
+
+
+class BVH:
+    """
+    轴对齐包围盒层次结构（中位数划分，构建一次）。
+    Hierarquia de caixas alinhadas com os eixos (divisão pela mediana, construída uma vez).
+
+    Os nós são tuplos (x0, y0, z0, x1, y1, z1, esquerdo, direito, eixo); nas
+    folhas esquerdo = -1 e direito é o tuplo dos índices das caixas.
+    """
+
+    def __init__(self, lo, hi, leaf_size=4):
+        self.boxes = [tuple(a) + tuple(b) for a, b in zip(lo.tolist(), hi.tolist())]
+        self.nodes = []
+        if self.boxes:
+            self._build(np.arange(len(self.boxes)), lo, hi, leaf_size)
+
+    def __len__(self):
+        return len(self.boxes)
+
+    def _build(self, idx, lo, hi, leaf_size):
+        node = len(self.nodes)
+        self.nodes.append(None)
+        bounds = tuple(lo[idx].min(axis=0).tolist()) + tuple(hi[idx].max(axis=0).tolist())
+        if len(idx) <= leaf_size:
+            self.nodes[node] = bounds + (-1, tuple(idx.tolist()), 0)
+            return node
+        axis = int(np.argmax(np.subtract(bounds[3:], bounds[:3])))
+        order = idx[np.argsort(lo[idx, axis] + hi[idx, axis], kind="stable")]
+        half = len(order) // 2
+        left = self._build(order[:half], lo, hi, leaf_size)
+        right = self._build(order[half:], lo, hi, leaf_size)
+        self.nodes[node] = bounds + (left, right, axis)
+        return node
+
+    def raycast(self, origin, direction, t_max, extra=()):
+        """
+        射线在 t_max 内的第一次命中 (t, 盒子编号)；未命中返回 (t_max, -1)。
+        Primeiro impacto do raio até t_max: (t, índice da caixa), ou (t_max, -1).
+        Caixas que contêm a origem são ignoradas; 'extra' são caixas testadas à
+        parte (índice -2).
+        """
+        ox, oy, oz = origin
+        ix, iy, iz = (1.0 / c if abs(c) > 1e-12 else 1e30 for c in direction)
+        best, hit = t_max, -1
+        for box in extra:
+            near, far = _slab(box, ox, oy, oz, ix, iy, iz)
+            if near <= far and 0.0 <= near < best:
+                best, hit = near, -2
+        nodes, boxes = self.nodes, self.boxes
+        negative = (ix < 0.0, iy < 0.0, iz < 0.0)
+        stack = [0] if nodes else []
+        while stack:
+            n = nodes[stack.pop()]
+            # _slab em linha: é o ciclo mais quente (内联的 _slab：最热的循环)
+            t1, t2 = (n[0] - ox) * ix, (n[3] - ox) * ix
+            near, far = (t2, t1) if t1 > t2 else (t1, t2)
+            t1, t2 = (n[1] - oy) * iy, (n[4] - oy) * iy
+            if t1 > t2: t1, t2 = t2, t1
+            if t1 > near: near = t1
+            if t2 < far: far = t2
+            t1, t2 = (n[2] - oz) * iz, (n[5] - oz) * iz
+            if t1 > t2: t1, t2 = t2, t1
+            if t1 > near: near = t1
+            if t2 < far: far = t2
+            if near > far or far < 0.0 or near >= best:
+                continue
+            if n[6] >= 0:
+                # Filho mais próximo primeiro, para encurtar o raio cedo (先访问较近的子节点)
+                if negative[n[8]]:
+                    stack.append(n[6])
+                    stack.append(n[7])
+                else:
+                    stack.append(n[7])
+                    stack.append(n[6])
+                continue
+            for i in n[7]:
+                near, far = _slab(boxes[i], ox, oy, oz, ix, iy, iz)
+                if near <= far and 0.0 <= near < best:
+                    best, hit = near, i
+        return best, hit
+
+
+class CameraCollider:
+    """
+    摄像机碰撞：场景静态几何的 BVH + 平滑的拉近/回退。
+    Colisão da câmara: BVH da geometria estática da cena + aproximação suavizada.
+    """
+
+    def __init__(self, scene):
+        boxes, self.doors = [], []
+        bounds = {}
+        w, h, d, th = GARAGE_DIMS
+        for i in range(len(scene)):
+            rec = scene.records[i]
+            kind = scene.kinds[int(rec["kind"])]
+            m = record_matrix(rec)
+            if kind == "garage":
+                parts = garage_camera_boxes()
+                self.doors.append(_world_box(m, (-w/2, 0.0, -0.1, w/2, h, 0.1)))
+            else:
+                b = bounds.get(kind)
+                if b is None:
+                    pos = get_baked_mesh(SCENE_KINDS[kind]).arrays["positions"]
+                    b = bounds[kind] = tuple(pos.min(axis=0).tolist()) + tuple(pos.max(axis=0).tolist())
+                parts = [b]
+            boxes.extend(_world_box(m, box) for box in parts)
+        boxes = np.array(boxes, dtype=np.float64).reshape(-1, 6)
+        self.bvh = BVH(boxes[:, :3], boxes[:, 3:])
+        self.key = None
+        self.fraction = 1.0
+        self.time = 0.0
+
+    def resolve(self, pivot, eye, s):
+        """
+        沿 pivot -> eye 的射线把摄像机放在第一个障碍之前。
+        Coloca a câmara antes do primeiro obstáculo no raio pivot -> eye.
+        A suavização só se aplica quando o mesmo State é desenhado em frames
+        seguidos (nos mosaicos de VecDrivingEnv a câmara salta logo para o sítio).
+        """
+        offset = [e - p for e, p in zip(eye, pivot)]
+        length = math.sqrt(sum(c * c for c in offset))
+        if length < 1e-6:
+            return _camera_eye(pivot, (0.0, 0.0, 1.0), 0.0)
+        direction = [c / length for c in offset]
+        # Porta da garagem à altura atual (车库门的当前高度)
+        doors = [(x0, y0 + s.garage_door_height, z0, x1, y1, z1)
+                 for x0, y0, z0, x1, y1, z1 in self.doors if y0 + s.garage_door_height < y1]
+        t, hit = self.bvh.raycast(pivot, direction, length + CAMERA_RADIUS, doors)
+        soft = 1.0 if hit == -1 else max(t - CAMERA_RADIUS, CAMERA_MIN_DISTANCE) / length
+        hard = 1.0 if hit == -1 else max(t - CAMERA_NEAR_MARGIN, 0.0) / length
+
+        now = time.perf_counter()
+        if self.key != id(s):
+            self.fraction = soft
+        else:
+            tau = CAMERA_PULL_IN_TIME if soft < self.fraction else CAMERA_RELEASE_TIME
+            self.fraction += (soft - self.fraction) * (1.0 - math.exp(-(now - self.time) / tau))
+        self.key, self.time = id(s), now
+        f = min(self.fraction, hard, 1.0)
+        return _camera_eye(pivot, direction, length * f)
+
+
+def avoid_camera_obstacles(eye):
+    """
+    compute_camera 使用：被遮挡时把摄像机拉向车辆。
+    Usado por compute_camera: aproxima a câmara do carro quando a vista está bloqueada.
+    """
+    if camera_collider is None:
+        return eye
+    pivot = (state.car_pos[0], state.car_pos[1] + 1.0, state.car_pos[2])
+    return camera_collider.resolve(pivot, eye, state)
+
+
+def init_camera_collider():
+    global camera_collider
+    camera_collider = CameraCollider(scene)
+
+
+# ============================================================================
+# 26. NAVIGATION (导航)
+# ============================================================================
+
+# Grelha de navegação rasterizada uma vez a partir das caixas de colisão
+# (alargadas pela meia largura do carro) e um campo de fluxo por destino com
+# nome: cada célula guarda a distância ao destino e a direção a seguir, por isso
+# guiar um carro é só uma consulta O(1). A porta da garagem é o único obstáculo
+# que muda: os campos são guardados por estado da porta e, quando a porta abre,
+# o campo com a porta fechada é atualizado de forma incremental (só distâncias
+# que diminuem, a partir das células libertadas) em vez de recalculado. Isto só
+# poupa trabalho para destinos fora da porta; o campo de "garage" com a porta
+# fechada cobre só o interior, por isso esse é recalculado por inteiro.
+# 由碰撞盒（按车宽膨胀）栅格化一次的导航网格，以及每个命名目的地的流场：每个格子保存到目的地的
+# 距离和前进方向，车辆转向只需 O(1) 查表。车库门是唯一会变化的障碍：流场按门的状态缓存，
+# 门打开时从关门流场出发，只从被释放的格子做“只减小”的增量传播（仅对门外的目的地有效）。
+
+NAV_REVERSE_ANGLE = math.radians(120.0)
+NAV_NEIGHBORS = ((0, -1, 1.0), (0, 1, 1.0), (-1, 0, 1.0), (1, 0, 1.0),
+                 (-1, -1, math.sqrt(2.0)), (-1, 1, math.sqrt(2.0)), (1, -1, math.sqrt(2.0)), (1, 1, math.sqrt(2.0)))
+# Destino alternativo quando o principal não é alcançável (目的地不可达时的备选)
+NAV_FALLBACK = {"garage": "garage_apron"}
+
+
+class Navigation:
+    """
+    导航网格与按目的地缓存的流场。
+    Grelha de navegação e campos de fluxo por destino.
+
+    Células indexadas [j, i] com i ao longo de x e j ao longo de z.
+    """
+
+    def __init__(self, scene, cell=NAV_CELL, clearance=NAV_CLEARANCE):
+        colliders = self.colliders = Colliders(scene)
+        boxes = colliders.boxes
+        lo = boxes[:, :2].min(axis=0) - NAV_MARGIN if len(boxes) else np.full(2, -NAV_MARGIN)
+        hi = boxes[:, 2:].max(axis=0) + NAV_MARGIN if len(boxes) else np.full(2, NAV_MARGIN)
+        self.cell = cell
+        self.origin = lo
+        self.nx, self.nz = (int(v) for v in np.ceil((hi - lo) / cell))
+        # Caixas reais bloqueiam; a faixa alargada só é cara, para que um carro
+        # que comece encostado a um obstáculo consiga sair (真实盒子不可通行；膨胀带只是代价高)
+        self.static = np.zeros((self.nz, self.nx), dtype=bool)
+        inflated = np.zeros((self.nz, self.nx), dtype=bool)
+        door = np.zeros((self.nz, self.nx), dtype=bool)
+        for box, is_door in zip(boxes.tolist(), colliders.is_door.tolist()):
+            if is_door:
+                self._fill(door, box)
+            else:
+                self._fill(self.static, box)
+                self._fill(inflated, box, clearance)
+        self.door = door & ~self.static
+        self.cost = self._wall_cost(inflated)
+        self.goals = {}
+        self._add_goals(scene)
+        self.fields = {}
+
+    def _wall_cost(self, inflated):
+        """
+        每个格子的通行代价：膨胀带内很贵，带外离障碍越近越贵（逐格膨胀求近似距离）。
+        Custo de cada célula: alto dentro da faixa alargada e, fora dela, maior
+        perto dos obstáculos (distância aproximada por dilatações sucessivas);
+        não depende da porta.
+        """
+        steps = max(int(round(NAV_WALL_RANGE / self.cell)), 1)
+        near = np.full(inflated.shape, steps + 1.0)
+        grown = inflated.copy()
+        for r in range(1, steps + 1):
+            padded = np.pad(grown, 1)
+            dilated = grown.copy()
+            for dc, dr, _ in NAV_NEIGHBORS:
+                dilated |= padded[1 + dr:1 + dr + self.nz, 1 + dc:1 + dc + self.nx]
+            near[dilated & ~grown] = r
+            grown = dilated
+        return np.where(inflated, NAV_CLEARANCE_COST, 1.0 + NAV_WALL_COST * (steps + 1.0 - near) / steps)
+
+    def _cells(self, box, pad=0.0):
+        x0, z0, x1, z1 = box
+        ox, oz = self.origin
+        i0 = max(int(math.floor((x0 - pad - ox) / self.cell)), 0)
+        j0 = max(int(math.floor((z0 - pad - oz) / self.cell)), 0)
+        i1 = min(int(math.ceil((x1 + pad - ox) / self.cell)), self.nx)
+        j1 = min(int(math.ceil((z1 + pad - oz) / self.cell)), self.nz)
+        return slice(j0, max(j1, j0)), slice(i0, max(i1, i0))
+
+    def _fill(self, mask, box, pad=0.0):
+        mask[self._cells(box, pad)] = True
+
+    def _add_goals(self, scene):
+        w, h, d, th = GARAGE_DIMS
+        footprints = {}
+        for i in range(len(scene)):
+            rec = scene.records[i]
+            kind = scene.kinds[int(rec["kind"])]
+            m = record_matrix(rec)
+            if kind == "garage":
+                # Lugar dentro da garagem e espera à frente da porta (车库内车位与门前等待区)
+                regions = {"garage": (-w/2 + 1.3, -d + 2.6, w/2 - 1.3, -2.6),
+                           "garage_apron": (-2.5, 2.0, 2.5, 7.0)}
+            elif "house" in kind:
+                zmax = footprints.get(kind)
+                if zmax is None:
+                    zmax = footprints[kind] = float(load_or_bake(SCENE_KINDS[kind]).arrays["positions"][:, 2].max())
+                regions = {"driveway:" + kind: (-2.5, zmax + NAV_DRIVEWAY_GAP, 2.5, zmax + NAV_DRIVEWAY_GAP + 5.0)}
+            else:
+                continue
+            for name, box in regions.items():
+                mask = self.goals.setdefault(name, np.zeros((self.nz, self.nx), dtype=bool))
+                self._fill(mask, _transform_box(m, box))
+        for name in list(self.goals):
+            self.goals[name] &= ~self.static
+            if not self.goals[name].any():
+                del self.goals[name]
+
+    def free(self, door_blocked):
+        return ~(self.static | self.door) if door_blocked else ~self.static
+
+    def _propagate(self, dist, free, heap):
+        """
+        Dijkstra（8 邻接，禁止斜穿角落）；dist 与 free 为扁平列表，原地更新。
+        Dijkstra (8 vizinhos, sem cortar cantos); dist e free são listas planas.
+        """
+        nx, nz = self.nx, self.nz
+        weight = self.cost.ravel().tolist()
+        steps = [(dc + dr * nx, dr, dc, cost) for dc, dr, cost in NAV_NEIGHBORS]
+        heappush, heappop = heapq.heappush, heapq.heappop
+        while heap:
+            d, i = heappop(heap)
+            if d > dist[i]:
+                continue
+            r, c = divmod(i, nx)
+            for off, dr, dc, cost in steps:
+                rr, cc = r + dr, c + dc
+                if rr < 0 or rr >= nz or cc < 0 or cc >= nx:
+                    continue
+                j = i + off
+                if not free[j] or (dr and dc and not (free[i + dr * nx] and free[i + dc])):
+                    continue
+                nd = d + cost * weight[j]
+                if nd < dist[j]:
+                    dist[j] = nd
+                    heappush(heap, (nd, j))
+
+    def _directions(self, dist, free):
+        """
+        每个格子走向距离下降最快的邻居（单位向量 dx, dz；到达或不可达时为 0）。
+        Direção de cada célula para o vizinho que mais reduz a distância.
+        """
+        nz, nx = dist.shape
+        padded = np.pad(dist, 1, constant_values=np.inf)
+        open_ = np.pad(free, 1, constant_values=False)
+        best = np.full(dist.shape, np.inf)
+        dirs = np.zeros((nz, nx, 2), dtype=np.float32)
+        for dc, dr, cost in NAV_NEIGHBORS:
+            cand = padded[1 + dr:1 + dr + nz, 1 + dc:1 + dc + nx] + cost * self.cost
+            if dr and dc:
+                corner = open_[1 + dr:1 + dr + nz, 1:1 + nx] & open_[1:1 + nz, 1 + dc:1 + dc + nx]
+                cand = np.where(corner, cand, np.inf)
+            better = cand < best
+            best[better] = cand[better]
+            dirs[better] = np.array([dc, dr], dtype=np.float32) / math.hypot(dc, dr)
+        dirs[~np.isfinite(dist) | (dist == 0.0) | (best > dist + 1e-6)] = 0.0
+        return dirs
+
+    def field(self, name, door_blocked=True):
+        """
+        取得目的地 name 的流场 (dist, dirs)；按门的状态缓存，开门时增量更新。
+        Campo de fluxo (dist, dirs) do destino 'name', guardado por estado da porta;
+        ao abrir a porta é atualizado de forma incremental.
+        """
+        key = (name, bool(door_blocked))
+        cached = self.fields.get(key)
+        if cached is not None:
+            return cached
+        free = self.free(door_blocked)
+        free_list = free.ravel().tolist()
+        closed = self.fields.get((name, True))
+        # O incremental só compensa para destinos fora da porta: com a porta fechada o campo
+        # de "garage" cobre só o interior selado e teria de propagar o mapa todo de novo.
+        # 只有门外的目的地才值得增量更新：关门时 "garage" 的流场只覆盖封闭的车库内部。
+        if not door_blocked and closed is not None and 2 * np.isfinite(closed[0]).sum() > free.sum():
+            # Só células novas: as distâncias apenas diminuem (只有新增的可通行格子：距离只会减小)
+            dist = closed[0].ravel().tolist()
+            jj, ii = np.nonzero(self.door)
+            seeds = set()
+            for j, i in zip(jj.tolist(), ii.tolist()):
+                for dc, dr, cost in NAV_NEIGHBORS:
+                    if 0 <= j + dr < self.nz and 0 <= i + dc < self.nx:
+                        seeds.add((j + dr) * self.nx + i + dc)
+            heap = [(dist[k], k) for k in seeds if free_list[k] and dist[k] < math.inf]
+        else:
+            goal = self.goals[name] & free
+            dist = [math.inf] * (self.nx * self.nz)
+            heap = [(0.0, k) for k in np.flatnonzero(goal).tolist()]
+            for _, k in heap:
+                dist[k] = 0.0
+        heapq.heapify(heap)
+        self._propagate(dist, free_list, heap)
+        dist = np.array(dist).reshape(self.nz, self.nx)
+        cached = self.fields[key] = (dist, self._directions(dist, free))
+        return cached
+
+    def lookup(self, name, x, z, door_blocked=True):
+        """
+        O(1) 查表：位置 (x, z) 处的前进方向 (N, 2) 与剩余代价 (N,)（单位与距离相同）。
+        Consulta O(1): direção (N, 2) e custo restante (N,) em (x, z), em
+        unidades de distância (inf se o destino não é alcançável).
+        """
+        dist, dirs = self.field(name, door_blocked)
+        i = np.clip(np.floor((np.asarray(x) - self.origin[0]) / self.cell).astype(np.int64), 0, self.nx - 1)
+        j = np.clip(np.floor((np.asarray(z) - self.origin[1]) / self.cell).astype(np.int64), 0, self.nz - 1)
+        return dirs[j, i], dist[j, i] * self.cell
+
+    def actions(self, x, z, yaw, destination="garage", door_height=0.0):
+        """
+        N 辆车的 (throttle, steering) 动作（与 VecDrivingEnv.step 的格式相同）。
+        Ações (throttle, steering) para N carros, no formato de VecDrivingEnv.step:
+        segue o campo de fluxo com o mesmo modelo de bicicleta de move_car.
+        """
+        x, z, yaw = (np.atleast_1d(np.asarray(v, dtype=np.float64)) for v in (x, z, yaw))
+        blocked = np.broadcast_to(np.asarray(door_height, dtype=np.float64), x.shape) < CAR_HEIGHT
+        dirs = np.zeros((len(x), 2))
+        for closed in (True, False):
+            rows = np.flatnonzero(blocked == closed)
+            if not len(rows):
+                continue
+            d, dist = self.lookup(destination, x[rows], z[rows], closed)
+            fallback = NAV_FALLBACK.get(destination)
+            lost = ~np.isfinite(dist)
+            if fallback in self.goals and lost.any():
+                d[lost] = self.lookup(fallback, x[rows[lost]], z[rows[lost]], closed)[0]
+            dirs[rows] = d
+        # O carro anda na direção (-sin yaw, -cos yaw) (车头方向)
+        err = (np.arctan2(-dirs[:, 0], -dirs[:, 1]) - yaw + math.pi) % (2 * math.pi) - math.pi
+        steering = np.clip(np.degrees(err) * NAV_STEER_GAIN / MAX_STEER, -1.0, 1.0)
+        throttle = np.clip(np.cos(err), 0.3, 1.0)
+        # De costas para o caminho: marcha atrás com a direção invertida para virar (背对路径时反打方向倒车掉头)
+        reverse = np.abs(err) > NAV_REVERSE_ANGLE
+        throttle[reverse] = -0.5
+        steering[reverse] *= -1.0
+        moving = dirs.any(axis=1)
+        return np.column_stack([np.where(moving, throttle, 0.0), np.where(moving, steering, 0.0)])
+
+
+def get_navigation():
+    global navigation
+    if navigation is None:
+        navigation = Navigation(scene)
+    return navigation
+
+
+def toggle_autopilot():
+    """
+    切换自动驾驶（首次使用时构建导航网格和流场）。
+    Liga/desliga o piloto automático (constrói a grelha e o campo na primeira vez).
+    """
+    global autopilot
+    if not autopilot:
+        nav = get_navigation()
+        if AUTOPILOT_DESTINATION not in nav.goals:
+            print("autopilot: no destination %r" % AUTOPILOT_DESTINATION)
+            return
+        nav.field(AUTOPILOT_DESTINATION, state.garage_door_height < CAR_HEIGHT)
+    autopilot = not autopilot
+    print("autopilot:", "on" if autopilot else "off")
+
+
+def step_autopilot(s, dt):
+    """
+    模拟 tick：沿流场驾驶主车辆。
+    Tick da simulação: conduz o carro principal pelo campo de fluxo.
+    """
+    global autopilot_backoff
+    if not autopilot or navigation is None:
+        return
+    (throttle, steering), = navigation.actions(s.car_pos[0], s.car_pos[2], s.car_yaw,
+                                               AUTOPILOT_DESTINATION, s.garage_door_height)
+    if autopilot_backoff > 0.0:
+        # Recua com a direção invertida para contornar o obstáculo (反向转向倒车绕开障碍)
+        autopilot_backoff -= dt
+        throttle, steering = -math.copysign(0.5, throttle or 1.0), -steering
+    s.steering_angle = float(steering) * MAX_STEER
+    if not throttle:
+        return
+    # Como DrivingEnv.step: um passo que bate é desfeito; tenta-se a direito e depois
+    # a recuar, e só então o carro fica parado (碰撞则撤销这一步；再试直行、倒车)
+    pos, yaw, wheel = s.car_pos[:], s.car_yaw, s.wheel_rotation
+    for i, (t, steer) in enumerate(((throttle, steering), (throttle, 0.0), (-throttle, 0.0))):
+        s.steering_angle = float(steer) * MAX_STEER
+        move_car(s, float(t) * AUTOPILOT_SPEED * dt)
+        if not navigation.colliders.hit(s.car_pos[0], s.car_pos[2], s.car_yaw, s.garage_door_height):
+            break
+        s.car_pos, s.car_yaw, s.wheel_rotation = pos, yaw, wheel
+    if i > 0:
+        autopilot_backoff = AUTOPILOT_BACKOFF if autopilot_backoff <= 0.0 else 0.0
+
+
+# ============================================================================
+# 27. SHADOWS (阴影)
+# ============================================================================
+
+# Cada luz com sombra tem dois mapas de profundidade: um estático, grande, com
+# a geometria fixa (garagem, casas, árvores, rochas), que só é redesenhado
+# quando a chave da luz muda (posição da luz, noite/dia, porta da garagem,
+# centro da região, blocos carregados); e um dinâmico, pequeno, ajustado ao
+# carro e redesenhado a cada frame só com o carro. O pipeline fixo não tem
+# forma de escurecer só a luz sem estragar o alfa, por isso a sombra é aplicada
+# num único pass em espaço de ecrã: a posição de cada pixel é reconstruída do
+# buffer de profundidade, testada contra os dois mapas (mínimo = composição) e
+# a cor do frame é multiplicada pelo fator de sombra. O custo por frame é o
+# carro num mapa pequeno mais um quad de ecrã inteiro, não um segundo
+# desenho da cena.
+# 每个投影光源有两张深度图：静态图（大）只包含固定几何体，只在光源键变化时重画（光源位置、昼夜、车库门、
+# 区域中心、已加载地块）；动态图（小）贴合汽车，每帧只画汽车。固定管线无法只让光照变暗而不破坏 alpha，
+# 所以阴影在一个屏幕空间 pass 中施加：由深度缓冲重建像素位置，对两张图取最小值（合成），再把帧颜色乘以阴影系数。
+
+# Posição da luz (como em setup_lights) para o estado 's' (各光源在状态 s 下的位置)
+def sun_light(s):
+    return moon_pos if s.is_night else light0_pos
+
+
+def lamp_light(s):
+    return light1_pos
+
+
+SHADOW_LIGHT_POSITIONS = {"sun": sun_light, "lamp": lamp_light}
+# A luz da garagem só ilumina o carro quando está lá dentro (车库灯只在车在库内时照亮汽车)
+SHADOW_LIGHT_ACTIVE = {"sun": lambda s: True, "lamp": lambda s: s.car_in_garage}
+SHADOW_DISTANCE = 100.0         # distância do olho das luzes direcionais (方向光的视点距离)
+# Clip [-1, 1] -> coordenadas de textura [0, 1] (vetores linha) (裁剪空间到纹理坐标)
+SHADOW_BIAS_MATRIX = np.array([[0.5, 0, 0, 0], [0, 0.5, 0, 0], [0, 0, 0.5, 0], [0.5, 0.5, 0.5, 1.0]])
+
+SHADOW_VERTEX_SHADER = """
+#version 120
+void main() {
+    gl_Position = gl_Vertex;
+}
+"""
+
+SHADOW_FRAGMENT_SHADER = """
+#version 120
+uniform sampler2D scene_depth;
+uniform sampler2DShadow maps[%(maps)d];
+uniform mat4 shadow_matrices[%(maps)d];
+uniform float strength[%(lights)d];
+uniform mat4 inverse_view_projection;
+uniform vec4 viewport;
+
+float lit(sampler2DShadow map, mat4 m, vec4 p) {
+    vec4 c = m * p;
+    if (c.w <= 0.0) return 1.0;
+    vec3 t = c.xyz / c.w;
+    if (any(lessThan(t.xy, vec2(0.0))) || any(greaterThan(t.xy, vec2(1.0)))) return 1.0;
+    // Receptores para lá do plano far ficam atrás de tudo o que o mapa tem
+    return shadow2D(map, vec3(t.xy, min(t.z, 1.0))).r;
+}
+
+void main() {
+    vec2 uv = (gl_FragCoord.xy - viewport.xy) / viewport.zw;
+    float depth = texture2D(scene_depth, uv).r;
+    if (depth >= 1.0) discard;
+    vec4 p = inverse_view_projection * vec4(vec3(uv, depth) * 2.0 - 1.0, 1.0);
+    p /= p.w;
+    float f = 1.0;
+%(terms)s
+    gl_FragColor = vec4(f, f, f, 1.0);
+}
+"""
+
+SHADOW_TERM = ("    if (strength[%(i)d] > 0.0)\n"
+               "        f *= 1.0 - strength[%(i)d] * (1.0 - min(lit(maps[%(s)d], shadow_matrices[%(s)d], p),"
+               " lit(maps[%(d)d], shadow_matrices[%(d)d], p)));")
+
+
+def compile_program(vertex, fragment):
+    """
+    编译并链接 GLSL 程序，失败时抛出 RuntimeError（附日志）。
+    Compila e liga um programa GLSL; RuntimeError com o log em caso de erro.
+    """
+    program = glCreateProgram()
+    for kind, source in ((GL_VERTEX_SHADER, vertex), (GL_FRAGMENT_SHADER, fragment)):
+        shader = glCreateShader(kind)
+        glShaderSource(shader, source)
+        glCompileShader(shader)
+        if not glGetShaderiv(shader, GL_COMPILE_STATUS):
+            log = glGetShaderInfoLog(shader)
+            glDeleteShader(shader)
+            glDeleteProgram(program)
+            raise RuntimeError("shader compile failed: %s" % log)
+        glAttachShader(program, shader)
+        glDeleteShader(shader)
+    glLinkProgram(program)
+    if not glGetProgramiv(program, GL_LINK_STATUS):
+        log = glGetProgramInfoLog(program)
+        glDeleteProgram(program)
+        raise RuntimeError("shader link failed: %s" % log)
+    return program
+
+
+class ShadowMap(OffscreenTarget):
+    """
+    只有深度纹理的帧缓冲（硬件比较；GL_LINEAR 给出 2x2 PCF）。
+    Framebuffer só com uma textura de profundidade (comparação em hardware;
+    GL_LINEAR dá PCF 2x2).
+    """
+
+    def __init__(self, size):
+        self.width = self.height = size
+        self.texture = True
+        self.color = None
+        self.depth = glGenTextures(1)
+        glBindTexture(GL_TEXTURE_2D, self.depth)
+        glTexImage2D(GL_TEXTURE_2D, 0, GL_DEPTH_COMPONENT24, size, size, 0, GL_DEPTH_COMPONENT, GL_FLOAT, None)
+        glTexParameteri(GL_TEXTURE_2D, GL_TEXTURE_MIN_FILTER, GL_LINEAR)
+        glTexParameteri(GL_TEXTURE_2D, GL_TEXTURE_MAG_FILTER, GL_LINEAR)
+        glTexParameteri(GL_TEXTURE_2D, GL_TEXTURE_WRAP_S, GL_CLAMP_TO_EDGE)
+        glTexParameteri(GL_TEXTURE_2D, GL_TEXTURE_WRAP_T, GL_CLAMP_TO_EDGE)
+        glTexParameteri(GL_TEXTURE_2D, GL_TEXTURE_COMPARE_MODE, GL_COMPARE_REF_TO_TEXTURE)
+        glTexParameteri(GL_TEXTURE_2D, GL_TEXTURE_COMPARE_FUNC, GL_LEQUAL)
+        glBindTexture(GL_TEXTURE_2D, 0)
+        previous = int(glGetIntegerv(GL_FRAMEBUFFER_BINDING))
+        self.fbo = glGenFramebuffers(1)
+        glBindFramebuffer(GL_FRAMEBUFFER, self.fbo)
+        glFramebufferTexture2D(GL_FRAMEBUFFER, GL_DEPTH_ATTACHMENT, GL_TEXTURE_2D, self.depth, 0)
+        glDrawBuffer(GL_NONE)
+        glReadBuffer(GL_NONE)
+        status = glCheckFramebufferStatus(GL_FRAMEBUFFER)
+        glBindFramebuffer(GL_FRAMEBUFFER, previous)
+        if status != GL_FRAMEBUFFER_COMPLETE:
+            self.release()
+            raise RuntimeError("incomplete framebuffer: 0x%x" % status)
+        self.viewport = None
+        self.previous = 0
+
+    def release(self):
+        glDeleteTextures([self.depth])
+        glDeleteFramebuffers(1, [self.fbo])
+
+
+class ShadowLight:
+    """
+    一个投影光源：缓存的静态深度图 + 每帧的汽车动态深度图。
+    Uma luz com sombra: mapa estático em cache + mapa dinâmico do carro por frame.
+
+    Durante o desenho dos mapas é a active_view (culling pelo frustum da luz,
+    sem impostores).
+    """
+
+    def __init__(self, name, static_size, dynamic_size, extent, snap=None, near=1.0,
+                 strength=0.5, night_strength=None):
+        self.name = name
+        self.static_size, self.dynamic_size = static_size, dynamic_size
+        self.extent = extent
+        self.snap = snap
+        self.near = near
+        self.strength = strength
+        self.night_strength = strength if night_strength is None else night_strength
+        self.impostor_distance = math.inf
+        self.static_map = None
+        self.dynamic_map = None
+        self.matrices = [np.eye(4), np.eye(4)]
+        self.key = None
+        self.planes = None
+        self.static_renders = 0
+
+    def cull(self, scene):
+        return sphere_mask(self.planes, scene.records["position"], scene_radii(scene))
+
+    def center(self, s):
+        """
+        静态图覆盖区域的中心：固定光源取光源正下方，否则按 snap 对齐到汽车附近。
+        Centro da região do mapa estático: por baixo da luz, ou junto ao carro
+        arredondado a 'snap' (para não redesenhar a cada passo).
+        """
+        if self.snap is None:
+            pos = SHADOW_LIGHT_POSITIONS[self.name](s)
+            return (float(pos[0]), 0.0, float(pos[2]))
+        return (round(s.car_pos[0] / self.snap) * self.snap, 0.0, round(s.car_pos[2] / self.snap) * self.snap)
+
+    def _look(self, pos, center, radius, fit):
+        """
+        设置光源的投影与视图矩阵；fit="ground" 覆盖地面区域，"sphere" 贴合包围球。
+        Define as matrizes da luz; fit="ground" cobre uma região do chão,
+        fit="sphere" ajusta-se a uma esfera envolvente. Devolve o olho.
+        """
+        center = np.asarray(center, dtype=np.float64)
+        glMatrixMode(GL_PROJECTION)
+        glLoadIdentity()
+        if pos[3] == 0.0:
+            direction = np.asarray(pos[:3], dtype=np.float64)
+            direction /= np.linalg.norm(direction)
+            eye = center + direction * SHADOW_DISTANCE
+            near = SHADOW_DISTANCE - radius if fit == "sphere" else 1.0
+            glOrtho(-radius, radius, -radius, radius, near, SHADOW_DISTANCE + radius)
+        else:
+            eye = np.asarray(pos[:3], dtype=np.float64)
+            direction = eye - center
+            dist = float(np.linalg.norm(direction))
+            if fit == "sphere":
+                fov = 2.0 * math.degrees(math.asin(min(radius / dist, 0.99)))
+                gluPerspective(fov, 1.0, max(dist - radius, self.near), dist + radius)
+            else:
+                fov = 2.0 * math.degrees(math.atan(radius / dist))
+                gluPerspective(fov, 1.0, self.near, dist + 2.0 * radius)
+            direction /= dist
+        glMatrixMode(GL_MODELVIEW)
+        glLoadIdentity()
+        up = (0.0, 0.0, -1.0) if abs(direction[1]) > 0.99 else (0.0, 1.0, 0.0)
+        gluLookAt(*eye, *center, *up)
+        return tuple(eye)
+
+    def _render(self, target, pos, center, radius, fit, draw):
+        global camera_eye, active_view
+        target.bind()
+        glClear(GL_DEPTH_BUFFER_BIT)
+        eye = self._look(pos, center, radius, fit)
+        mv = np.array(glGetFloatv(GL_MODELVIEW_MATRIX), dtype=np.float64).reshape(4, 4)
+        proj = np.array(glGetFloatv(GL_PROJECTION_MATRIX), dtype=np.float64).reshape(4, 4)
+        self.planes = frustum_planes()
+        saved, camera_eye, active_view = camera_eye, eye, self
+        try:
+            draw()
+        finally:
+            camera_eye, active_view = saved, None
+            target.unbind()
+        return mv @ proj @ SHADOW_BIAS_MATRIX
+
+    def update_static(self, s):
+        """
+        光源或场景变化时重画静态深度图；返回是否重画。
+        Redesenha o mapa estático se a luz ou a cena mudaram; devolve se redesenhou.
+        """
+        pos = [float(v) for v in SHADOW_LIGHT_POSITIONS[self.name](s)]
+        center = self.center(s)
+        key = (tuple(pos), center, round(s.garage_door_height, 2), id(scene),
+               tuple(sorted(world.tiles)) if world is not None else None)
+        if key == self.key and self.static_map is not None:
+            return False
+        if self.static_map is None:
+            self.static_map = ShadowMap(self.static_size)
+
+        def draw():
+            if world is not None:
+                world.draw()
+            else:
+                draw_scene_objects(scene)
+
+        self.matrices[0] = self._render(self.static_map, pos, center, self.extent, "ground", draw)
+        self.key = key
+        self.static_renders += 1
+        return True
+
+    def update_dynamic(self, s):
+        """
+        每帧把汽车画进贴合它的小深度图。
+        Desenha o carro no mapa dinâmico (pequeno, ajustado ao carro), a cada frame.
+        """
+        if self.dynamic_map is None:
+            self.dynamic_map = ShadowMap(self.dynamic_size)
+        pos = [float(v) for v in SHADOW_LIGHT_POSITIONS[self.name](s)]
+        center = (s.car_pos[0], 0.7, s.car_pos[2])
+        self.matrices[1] = self._render(self.dynamic_map, pos, center, SHADOW_CAR_RADIUS, "sphere",
+                                        draw_complete_car)
+
+    def release(self):
+        for target in (self.static_map, self.dynamic_map):
+            if target is not None:
+                target.release()
+        self.static_map = self.dynamic_map = None
+        self.key = None
+
+
+class Shadows:
+    """
+    所有投影光源与屏幕空间阴影 pass。
+    Todas as luzes com sombra e o pass de sombra em espaço de ecrã.
+    """
+
+    def __init__(self, config=None):
+        config = SHADOW_LIGHTS if config is None else config
+        self.lights = [ShadowLight(name, **cfg) for name, cfg in config.items()]
+        count = len(self.lights)
+        terms = "\n".join(SHADOW_TERM % {"i": i, "s": 2 * i, "d": 2 * i + 1} for i in range(count))
+        self.program = compile_program(SHADOW_VERTEX_SHADER, SHADOW_FRAGMENT_SHADER %
+                                       {"maps": 2 * count, "lights": count, "terms": terms})
+        self.locations = {name: glGetUniformLocation(self.program, name)
+                          for name in ("scene_depth", "maps", "shadow_matrices", "strength",
+                                       "inverse_view_projection", "viewport")}
+        # Unidade 0: profundidade do ecrã; 1..: mapas de sombra (纹理单元 0 为屏幕深度，其后为阴影图)
+        glUseProgram(self.program)
+        glUniform1i(self.locations["scene_depth"], 0)
+        glUniform1iv(self.locations["maps"], 2 * count, np.arange(1, 2 * count + 1, dtype=np.int32))
+        glUseProgram(0)
+        self.depth = None
+        self.depth_size = None
+
+    def render(self, s):
+        """
+        更新阴影图并把阴影乘到当前帧上（在不透明物体之后调用）。
+        Atualiza os mapas e multiplica a sombra no frame atual (depois dos objetos opacos).
+        """
+        active = [light for light in self.lights if SHADOW_LIGHT_ACTIVE[light.name](s)]
+        if not active:
+            return
+        mv = np.array(glGetFloatv(GL_MODELVIEW_MATRIX), dtype=np.float64).reshape(4, 4)
+        proj = np.array(glGetFloatv(GL_PROJECTION_MATRIX), dtype=np.float64).reshape(4, 4)
+        try:
+            inverse = np.linalg.inv(mv @ proj)
+        except np.linalg.LinAlgError:
+            return      # vista degenerada: sem sombras neste frame (退化视图：本帧不画阴影)
+        # Como em render_due: sem scissor, com polygon offset contra "shadow acne" (关闭裁剪，开启多边形偏移)
+        glPushAttrib(GL_ENABLE_BIT | GL_SCISSOR_BIT | GL_POLYGON_BIT | GL_CURRENT_BIT)
+        glDisable(GL_SCISSOR_TEST)
+        glEnable(GL_POLYGON_OFFSET_FILL)
+        glPolygonOffset(*SHADOW_POLYGON_OFFSET)
+        glMatrixMode(GL_PROJECTION)
+        glPushMatrix()
+        glMatrixMode(GL_MODELVIEW)
+        glPushMatrix()
+        for light in active:
+            light.update_static(s)
+            light.update_dynamic(s)
+        glMatrixMode(GL_PROJECTION)
+        glPopMatrix()
+        glMatrixMode(GL_MODELVIEW)
+        glPopMatrix()
+        glPopAttrib()
+        self.apply(s, inverse, active)
+
+    def apply(self, s, inverse, active):
+        x, y, w, h = (int(v) for v in glGetIntegerv(GL_VIEWPORT))
+        glPushAttrib(GL_ENABLE_BIT | GL_COLOR_BUFFER_BIT | GL_DEPTH_BUFFER_BIT | GL_TEXTURE_BIT)
+        glActiveTexture(GL_TEXTURE0)
+        if self.depth is None:
+            self.depth = glGenTextures(1)
+        glBindTexture(GL_TEXTURE_2D, self.depth)
+        if self.depth_size != (w, h):
+            glTexImage2D(GL_TEXTURE_2D, 0, GL_DEPTH_COMPONENT24, w, h, 0, GL_DEPTH_COMPONENT, GL_FLOAT, None)
+            glTexParameteri(GL_TEXTURE_2D, GL_TEXTURE_MIN_FILTER, GL_NEAREST)
+            glTexParameteri(GL_TEXTURE_2D, GL_TEXTURE_MAG_FILTER, GL_NEAREST)
+            self.depth_size = (w, h)
+        glCopyTexSubImage2D(GL_TEXTURE_2D, 0, 0, 0, x, y, w, h)
+
+        strength = np.zeros(len(self.lights), dtype=np.float32)
+        matrices = np.tile(np.eye(4, dtype=np.float32), (2 * len(self.lights), 1, 1))
+        for i, light in enumerate(self.lights):
+            if light in active:
+                strength[i] = light.night_strength if s.is_night else light.strength
+                matrices[2 * i:2 * i + 2] = light.matrices
+            for j, target in enumerate((light.static_map, light.dynamic_map)):
+                glActiveTexture(GL_TEXTURE1 + 2 * i + j)
+                glBindTexture(GL_TEXTURE_2D, target.depth if target is not None else 0)
+
+        glUseProgram(self.program)
+        glUniform1fv(self.locations["strength"], len(strength), strength)
+        glUniformMatrix4fv(self.locations["shadow_matrices"], len(matrices), GL_FALSE, matrices)
+        glUniformMatrix4fv(self.locations["inverse_view_projection"], 1, GL_FALSE, inverse.astype(np.float32))
+        glUniform4f(self.locations["viewport"], x, y, w, h)
+        glDisable(GL_DEPTH_TEST)
+        glDepthMask(GL_FALSE)
+        glDisable(GL_LIGHTING)
+        glEnable(GL_BLEND)
+        glBlendFunc(GL_ZERO, GL_SRC_COLOR)
+        glBegin(GL_QUADS)
+        glVertex2f(-1, -1); glVertex2f(1, -1); glVertex2f(1, 1); glVertex2f(-1, 1)
+        glEnd()
+        glUseProgram(0)
+        for unit in range(2 * len(self.lights), -1, -1):
+            glActiveTexture(GL_TEXTURE0 + unit)
+            glBindTexture(GL_TEXTURE_2D, 0)
+        glPopAttrib()
+
+    def release(self):
+        for light in self.lights:
+            light.release()
+        if self.depth is not None:
+            glDeleteTextures([self.depth])
+            self.depth = None
+        glDeleteProgram(self.program)
+
+
+def init_shadows():
+    """
+    创建阴影（需要 FBO、深度纹理与 GLSL；不支持时返回 None）。
+    Cria as sombras (requer FBO, texturas de profundidade e GLSL); None se não houver suporte.
+    """
+    if not bool(glGenFramebuffers) or not bool(glCreateShader):
+        return None
+    try:
+        return Shadows()
+    except RuntimeError as e:
+        print("shadows disabled:", e)
+        return None
+
+
+# ============================================================================
+# 28. ANIMATION (动画)
+# ============================================================================
+
+# As portas andam por trilhas de keyframes avançadas a cada tick da simulação
+# (step_door); o resultado fica nos canais do estado (car_door_angle,
+# garage_door_height), que o SimulationThread já interpola entre ticks. A
+# partir desses canais a paleta calcula uma matriz local por peça animada
+# (portas, volante, rodas, porta da garagem), uma só vez por estado, e cada
+# peça é desenhada com um glMultMatrixf sobre a sua malha em cache. A porta da
+# garagem é uma malha por número de ripas visíveis (no máximo GARAGE_SLATS + 1).
+# 门沿关键帧轨道运动；调色板为每个动画部件计算一个矩阵，部件只需上传一个矩阵并绘制缓存网格。
+
+class AnimationTrack:
+    """
+    关键帧轨道：时间上线性插值；数值单调递增，因此可以由数值反推时间。
+    Trilha de keyframes com interpolação linear no tempo. Os valores são crescentes,
+    por isso o tempo recupera-se do valor e um estado definido à mão (comando remoto) continua a animar.
+    """
+
+    def __init__(self, keys):
+        self.times, self.values = (np.array(col, dtype=np.float64) for col in zip(*keys))
+        if np.any(np.diff(self.times) <= 0) or np.any(np.diff(self.values) <= 0):
+            raise ValueError("keyframes must increase in time and value")
+        self.start, self.end = float(self.values[0]), float(self.values[-1])
+        self.duration = float(self.times[-1] - self.times[0])
+
+    def sample(self, t):
+        return float(np.interp(t, self.times, self.values))
+
+    def time_of(self, value):
+        return float(np.interp(value, self.values, self.times))
+
+    def advance(self, value, target, dt):
+        """
+        沿轨道向目标推进 dt 秒（可反向播放）。
+        Avança dt segundos ao longo da trilha em direção ao alvo (toca ao contrário se preciso).
+        """
+        target = min(max(target, self.start), self.end)
+        t, goal = self.time_of(value), self.time_of(target)
+        if abs(goal - t) <= dt:
+            return target
+        return self.sample(t + math.copysign(dt, goal - t))
+
+    def advance_many(self, values, targets, dt):
+        """
+        advance 的批量版本（数组，用于 VecDrivingEnv）。
+        Versão em lote de advance, sobre arrays (usada por VecDrivingEnv).
+        """
+        targets = np.clip(targets, self.start, self.end)
+        t = np.interp(values, self.values, self.times)
+        goal = np.interp(targets, self.values, self.times)
+        moved = np.interp(t + np.clip(goal - t, -dt, dt), self.times, self.values)
+        return np.where(np.abs(goal - t) <= dt, targets, moved)
+
+
+animation_tracks = {name: AnimationTrack(keys) for name, keys in ANIMATION_TRACKS.items()}
+
+ANIMATION_PARTS = ("door_left", "door_right", "steering_wheel",
+                   "wheel_front_left", "wheel_front_right", "wheel_rear_left", "wheel_rear_right",
+                   "garage_door")
+
+
+def _translation_matrix(x, y, z):
+    m = np.identity(4)
+    m[:3, 3] = (x, y, z)
+    return m
+
+
+class AnimationPalette:
+    """
+    动画部件的变换调色板：每个部件一个 4x4 矩阵（按 glMultMatrixf 的列主序存放）。
+    Paleta de transformações das peças animadas: uma matriz 4x4 por peça, já na ordem
+    de colunas do glMultMatrixf, relativa ao pai (carro ou garagem).
+    """
+
+    def __init__(self):
+        self.index = {name: i for i, name in enumerate(ANIMATION_PARTS)}
+        self.matrices = np.tile(np.identity(4, dtype=np.float32), (len(ANIMATION_PARTS), 1, 1))
+        self.visible = np.ones(len(ANIMATION_PARTS), dtype=bool)
+        self.garage_slats = GARAGE_SLATS
+        self.key = None
+        self.evaluations = 0
+
+    def _set(self, name, *transforms):
+        m = np.identity(4)
+        for t in transforms:
+            m = m @ t
+        self.matrices[self.index[name]] = m.T
+
+    def evaluate(self, s):
+        """
+        由状态计算整块调色板；状态没变时不做任何事。
+        Calcula a paleta inteira a partir do estado; não faz nada se os canais não mudaram.
+        """
+        key = (s.car_door_angle, s.steering_angle, s.wheel_rotation, s.garage_door_height)
+        if key == self.key:
+            return
+        self.key = key
+        self.evaluations += 1
+        angle, steer, spin, height = key
+
+        # [REQ 2] Portas: dobradiça em z=-0.9, ângulo de car_door_angle. 车门铰链与开门角度
+        self._set("door_left", _translation_matrix(-0.95, 0, -0.9), _rotation_matrix(-angle, 0, 1, 0))
+        self._set("door_right", _translation_matrix(0.95, 0, -0.9), _rotation_matrix(angle, 0, 1, 0))
+
+        # [REQ 3] Volante: para rodar mais/menos, mude o multiplicador '1.5'. 改变方向盘旋转幅度，修改 1.5。
+        self._set("steering_wheel", _translation_matrix(-0.45, 0.55, -0.50),
+                  _rotation_matrix(20, 1, 0, 0), _rotation_matrix(steer * 1.5, 0, 0, 1))
+
+        # [REQ 4] Rodas giram ao deslocar; as traseiras, maiores, giram mais devagar. 车轮转速
+        spin_axis = _rotation_matrix(90, 0, 1, 0)
+        rear_spin = spin * (0.33 / 0.55)
+        for side, sign in (("left", -1), ("right", 1)):
+            self._set("wheel_front_" + side, _translation_matrix(sign * 1.0, 0.0, -1.3),
+                      _rotation_matrix(steer, 0, 1, 0), _rotation_matrix(-spin, 1, 0, 0), spin_axis)
+            self._set("wheel_rear_" + side, _translation_matrix(sign * 1.05, 0.15, 1.2),
+                      _rotation_matrix(-rear_spin, 1, 0, 0), spin_axis)
+
+        # [REQ 5] Porta da garagem: sobe com garage_door_height; as ripas acima do vão somem.
+        w, h, d, th = GARAGE_DIMS
+        self.garage_slats = int(np.count_nonzero(np.arange(GARAGE_SLATS) * (h / GARAGE_SLATS) + height < h))
+        self._set("garage_door", _translation_matrix(0, height, 0))
+        self.visible[self.index["garage_door"]] = self.garage_slats > 0
+
+    def draw(self, name, fn, *args):
+        """
+        用调色板矩阵绘制一个缓存网格。
+        Desenha uma malha em cache com a matriz da paleta (um glMultMatrixf por peça).
+        """
+        i = self.index[name]
+        if not self.visible[i]:
+            return
+        glPushMatrix()
+        glMultMatrixf(self.matrices[i])
+        draw_cached(fn, *args)
+        glPopMatrix()
+
+
+def get_animation():
+    """
+    返回动画调色板；首次创建时按当前状态计算（供 render_frame 之外的烘焙与阴影使用）。
+    Devolve a paleta de animação; ao ser criada é logo calculada com o estado atual
+    (para bakes e sombras desenhados fora de render_frame).
+    """
+    global animation
+    if animation is None:
+        animation = AnimationPalette()
+        animation.evaluate(state)
+    return animation
+
+
+if __name__ == "__main__":
+    if len(sys.argv) == 3 and sys.argv[1] == "--batch":
+        # jobs.json: {"replay": ..., "output": ..., "jobs": [...], "fps": ..., "fmt": ...}
+        with open(sys.argv[2]) as f:
+            render_batch(**json.load(f))
+        sys.exit(0)
+    if len(sys.argv) == 2 and sys.argv[1] == "--telemetry-standin":
+        run_telemetry_standin()
+        sys.exit(0)
+    if len(sys.argv) in (2, 3) and sys.argv[1] == "--benchmark":
+        run_benchmark(*[int(a) for a in sys.argv[2:]])
+        sys.exit(0)
+
+    with startup.phase("window"):
+        glutInit(sys.argv)
+        glutInitDisplayMode(GLUT_DOUBLE | GLUT_RGB | GLUT_DEPTH)
+        glutInitWindowSize(800, 600)
+        glutCreateWindow(b"Final Project")
     
     init()
+    startup.defer("services", start_services)
     
     glutDisplayFunc(draw_scene)
     glutKeyboardFunc(keyboard)
@@ -1285,7 +7125,10 @@ if __name__ == "__main__":
     print(" [O]       Open Door       | [O]     Abrir Porta")
     print(" [G]       Open Garage     | [G]     Abrir Garagem")
     print(" [F]       Close Garage    | [F]     Fechar Garagem")
+    print(" [M]       Map Overlay     | [M]     Mapa")
     print(" [SPACE]   Reset Steering  | [ESPAÇO] Resetar Direção")
+    print(" [R]       Record Frames   | [R]     Gravar Frames")
+    print(" [L]       Record Replay   | [L]     Gravar Replay")
     print(" [MOUSE]   Rotate View     | [MOUSE] Girar Visão")
     print(" [SCROLL]  Zoom            | [SCROLL] Zoom")
     print("="*60)